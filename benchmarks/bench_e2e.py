@@ -0,0 +1,97 @@
+# Runs dict2anki end to end against the fake Cambridge server and reports throughput and latency.
+#
+#   python benchmarks/bench_e2e.py -n 1000 --latency 0.05 --throttle 0.01
+#   python benchmarks/bench_e2e.py -n 1000 -- --concurrency 16
+#
+# Options after '--' are passed to dict2anki. Requests are not rate-limited unless --rate is passed there.
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_cambridge import add_arguments, from_args  # noqa: E402
+from dict2anki import cli  # noqa: E402
+from dict2anki.extractors.cambridge import CambridgeExtractor  # noqa: E402
+from dict2anki.journal import Journal  # noqa: E402
+
+DEFAULT_WORDS = 500
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def run(count: int, fake, cli_args: List[str]) -> dict:
+    latencies = []
+    fetch_async = CambridgeExtractor.fetch_async
+
+    async def timed_fetch_async(self, word):
+        start = time.perf_counter()
+        try:
+            return await fetch_async(self, word)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    CambridgeExtractor.fetch_async = timed_fetch_async
+    with tempfile.TemporaryDirectory() as d, fake:
+        input_file = os.path.join(d, 'words.txt')
+        with open(input_file, 'w', encoding='utf8') as f:
+            f.write('\n'.join('word{}'.format(i) for i in range(count)))
+        sys.argv = ['dict2anki', '-i', input_file, '-o', d, '--rate', '0'] + cli_args
+        start = time.perf_counter()
+        try:
+            cli.main()
+        finally:
+            CambridgeExtractor.fetch_async = fetch_async
+        elapsed = time.perf_counter() - start
+        journal = os.path.join(cli.output_path, 'cards.journal')
+        statuses = Counter(status for status, _, _, _ in Journal.entries(journal))
+    return {
+        'words': count,
+        'cards': statuses['C'],
+        'journal': dict(statuses),
+        'seconds': elapsed,
+        'words_per_second': count / elapsed,
+        'latency_ms': {
+            'p50': percentile(latencies, 50) * 1000,
+            'p90': percentile(latencies, 90) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'max': max(latencies, default=float('nan')) * 1000,
+        },
+        'server': {str(k): v for k, v in fake.counts.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark dict2anki against a fake Cambridge server')
+    parser.add_argument('-n', '--words', metavar='N', type=int, default=DEFAULT_WORDS,
+                        help='words to look up, default: %(default)s')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write results as JSON to FILE')
+    add_arguments(parser)
+    parser.add_argument('cli_args', nargs=argparse.REMAINDER, help='options passed to dict2anki after --')
+    args = parser.parse_args()
+    cli_args = args.cli_args[1:] if args.cli_args[:1] == ['--'] else args.cli_args
+
+    result = run(args.words, from_args(args), cli_args)
+    print()
+    print('{words} words, {cards} cards in {seconds:.2f}s, {words_per_second:.1f} words/s'.format(**result))
+    print('latency: p50={p50:.1f}ms p90={p90:.1f}ms p99={p99:.1f}ms max={max:.1f}ms'.format(**result['latency_ms']))
+    print('journal: {}, server: {}'.format(result['journal'], result['server']))
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
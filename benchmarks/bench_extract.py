@@ -0,0 +1,144 @@
+# Benchmarks the HTML parsing on the corpus, without network.
+#
+#   python benchmarks/bench_extract.py -o results.json
+#   python benchmarks/bench_extract.py --compare benchmarks/baseline.json
+#
+# For each page and function, reports the median and minimum time per call, the peak memory allocated during a
+# call and the memory blocks still held by its result. Exits with 1 if compared results regress beyond the
+# threshold. Times depend on the machine, so compare against a baseline recorded on the same one.
+import argparse
+import gc
+import glob
+import gzip
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dict2anki import htmls  # noqa: E402
+from dict2anki.extractors.cambridge import CambridgeExtractor, REWRITER  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+DEFAULT_REPEAT = 20
+
+DEFAULT_THRESHOLD = 0.2
+
+
+def load_corpus(corpus_dir: str) -> Dict[str, str]:
+    corpus = {}
+    for file in sorted(glob.glob(os.path.join(corpus_dir, '*.html.gz'))):
+        with gzip.open(file, 'rt', encoding='utf8') as f:
+            corpus[os.path.basename(file)[:-len('.html.gz')]] = f.read()
+    return corpus
+
+
+def back_of(page: str) -> str:
+    doc = htmls.Document(page)
+    return REWRITER.apply(page, *doc.find('div', 'class="di-body"'))
+
+
+def cases(page: str) -> Dict[str, Callable[[], object]]:
+    back = back_of(page)
+    return {
+        'find_positions': lambda: list(htmls.find_positions(page, 'div', 'def-block ddef_block')),
+        'sub': lambda: htmls.sub(page, lambda h: h, 'div', 'def-block ddef_block'),
+        '_extract_fields': lambda: CambridgeExtractor._extract_fields(page),
+        '_collapse': lambda: CambridgeExtractor._collapse(back),
+    }
+
+
+def measure(func: Callable[[], object], repeat: int) -> Dict[str, float]:
+    # warm up caches, e.g. compiled patterns
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    retained = sys.getallocatedblocks() - blocks
+    del result
+    return {
+        'median_ms': statistics.median(times) * 1000,
+        'min_ms': min(times) * 1000,
+        'peak_kib': peak / 1024,
+        'retained_blocks': retained,
+    }
+
+
+def run(corpus: Dict[str, str], repeat: int, only: List[str] = None) -> dict:
+    results = {}
+    for name, page in corpus.items():
+        for case, func in cases(page).items():
+            if only and case not in only:
+                continue
+            key = '{}/{}'.format(case, name)
+            results[key] = dict(measure(func, repeat), page_kib=len(page.encode('utf8')) / 1024)
+            print('{:<32} {median_ms:10.3f} ms {min_ms:10.3f} ms {peak_kib:10.1f} KiB {retained_blocks:8d} blocks'
+                  .format(key, **results[key]))
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    for key, result in current['results'].items():
+        base = baseline['results'].get(key)
+        if not base:
+            continue
+        for metric in ('median_ms', 'peak_kib'):
+            if base[metric] > 0 and result[metric] > base[metric] * (1 + threshold):
+                regressions.append('{} {}: {:.3f} -> {:.3f} (+{:.0%})'.format(
+                    key, metric, base[metric], result[metric], result[metric] / base[metric] - 1))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark HTML parsing on the corpus')
+    parser.add_argument('--corpus', metavar='DIR', default=CORPUS_DIR, help='pages to parse, default: %(default)s')
+    parser.add_argument('-n', '--repeat', metavar='N', type=int, default=DEFAULT_REPEAT,
+                        help='calls timed for each page, default: %(default)s')
+    parser.add_argument('-k', '--case', metavar='NAME', action='append',
+                        help='only run NAME, can be repeated')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write results as JSON to FILE')
+    parser.add_argument('--compare', metavar='FILE', help='compare with baseline results in FILE')
+    parser.add_argument('--threshold', metavar='RATIO', type=float, default=DEFAULT_THRESHOLD,
+                        help='flag results slower or larger than baseline by RATIO, default: %(default)s')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        parser.error('no pages in {}'.format(args.corpus))
+    results = run(corpus, args.repeat, args.case)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if args.compare:
+        with open(args.compare, encoding='utf8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print('REGRESSION {}'.format(regression))
+        if regressions:
+            sys.exit(1)
+        print('no regressions beyond {:.0%}'.format(args.threshold))
+
+
+if __name__ == '__main__':
+    main()
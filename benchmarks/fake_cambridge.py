@@ -0,0 +1,241 @@
+# A local stand-in for the Cambridge endpoints, serving corpus pages.
+#
+#   python benchmarks/fake_cambridge.py --port 8000 --latency 0.05 --throttle 0.02
+#
+# Queries are redirected to the normalized entry like the real site, pronunciations are served as fake audio, and
+# faults are injected at random with a fixed seed: 404s, 429s with Retry-After, truncated bodies and connection resets.
+import argparse
+import glob
+import gzip
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dict2anki.extractors import cambridge  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+PATH_QUERY = '/zhs/query/'
+
+PATH_ENTRY = '/zhs/dictionary/'
+
+PATH_MEDIA = '/zhs/media/'
+
+STYLE = b'.cdo-search{color:#fff}@font-face{font-family:cdoicons;src:url(/zhs/external/fonts/cdoicons.woff)}' \
+        b'.i-volume-up:before{content:"\\e900"}'
+
+FONT = bytes(range(256)) * 64
+
+SCRIPT = b'(self.AMP=self.AMP||[]).push({});'
+
+
+class FakeCambridge:
+    def __init__(self, corpus_dir: str = CORPUS_DIR, port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 encoding: str = 'gzip', not_found: float = 0.0, throttle: float = 0.0, retry_after: int = 1,
+                 truncate: float = 0.0, reset: float = 0.0, seed: int = 0):
+        self.pages = []
+        for file in sorted(glob.glob(os.path.join(corpus_dir, '*.html.gz'))):
+            with gzip.open(file, 'rb') as f:
+                self.pages.append(f.read())
+        if not self.pages:
+            raise ValueError('no pages in {}'.format(corpus_dir))
+        self.latency = latency
+        self.jitter = jitter
+        self.encoding = encoding
+        self.not_found = not_found
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.truncate = truncate
+        self.reset = reset
+        # responses by status, or 'truncated' and 'reset'
+        self.counts = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self._saved: Dict[str, str] = {}
+        self._encoded: Dict[bytes, bytes] = {}
+        for body in self.pages + [STYLE, SCRIPT]:
+            self._encode(body)
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def _roll(self, probability: float) -> bool:
+        with self._lock:
+            return probability > 0 and self._random.random() < probability
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def _encode(self, body: bytes) -> bytes:
+        # compressed once, so the server takes little CPU from the client in the same process
+        if body not in self._encoded:
+            if self.encoding == 'gzip':
+                self._encoded[body] = gzip.compress(body)
+            elif self.encoding == 'deflate':
+                self._encoded[body] = zlib.compress(body)
+            else:
+                self._encoded[body] = body
+        return self._encoded[body]
+
+    def page(self, word: str) -> bytes:
+        return self.pages[zlib.crc32(word.encode('utf8')) % len(self.pages)]
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if fake.latency or fake.jitter:
+                    time.sleep(fake.latency + random.uniform(0, fake.jitter))
+                path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+                if fake._roll(fake.throttle):
+                    return self.send(429, b'too many requests', {'Retry-After': str(fake.retry_after)})
+                if fake._roll(fake.reset):
+                    fake._count('reset')
+                    # close with RST instead of FIN
+                    self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+                    self.connection.close()
+                    self.close_connection = True
+                    return
+                if path.startswith(PATH_QUERY):
+                    if fake._roll(fake.not_found):
+                        return self.send(404, b'not found')
+                    word = path[len(PATH_QUERY):]
+                    slug = '-'.join(word.replace('/', ' ').replace('-', ' ').replace('\'', ' ').lower().split())
+                    return self.send(302, b'', {'Location': PATH_ENTRY + urllib.parse.quote(slug)})
+                if path.startswith(PATH_ENTRY):
+                    page = fake.page(path[len(PATH_ENTRY):])
+                    return self.send(200, page, {'Content-Type': 'text/html; charset=utf-8'}, compress=True)
+                if path.startswith(PATH_MEDIA) and path.endswith('.mp3'):
+                    # British and American pronunciations are the same file here
+                    name = os.path.basename(path)[2:]
+                    return self.send(200, b'ID3' + name.encode('utf8') * 64, {'Content-Type': 'audio/mpeg'})
+                if path == '/zhs/common.css':
+                    return self.send(200, STYLE, {'Content-Type': 'text/css', 'ETag': '"style"'}, compress=True)
+                if path == '/zhs/external/fonts/cdoicons.woff':
+                    return self.send(200, FONT, {'Content-Type': 'font/woff', 'ETag': '"font"'})
+                if path in ('/v0.js', '/v0/amp-audio-0.1.js', '/v0/amp-accordion-0.1.js'):
+                    return self.send(200, SCRIPT, {'Content-Type': 'text/javascript', 'ETag': '"amp"'}, compress=True)
+                self.send(404, b'not found')
+
+            def send(self, status: int, body: bytes, headers: Dict[str, str] = None, compress: bool = False):
+                if compress and fake.encoding != 'identity':
+                    body = fake._encode(body)
+                    headers = dict(headers or {}, **{'Content-Encoding': fake.encoding})
+                truncated = status == 200 and fake._roll(fake.truncate)
+                fake._count('truncated' if truncated else status)
+                self.send_response(status)
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if truncated:
+                    self.wfile.write(body[:len(body) // 2])
+                    self.close_connection = True
+                else:
+                    self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'FakeCambridge':
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def install(self):
+        # point the Cambridge extractor here
+        urls = {
+            'URL_ROOT': self.url + '/',
+            'URL_QUERY': self.url + PATH_QUERY + '{}',
+            'URL_STYLE': self.url + '/zhs/common.css',
+            'URL_FONT': self.url + '/zhs/external/fonts/cdoicons.woff',
+            'URL_AMP': self.url + '/v0.js',
+            'URL_AMP_AUDIO': self.url + '/v0/amp-audio-0.1.js',
+            'URL_AMP_ACCORDION': self.url + '/v0/amp-accordion-0.1.js',
+        }
+        for name, url in urls.items():
+            self._saved.setdefault(name, getattr(cambridge, name))
+            setattr(cambridge, name, url)
+
+    def uninstall(self):
+        for name, url in self._saved.items():
+            setattr(cambridge, name, url)
+        self._saved.clear()
+
+    def __enter__(self) -> 'FakeCambridge':
+        self.start()
+        self.install()
+        return self
+
+    def __exit__(self, *args):
+        self.uninstall()
+        self.stop()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--corpus', metavar='DIR', default=CORPUS_DIR, help='pages to serve, default: %(default)s')
+    parser.add_argument('--latency', metavar='SECONDS', type=float, default=0.0,
+                        help='delay of each response, default: %(default)s')
+    parser.add_argument('--jitter', metavar='SECONDS', type=float, default=0.0,
+                        help='random extra delay up to SECONDS, default: %(default)s')
+    parser.add_argument('--encoding', choices=('identity', 'gzip', 'deflate'), default='gzip',
+                        help='content encoding, default: %(default)s')
+    parser.add_argument('--not-found', metavar='RATIO', type=float, default=0.0,
+                        help='answer queries with 404, default: %(default)s')
+    parser.add_argument('--throttle', metavar='RATIO', type=float, default=0.0,
+                        help='answer with 429, default: %(default)s')
+    parser.add_argument('--retry-after', metavar='SECONDS', type=int, default=1,
+                        help='Retry-After of 429s, default: %(default)s')
+    parser.add_argument('--truncate', metavar='RATIO', type=float, default=0.0,
+                        help='send half of the body and close, default: %(default)s')
+    parser.add_argument('--reset', metavar='RATIO', type=float, default=0.0,
+                        help='reset connections, default: %(default)s')
+    parser.add_argument('--seed', type=int, default=0, help='seed of injected faults, default: %(default)s')
+
+
+def from_args(args: argparse.Namespace, port: int = 0) -> FakeCambridge:
+    return FakeCambridge(args.corpus, port, args.latency, args.jitter, args.encoding, args.not_found, args.throttle,
+                         args.retry_after, args.truncate, args.reset, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='serve fake Cambridge pages')
+    parser.add_argument('--port', type=int, default=8000, help='default: %(default)s')
+    add_arguments(parser)
+    args = parser.parse_args()
+    fake = from_args(args, args.port)
+    print('serving on {}, query: {}{}WORD'.format(fake.url, fake.url, PATH_QUERY))
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.server.server_close()
+        print(dict(fake.counts))
+
+
+if __name__ == '__main__':
+    main()
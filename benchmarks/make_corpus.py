@@ -0,0 +1,156 @@
+# Generates the benchmark corpus: python benchmarks/make_corpus.py
+#
+# The pages are synthetic. They follow the markup of Cambridge English-Chinese entry pages (the classes the
+# extractor looks for, nesting, audios, ads, scripts and cross references), scaled from a short entry to a very
+# long one, and are generated from fixed seeds so the corpus doesn't change between runs.
+import gzip
+import os
+import random
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+# name: (parts of speech, senses per part, examples per sense, idioms)
+SIZES = {
+    'small': (1, 2, 1, 0),
+    'medium': (2, 6, 2, 4),
+    'large': (4, 15, 3, 12),
+    'very-long': (8, 40, 4, 40),
+}
+
+WORDS = ['run', 'set', 'take', 'go', 'make', 'get', 'account', 'list', 'chat', 'fulfil', 'reflect', 'cater',
+         'adhere', 'term', 'abbreviate', 'quickly', 'along', 'away', 'through', 'over', 'under', 'about']
+
+HANZI = '的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所'
+
+POS = ['verb', 'noun', 'adjective', 'adverb', 'phrasal verb', 'preposition', 'exclamation', 'idiom']
+
+HEAD = '''<!doctype html>
+<html lang="zh-Hans"><head><meta charset="utf-8"><title>{word} | 剑桥词典</title>
+<link rel="stylesheet" href="/zhs/common.css">
+<script async src="https://cdn.ampproject.org/v0.js"></script>
+<script async custom-element="amp-audio" src="https://cdn.ampproject.org/v0/amp-audio-0.1.js"></script>
+<script type="application/ld+json">{{"@context": "http://schema.org", "headline": "{word}"}}</script>
+</head>
+<body class="break default_layout">
+<div class="hfr lpb-2"><a class="share" href="https://www.facebook.com/">facebook</a><a class="share" href="https://twitter.com/">twitter</a></div>
+<div class="pr dictionary" data-id="cald4-zhs">
+'''
+
+TAIL = '''<div class="cid" id="cid"><div class="hdib">{word}</div></div>
+<div class="dwl hax"><a href="/zhs/wordlist">添加到词表</a></div>
+<div class="bb hax"><div class="bb hax"><a href="/zhs/translate">翻译</a></div></div>
+<div id="ad_contentslot_2" class="am-default contentslot ad_contentslot"></div>
+<script>window.dataLayer = window.dataLayer || []; dataLayer.push({{"entry": "{word}"}});</script>
+</div>
+</div>
+<script>(function () {{ var s = document.createElement("script"); s.src = "/zhs/ads.js"; }})();</script>
+</body></html>
+'''
+
+
+def sentence(rnd: random.Random, word: str, n: int) -> str:
+    words = [rnd.choice(WORDS) for _ in range(n)]
+    words[rnd.randrange(n)] = '<span class="x-h dx-h">{}</span>'.format(word)
+    return ' '.join(words).capitalize() + '.'
+
+
+def hanzi(rnd: random.Random, n: int) -> str:
+    return ''.join(rnd.choice(HANZI) for _ in range(n))
+
+
+def definition(rnd: random.Random, word: str) -> str:
+    words = []
+    for _ in range(rnd.randint(4, 14)):
+        w = rnd.choice(WORDS)
+        words.append('<a class="query" href="https://dictionary.cambridge.org/zhs/{0}" title="{0}">{0}</a>'.format(w)
+                     if rnd.random() < 0.3 else w)
+    return ' '.join(words)
+
+
+def example(rnd: random.Random, word: str) -> str:
+    return ('<div class="examp dexamp"><span class="eg deg">{}</span>'
+            '<span class="trans dtrans dtrans-se hdb break-cj" lang="zh-Hans">{}</span></div>'
+            ).format(sentence(rnd, word, rnd.randint(5, 16)), hanzi(rnd, rnd.randint(6, 20)))
+
+
+def sense(rnd: random.Random, word: str, pos: str, index: int, examples: int) -> str:
+    parts = ['<div class="pr dsense "><h3 class="dsense_h"><span class="hw dsense_hw">{}</span> '
+             '<span class="pos dsense_pos">{}</span></h3>'.format(word, pos),
+             '<div class="sense-body dsense_b">']
+    level = rnd.choice(['A1', 'A2', 'B1', 'B2', 'C1', 'C2'])
+    parts.append('<div class="def-block ddef_block " data-wl-senseid="ID_{}">'.format(index))
+    parts.append('<div class="ddef_h"><span class="def-info ddef-info"><span class="epp-xref dxref {0}">{0}</span>'
+                 '</span><div class="def ddef_d db">{1}</div></div>'.format(level, definition(rnd, word)))
+    parts.append('<div class="def-body ddef_b"><span class="trans dtrans dtrans-se  break-cj" lang="zh-Hans">{}</span>'
+                 .format(hanzi(rnd, rnd.randint(2, 12))))
+    parts.extend(example(rnd, word) for _ in range(examples))
+    parts.append('</div></div>')
+    parts.append('<div class="daccord"><amp-accordion><section><header class="ca_h daccord_h">更多范例</header>'
+                 '<ul class="hul-u">{}</ul></section></amp-accordion></div>'.format(
+                     ''.join('<li class="eg dexamp hax">{}</li>'.format(sentence(rnd, word, rnd.randint(6, 14)))
+                             for _ in range(rnd.randint(2, 6)))))
+    parts.append('</div></div>')
+    return ''.join(parts)
+
+
+def entry(rnd: random.Random, word: str, pos_count: int, senses: int, examples: int) -> str:
+    parts = ['<div class="entry"><div class="entry-body">']
+    index = 0
+    for p in range(pos_count):
+        pos = POS[p % len(POS)]
+        slug = word[:3]
+        parts.append('<div class="pr entry-body__el"><div class="pos-header dpos-h">'
+                     '<div class="di-title"><span class="headword hdb tw-bw dhw dpos-h_hw ">'
+                     '<span class="hw dhw">{0}</span></span></div>'
+                     '<div class="posgram dpos-g hdib lmr-5"><span class="pos dpos" title="{1}">{1}</span></div>'
+                     .format(word, pos))
+        for region in ('uk', 'us'):
+            parts.append('<span class="{0} dpron-i "><span class="region dreg">{0}</span><span class="daud">'
+                         '<audio class="hdn" preload="none" controlslist="nodownload"><source type="audio/mpeg" '
+                         'src="/zhs/media/english-chinese-simplified/{0}_pron/{1}/{0}{2}/{0}{3}__00{4}.mp3"/>'
+                         '</audio><div class="i i-volume-up c_aud htc hdib hp hv-1 fon tcu tc-bd lmr-10 lpt-3" '
+                         'title="Listen to the pronunciation" role="button" tabindex="0"></div></span>'
+                         '<span class="pron dpron">/<span class="ipa dipa lpr-2 lpl-1">{3}</span>/</span></span>'
+                         .format(region, word[0], slug, word, p + 1))
+        parts.append('</div><div class="pos-body">')
+        for _ in range(senses):
+            index += 1
+            parts.append(sense(rnd, word, pos, index, examples))
+        parts.append('</div>')
+        if p == 0:
+            parts.append('<div id="ad_contentslot_1" class="am-default contentslot ad_contentslot">'
+                         '<div class="ad"><script>googletag.cmd.push(function () {});</script></div></div>')
+        parts.append('</div>')
+    parts.append('</div></div>')
+    return ''.join(parts)
+
+
+def xrefs(rnd: random.Random, word: str, idioms: int) -> str:
+    if not idioms:
+        return ''
+    items = ''.join('<div class="item lc lc1 lpb-10 lpr-10"><a href="/zhs/{0}-{1}"><span class="x-h dx-h">{0} {1}'
+                    '</span></a></div>'.format(word, rnd.choice(WORDS)) for _ in range(idioms))
+    return ('<div class="xref idioms hax dxref-w lmt-25 lmb-25"><h3 class="bb fs16 lp-10 lmb-0">习语</h3>'
+            '<div class="hax lp-10 lb lb-cm lbt0 dwla wordlist">{}</div></div>'.format(items))
+
+
+def page(name: str, word: str) -> str:
+    rnd = random.Random(name)
+    pos_count, senses, examples, idioms = SIZES[name]
+    return (HEAD.format(word=word) + '<div class="di-body">' + entry(rnd, word, pos_count, senses, examples) +
+            xrefs(rnd, word, idioms) + TAIL.format(word=word))
+
+
+def main():
+    os.makedirs(CORPUS_DIR, exist_ok=True)
+    for name, word in zip(SIZES, ('chat', 'account', 'take', 'run')):
+        html = page(name, word)
+        file = os.path.join(CORPUS_DIR, '{}.html.gz'.format(name))
+        # mtime=0 keeps the files identical between runs
+        with open(file, 'wb') as f, gzip.GzipFile(fileobj=f, mode='wb', mtime=0) as gz:
+            gz.write(html.encode('utf8'))
+        print('{}: {} bytes'.format(file, len(html.encode('utf8'))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+import hashlib
+import html
+import itertools
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import zipfile
+from typing import Iterable, List, Sequence
+
+from .utils import get_tag, valid_path, Log
+
+__all__ = [
+    'write_apkg',
+]
+
+TAG = get_tag(__name__)
+
+DEFAULT_DECK = 'dict2anki'
+
+# the templates refer to these
+FIELDS = ('正面', '背面')
+
+# notes inserted in a transaction
+DEFAULT_BATCH_SIZE = 10000
+
+COLLECTION_FILE = 'collection.anki2'
+
+MEDIA_FILE = 'media'
+
+# already compressed, stored as is
+STORED_EXTENSIONS = ('.mp3', '.ogg', '.m4a', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.woff', '.woff2')
+
+# schema 11, understood by all Anki versions since 2.1
+SCHEMA = '''
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null, scm integer not null,
+    ver integer not null, dty integer not null, usn integer not null, ls integer not null,
+    conf text not null, models text not null, decks text not null, dconf text not null, tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null, mod integer not null,
+    usn integer not null, tags text not null, flds text not null, sfld integer not null,
+    csum integer not null, flags integer not null, data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null, ord integer not null,
+    mod integer not null, usn integer not null, type integer not null, queue integer not null,
+    due integer not null, ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null, odid integer not null,
+    flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null, ease integer not null,
+    ivl integer not null, lastIvl integer not null, factor integer not null, time integer not null,
+    type integer not null
+);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+'''
+
+_strip_tags = re.compile(r'<[^>]*>')
+
+_BASE91 = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!#$%&()*+,-./:;<=>?@[]^_`{|}~'
+
+
+def _id_of(name: str) -> int:
+    # stable, so importing again updates the note type and deck instead of adding new ones
+    return (1 << 30) + int.from_bytes(hashlib.blake2b(name.encode('utf8'), digest_size=4).digest(), 'big') % (1 << 30)
+
+
+def _guid_of(field: str) -> str:
+    # stable, so importing again updates notes instead of duplicating them
+    n = int.from_bytes(hashlib.sha256(field.encode('utf8')).digest()[:8], 'big')
+    guid = ''
+    while n:
+        n, r = divmod(n, len(_BASE91))
+        guid = _BASE91[r] + guid
+    return guid
+
+
+def _strip(field: str) -> str:
+    return html.unescape(_strip_tags.sub('', field)).strip()
+
+
+def _checksum(field: str) -> int:
+    return int(hashlib.sha1(_strip(field).encode('utf8')).hexdigest()[:8], 16)
+
+
+def _collection(deck: str, front_template: str, back_template: str, styling: str, now: int) -> tuple:
+    mid, did = _id_of('dict2anki ' + deck), _id_of(deck)
+    model = {
+        'id': mid, 'name': deck, 'type': 0, 'mod': now, 'usn': -1, 'sortf': 0, 'did': did,
+        'tmpls': [{'name': 'Card 1', 'ord': 0, 'qfmt': front_template, 'afmt': back_template, 'did': None,
+                   'bqfmt': '', 'bafmt': ''}],
+        'flds': [{'name': name, 'ord': i, 'sticky': False, 'rtl': False, 'font': 'Arial', 'size': 20, 'media': []}
+                 for i, name in enumerate(FIELDS)],
+        'css': styling,
+        'latexPre': '\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n\\usepackage[utf8]{inputenc}\n'
+                    '\\usepackage{amssymb,amsmath}\n\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n'
+                    '\\begin{document}\n',
+        'latexPost': '\\end{document}',
+        'tags': [], 'vers': [],
+        'req': [[0, 'any', [0]]],
+    }
+
+    def deck_of(id_: int, name: str) -> dict:
+        return {
+            'id': id_, 'name': name, 'mod': now, 'usn': -1, 'desc': '', 'dyn': 0, 'conf': 1, 'collapsed': False,
+            'browserCollapsed': False, 'extendNew': 0, 'extendRev': 0,
+            'newToday': [0, 0], 'revToday': [0, 0], 'lrnToday': [0, 0], 'timeToday': [0, 0],
+        }
+
+    dconf = {
+        'id': 1, 'name': 'Default', 'mod': 0, 'usn': 0, 'maxTaken': 60, 'autoplay': True, 'timer': 0,
+        'replayq': True, 'dyn': False,
+        'new': {'delays': [1, 10], 'ints': [1, 4, 7], 'initialFactor': 2500, 'order': 1, 'perDay': 20,
+                'bury': True, 'separate': True},
+        'rev': {'perDay': 200, 'ease4': 1.3, 'fuzz': 0.05, 'maxIvl': 36500, 'ivlFct': 1, 'bury': True,
+                'minSpace': 1},
+        'lapse': {'delays': [10], 'mult': 0, 'minInt': 1, 'leechFails': 8, 'leechAction': 0},
+    }
+    conf = {
+        'activeDecks': [1], 'curDeck': 1, 'curModel': mid, 'newSpread': 0, 'collapseTime': 1200, 'timeLim': 0,
+        'estTimes': True, 'dueCounts': True, 'nextPos': 1, 'sortType': 'noteFld', 'sortBackwards': False,
+        'addToCur': True,
+    }
+    decks = {'1': deck_of(1, 'Default'), str(did): deck_of(did, deck)}
+    return (1, now, now * 1000, now * 1000, 11, 0, 0, 0, json.dumps(conf), json.dumps({str(mid): model}),
+            json.dumps(decks), json.dumps({'1': dconf}), '{}'), mid, did
+
+
+def write_apkg(path: str, rows: Iterable[Sequence[str]], front_template: str, back_template: str, styling: str,
+               deck: str = DEFAULT_DECK, media: List[str] = (), batch: int = DEFAULT_BATCH_SIZE) -> int:
+    start = time.perf_counter()
+    now = int(time.time())
+    path = valid_path(path)
+    with tempfile.TemporaryDirectory() as d:
+        collection = os.path.join(d, COLLECTION_FILE)
+        db = sqlite3.connect(collection)
+        # a throwaway file, written once
+        db.execute('PRAGMA journal_mode=OFF')
+        db.execute('PRAGMA synchronous=OFF')
+        db.executescript(SCHEMA)
+        col, mid, did = _collection(deck, front_template, back_template, styling, now)
+        db.execute('INSERT INTO col VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', col)
+        # unique ids, increasing in the order of cards
+        base = now * 1000
+        count = 0
+        guids = set()
+        rows = iter(rows)
+        while True:
+            notes, cards = [], []
+            for fields in itertools.islice(rows, batch):
+                fields = list(fields) + [''] * (len(FIELDS) - len(fields))
+                guid = _guid_of(fields[0])
+                if guid in guids:
+                    # different entries spelled the same
+                    guid = _guid_of('\x1f'.join(fields))
+                guids.add(guid)
+                nid = base + count
+                notes.append((nid, guid, mid, now, -1, '', '\x1f'.join(fields[:len(FIELDS)]), _strip(fields[0]),
+                              _checksum(fields[0]), 0, ''))
+                cards.append((nid, nid, did, 0, now, -1, 0, 0, count + 1, 0, 0, 0, 0, 0, 0, 0, 0, ''))
+                count += 1
+            if not notes:
+                break
+            with db:
+                db.executemany('INSERT INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', notes)
+                db.executemany('INSERT INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', cards)
+            Log.d(TAG, 'inserted {} notes'.format(count))
+        db.close()
+
+        # files are copied into the archive in chunks, never read whole
+        with zipfile.ZipFile(path + '.part', 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.write(collection, COLLECTION_FILE)
+            manifest = {}
+            for i, file in enumerate(media):
+                compress = zipfile.ZIP_STORED if file.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+                zf.write(file, str(i), compress)
+                manifest[str(i)] = os.path.basename(file)
+            zf.writestr(MEDIA_FILE, json.dumps(manifest, ensure_ascii=False))
+        os.replace(path + '.part', path)
+    Log.i(TAG, 'wrote {} notes and {} media files to: {} in {:.1f}s'.format(count, len(manifest), path,
+                                                                         time.perf_counter() - start))
+    return count
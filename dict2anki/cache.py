@@ -0,0 +1,157 @@
+import hashlib
+import http.client
+import io
+import json
+import os
+import threading
+import time
+import zlib
+from typing import Optional, Dict, List, Tuple
+
+from .utils import get_tag, Log
+
+__all__ = [
+    'CachedResponse', 'ResponseCache',
+]
+
+TAG = get_tag(__name__)
+
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+# headers kept along with bodies
+_KEPT_HEADERS = ('Content-Type', 'Content-Encoding', 'ETag', 'Last-Modified')
+
+
+class CachedResponse(io.BytesIO):
+    status = 200
+    reason = 'OK'
+
+    def __init__(self, url: str, headers: Dict[str, str], body: bytes):
+        super().__init__(body)
+        self.url = url
+        self.headers = http.client.HTTPMessage()
+        for k, v in headers.items():
+            self.headers[k] = v
+
+    def geturl(self) -> str:
+        return self.url
+
+
+class ResponseCache:
+    def __init__(self, path: str, ttl: float = DEFAULT_TTL, max_size: int = DEFAULT_MAX_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _file(self, url: str) -> str:
+        key = hashlib.sha1(url.encode('utf8')).hexdigest()
+        return os.path.join(self.path, key[:2], key)
+
+    def _read(self, url: str, allow_expired: bool) -> Optional[Tuple[dict, bytes]]:
+        file = self._file(url)
+        try:
+            with open(file, 'rb') as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                Log.w(TAG, 'broken cache entry: {}, {}'.format(file, e))
+            return None
+        if meta.get('url') != url:
+            return None
+        if not allow_expired and meta['time'] + self.ttl < time.time():
+            Log.d(TAG, 'expired: {}'.format(url))
+            return None
+        # bump for LRU eviction
+        try:
+            os.utime(file)
+        except OSError:
+            pass
+        return meta, body
+
+    def get(self, url: str, allow_expired: bool = False) -> Optional[CachedResponse]:
+        entry = self._read(url, allow_expired)
+        if entry and 'location' in entry[0]:
+            entry = self._read(entry[0]['location'], allow_expired)
+        if not entry:
+            return None
+        meta, body = entry
+        Log.d(TAG, 'hit: {}'.format(url))
+        return CachedResponse(meta['url'], meta['headers'], body)
+
+    def put(self, url: str, final_url: str, headers, body: bytes):
+        now = time.time()
+        kept = {k: headers[k] for k in _KEPT_HEADERS if headers[k]}
+        if not kept.get('Content-Encoding'):
+            body = zlib.compress(body)
+            kept['Content-Encoding'] = 'deflate'
+        self._write(final_url, {'url': final_url, 'time': now, 'headers': kept}, body)
+        if url != final_url:
+            self._write(url, {'url': url, 'time': now, 'location': final_url}, b'')
+
+    def refresh(self, url: str):
+        # the entry is still valid, e.g. after a 304 response
+        entry = self._read(url, True)
+        if entry:
+            meta, body = entry
+            meta['time'] = time.time()
+            self._write(url, meta, body)
+            if 'location' in meta:
+                self.refresh(meta['location'])
+
+    def _write(self, url: str, meta: dict, body: bytes):
+        file = self._file(url)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(file, threading.get_ident())
+        data = json.dumps(meta).encode('utf8') + b'\n' + body
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        try:
+            old = os.path.getsize(file)
+        except OSError:
+            old = 0
+        os.replace(tmp, file)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(data) - old
+            if self._size > self.max_size:
+                self._evict()
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for d in os.scandir(self.path):
+            if not d.is_dir():
+                continue
+            for e in os.scandir(d.path):
+                if e.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = e.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, e.path))
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        entries.sort()
+        self._size = sum(size for _, size, _ in entries)
+        # leave some room to avoid evicting on every write
+        target = self.max_size * 0.9
+        count = 0
+        for _, size, path in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+            count += 1
+        Log.d(TAG, 'evicted {} entries, size={}'.format(count, self._size))
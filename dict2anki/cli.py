@@ -1,9 +1,20 @@
 import argparse
+import glob
+import json
 import os
 import socket
 import sys
+from typing import Callable, Iterator, List
 
+from . import net, stats
+from .profiling import Profiler
+from .shard import MergeError, parse_shard, shard_dir, merge
+from .apkg import DEFAULT_DECK
+from .cache import ResponseCache, DEFAULT_TTL, DEFAULT_MAX_SIZE
 from .extractors import EXTRACTORS, DEFAULT_EXTRACTOR
+from .limiter import DEFAULT_MAXIMUM
+from .media import MediaFetcher
+from .store import CardStore
 from .utils import get_tag, Log
 
 TAG = get_tag(__name__)
@@ -12,10 +23,44 @@ extractor = None
 
 output_path = None
 
-words = []
+input_files = []
+
+shard = None
+
+merge_paths = []
+
+apkg = None
+
+media = False
+
+prune = False
+
+resume = False
+
+cache_dir = None
+
+cache_ttl = None
+
+concurrency = None
+
+max_concurrency = DEFAULT_MAXIMUM
+
+processes = None
+
+stats_json = None
+
+profile = False
+
+profile_mem = False
 
 DEFAULT_TIME_OUT = 20
 
+DEFAULT_RATE = 10.0
+
+CARD_STORE_FILE = 'cards.sqlite3'
+
+MANIFEST_FILE = 'media.manifest'
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -29,8 +74,8 @@ def parse_args():
         help='show this help message and exit'
     )
     parser.add_argument(
-        '-i', '--input-file', metavar='FILE', type=argparse.FileType('r'),
-        help='read words from FILE split by lines, ignoring lines starting with "#"'
+        '-i', '--input-file', metavar='FILE', nargs='+',
+        help='read words from FILEs or globs split by lines, ignoring lines starting with "#", "-" for stdin'
     )
     parser.add_argument(
         '-o', '--output-path', metavar='PATH', help='set output path'
@@ -39,6 +84,101 @@ def parse_args():
         '-e', '--extractor', metavar='DICT',
         help='available extractors: {}, default: {}'.format(', '.join(list(EXTRACTORS.keys())), DEFAULT_EXTRACTOR)
     )
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='skip words finished by the last run in PATH, retrying failed ones'
+    )
+    parser.add_argument(
+        '--shard', metavar='i/N',
+        help='only look up words hashed to shard i of N (0 <= i < N), writing to PATH/{}'.format(shard_dir('i', 'N'))
+    )
+    parser.add_argument(
+        '--merge', metavar='DIR', nargs='+',
+        help='merge cards of shards in DIRs or globs to PATH in the order of input words, without duplicates'
+    )
+    parser.add_argument(
+        '--apkg', metavar='DECK', nargs='?', const=DEFAULT_DECK,
+        help='also write cards to PATH/DECK.apkg to import into Anki directly, default DECK: {}'.format(DEFAULT_DECK)
+    )
+    parser.add_argument(
+        '--media', action='store_true',
+        help='download audios and images of cards into PATH/collection.media for offline use'
+    )
+    parser.add_argument(
+        '--prune-styling', action='store_true',
+        help='drop CSS rules and scripts not used by cards in PATH from the styling, and minify it'
+    )
+    parser.add_argument(
+        '--concurrency', metavar='N', type=int,
+        help='look up N words at a time, default: adapted to the server'
+    )
+    parser.add_argument(
+        '--max-concurrency', metavar='N', type=int, default=DEFAULT_MAXIMUM,
+        help='look up at most N words at a time when adapting, default: {}'.format(DEFAULT_MAXIMUM)
+    )
+    parser.add_argument(
+        '--processes', metavar='N', type=int,
+        help='parse pages in N processes, 0 to parse in the main process, default: number of cores'
+    )
+    parser.add_argument(
+        '--rate', metavar='N', type=float, default=DEFAULT_RATE,
+        help='send at most N requests per second to each host, 0 for unlimited, default: {}'.format(DEFAULT_RATE)
+    )
+    parser.add_argument(
+        '--burst', metavar='N', type=int, default=net.DEFAULT_BURST,
+        help='allow bursts of N requests within the rate, default: {}'.format(net.DEFAULT_BURST)
+    )
+    parser.add_argument(
+        '--backoff', metavar='SECONDS', type=float, default=net.DEFAULT_BACKOFF,
+        help='wait about SECONDS before the first retry, doubled for each attempt, default: {}'.format(
+            net.DEFAULT_BACKOFF)
+    )
+    parser.add_argument(
+        '--max-backoff', metavar='SECONDS', type=float, default=net.DEFAULT_MAX_BACKOFF,
+        help='wait at most SECONDS between retries unless asked by Retry-After, default: {}'.format(
+            net.DEFAULT_MAX_BACKOFF)
+    )
+    parser.add_argument(
+        '--max-body-size', metavar='MB', type=int, default=net.DEFAULT_MAX_BODY_SIZE // 1024 // 1024,
+        help='abort responses larger than MB after decompression, 0 for unlimited, default: {}'.format(
+            net.DEFAULT_MAX_BODY_SIZE // 1024 // 1024)
+    )
+    parser.add_argument(
+        '--cache-dir', metavar='DIR', help='cache responses in DIR, default: PATH/.cache'
+    )
+    parser.add_argument(
+        '--cache-ttl', metavar='SECONDS', type=float, default=DEFAULT_TTL,
+        help='expire cached responses after SECONDS, default: {}'.format(DEFAULT_TTL)
+    )
+    parser.add_argument(
+        '--cache-size', metavar='MB', type=int, default=DEFAULT_MAX_SIZE // 1024 // 1024,
+        help='evict least recently used responses when cache exceeds MB, default: {}'.format(
+            DEFAULT_MAX_SIZE // 1024 // 1024)
+    )
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help='don\'t cache responses'
+    )
+    parser.add_argument(
+        '--offline', action='store_true',
+        help='only use cached responses'
+    )
+    parser.add_argument(
+        '--stats', action='store_true',
+        help='print time spent in each stage, retries and bytes transferred'
+    )
+    parser.add_argument(
+        '--stats-json', metavar='FILE',
+        help='write the stats as JSON to FILE'
+    )
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='profile the run with cProfile, writing profile.pstats to PATH, parsing in the main process'
+    )
+    parser.add_argument(
+        '--profile-mem', action='store_true',
+        help='trace memory allocations, writing a tracemalloc snapshot and top allocations to PATH'
+    )
     parser.add_argument(
         '-d', '--debug', action='store_true',
         help='show debug info'
@@ -66,17 +206,116 @@ def parse_args():
         Log.i(TAG, 'no extractor specified, using default: {}'.format(DEFAULT_EXTRACTOR))
         extractor = DEFAULT_EXTRACTOR
 
+    global resume
+    resume = args.resume
+
+    global concurrency, max_concurrency
+    if (args.concurrency is not None and args.concurrency < 1) or args.max_concurrency < 1:
+        Log.e(TAG, 'concurrency must be positive')
+        sys.exit(2)
+    concurrency = args.concurrency
+    max_concurrency = args.max_concurrency
+
+    global processes
+    if args.processes is not None and args.processes < 0:
+        Log.e(TAG, 'invalid number of processes: {}'.format(args.processes))
+        sys.exit(2)
+    processes = args.processes
+
+    if args.rate < 0 or args.burst < 1 or args.backoff < 0 or args.max_backoff < 0:
+        Log.e(TAG, 'invalid rate or backoff')
+        sys.exit(2)
+    net.rate_limit = args.rate or None
+    net.rate_burst = args.burst
+    net.backoff = args.backoff
+    net.max_backoff = args.max_backoff
+    net.max_body_size = args.max_body_size * 1024 * 1024 or None
+
+    global stats_json
+    stats.enabled = args.stats or bool(args.stats_json)
+    stats_json = args.stats_json
+
+    global profile, profile_mem
+    profile = args.profile
+    profile_mem = args.profile_mem
+
+    global shard
+    if args.shard and args.merge:
+        Log.e(TAG, '--shard and --merge can\'t be used together')
+        sys.exit(2)
+    try:
+        shard = parse_shard(args.shard) if args.shard else None
+    except ValueError as e:
+        Log.e(TAG, e)
+        sys.exit(2)
+
     global output_path
     output_path = os.path.join(args.output_path if args.output_path else os.curdir, extractor)
+    if shard:
+        output_path = os.path.join(output_path, shard_dir(*shard))
 
-    global words
-    Log.d(TAG, 'loading words from {}'.format(args.input_file.name))
-    for word in args.input_file.read().splitlines():
-        word = word.strip()
-        if word and not word.startswith('#'):
-            words.append(word)
-    args.input_file.close()
-    Log.d(TAG, '{} words loaded'.format(len(words)))
+    global merge_paths
+    merge_paths = expand(args.merge, os.path.isdir) if args.merge else []
+    if merge_paths:
+        if os.path.abspath(output_path) in map(os.path.abspath, merge_paths):
+            Log.e(TAG, 'can\'t merge into a shard: {}'.format(output_path))
+            sys.exit(2)
+
+    if args.no_cache and args.offline:
+        Log.e(TAG, '--offline requires cache')
+        sys.exit(2)
+    global cache_dir, cache_ttl
+    if not args.no_cache and not merge_paths:
+        cache_dir = args.cache_dir if args.cache_dir else os.path.join(output_path, '.cache')
+        cache_ttl = args.cache_ttl
+        Log.d(TAG, 'caching responses in {}'.format(cache_dir))
+        net.response_cache = ResponseCache(cache_dir, cache_ttl, args.cache_size * 1024 * 1024)
+    net.offline = args.offline
+
+    global apkg, media, prune
+    apkg = args.apkg
+    media = args.media
+    if args.prune_styling and shard:
+        Log.e(TAG, 'styling of a shard can\'t be pruned, prune it with --merge instead')
+        sys.exit(2)
+    prune = args.prune_styling
+
+    global input_files
+    input_files = expand(args.input_file, os.path.isfile)
+
+
+def expand(patterns: List[str], exists: Callable[[str], bool]) -> List[str]:
+    paths = []
+    for pattern in patterns:
+        if pattern == '-':
+            paths.append(pattern)
+        elif glob.has_magic(pattern):
+            matched = sorted(glob.glob(pattern))
+            if not matched:
+                Log.e(TAG, 'no match: {}'.format(pattern))
+                sys.exit(2)
+            paths.extend(matched)
+        elif exists(pattern):
+            paths.append(pattern)
+        else:
+            Log.e(TAG, 'not found: {}'.format(pattern))
+            sys.exit(2)
+    return paths
+
+
+def read_words(files: List[str]) -> Iterator[str]:
+    # streamed, so huge lists and pipes take little memory
+    for file in files:
+        Log.d(TAG, 'reading words from {}'.format(file))
+        fp = sys.stdin if file == '-' else open(file, encoding='utf8')
+        try:
+            for line in fp:
+                word = line.strip()
+                if word and not word.startswith('#'):
+                    yield word
+        finally:
+            if fp is not sys.stdin:
+                fp.close()
 
 
 def main():
@@ -84,9 +323,49 @@ def main():
 
     socket.setdefaulttimeout(DEFAULT_TIME_OUT)
 
+    if profile or profile_mem:
+        with Profiler(output_path, profile, profile_mem):
+            run()
+    else:
+        run()
+
+
+def run():
     global extractor
     e = EXTRACTORS[extractor](output_path)
-    e.generate_front_template()
-    e.generate_back_template()
-    e.generate_styling()
-    e.generate_cards(*words)
+    if merge_paths:
+        try:
+            merge(merge_paths, read_words(input_files), e.normalize, output_path)
+        except MergeError as err:
+            Log.e(TAG, '{}, run the shard again'.format(err))
+            sys.exit(1)
+        if prune:
+            e.prune_styling()
+        if apkg:
+            e.generate_apkg(apkg)
+        return
+    e.concurrency = concurrency
+    e.max_concurrency = max_concurrency
+    # other processes are not profiled
+    e.processes = 0 if profile else processes
+    if cache_dir:
+        e.card_store = CardStore(os.path.join(cache_dir, CARD_STORE_FILE), e.version, cache_ttl)
+    e.shard = shard
+    if media:
+        e.media = MediaFetcher(e.media_path, os.path.join(output_path, MANIFEST_FILE))
+    try:
+        e.generate(source=read_words(input_files), resume=resume)
+    finally:
+        if e.media:
+            e.media.close()
+        if e.card_store:
+            # checkpoints the WAL
+            e.card_store.close()
+    if prune:
+        e.prune_styling()
+    if apkg:
+        e.generate_apkg(apkg)
+    if stats_json:
+        with open(stats_json, 'w', encoding='utf8') as f:
+            json.dump(stats.report(), f, indent=2)
+        Log.i(TAG, 'wrote stats to: {}'.format(stats_json))
@@ -1,11 +1,14 @@
+import asyncio
 import os
 import re
 import urllib.parse
 from typing import Tuple, List
+from urllib.error import HTTPError
 
 from dict2anki import htmls
-from dict2anki.net import url_get_content, urlopen_with_retry, fake_headers, url_save, url_save_guess_file
-from dict2anki.utils import Log, valid_path, get_tag
+from dict2anki.net import fake_headers, async_run, async_urlopen_with_retry, async_url_get_data, \
+    async_url_get_content
+from dict2anki.utils import Log, valid_path, write_if_changed, get_tag
 from .extractor import CardExtractor, WordNotFoundError, ExtractError
 
 __all__ = [
@@ -46,8 +49,37 @@ HTML_COLLAPSE1 = '<amp-accordion><section>' \
 
 parse_tag = re.compile(r'^(<[\s\S]*?>)([\s\S]*)(</[\s\S]*>)$')
 
+# applied to the body of an entry in a single pass
+REWRITER = htmls.compile_rules([
+    # remove titles
+    ('div', 'class="di-title"', htmls.REMOVE),
+    # # remove audios
+    # ('span', 'class="daud"', htmls.REMOVE),
+    # remove phrases and idioms
+    ('div', 'class="xref', htmls.REMOVE),
+    # seems useless
+    ('div', 'class="cid"', htmls.REMOVE),
+    ('div', 'class="dwl hax"', htmls.REMOVE),
+    # remove share
+    ('div', 'class="hfr lpb-2"', htmls.REMOVE),
+    # remove more examples
+    ('div', 'class="daccord"', htmls.REMOVE),
+    # remove adds
+    ('div', 'ad_contentslot', htmls.REMOVE),
+    ('div', 'class="bb hax"', htmls.REMOVE),
+    # remove js
+    ('script', '', htmls.REMOVE),
+    # remove links
+    ('a', 'class="query"', htmls.UNWRAP),
+    ('a', 'href=', htmls.UNWRAP),
+    # remove underlines
+    ('span', 'class="x-h dx-h"', htmls.UNWRAP),
+])
+
 
 class CambridgeExtractor(CardExtractor):
+    # bump when extraction rules change
+    VERSION = 1
 
     def __init__(self, out_path: str = DEFAULT_OUT_PATH, **kwargs):
         super().__init__(out_path, **kwargs)
@@ -59,98 +91,100 @@ class CambridgeExtractor(CardExtractor):
             self._styling = self._retrieve_styling()
         super().generate_styling()
 
+    async def generate_styling_async(self):
+        if not self._styling:
+            self._styling = await self._retrieve_styling_async()
+        super().generate_styling()
+
     def _retrieve_styling(self) -> str:
+        return async_run(self._retrieve_styling_async())
+
+    async def _retrieve_styling_async(self) -> str:
         Log.i(TAG, 'retrieving styling')
-        style = url_get_content(URL_STYLE, fake_headers())
-        font = url_save_guess_file(URL_FONT, fake_headers())[0]
+        style, font_data, amp, amp_audio, amp_accordion = await asyncio.gather(
+            async_url_get_content(URL_STYLE, fake_headers(), revalidate=True),
+            async_url_get_data(URL_FONT, fake_headers(), revalidate=True),
+            async_url_get_content(URL_AMP, fake_headers(), revalidate=True),
+            async_url_get_content(URL_AMP_AUDIO, fake_headers(), revalidate=True),
+            async_url_get_content(URL_AMP_ACCORDION, fake_headers(), revalidate=True),
+        )
+        font = os.path.basename(urllib.parse.urlsplit(URL_FONT).path)
         # add '_' to tell Anki that the file is used by template
-        _font = url_save(
-            URL_FONT,
-            headers=fake_headers(),
-            filename=valid_path(os.path.join(self.media_path, '_' + font)),
-            force=True
-        )[0]
-        Log.i(TAG, 'saved font file to: {}'.format(_font))
+        _font = valid_path(os.path.join(self.media_path, '_' + font))
+        if write_if_changed(_font, font_data):
+            Log.i(TAG, 'saved font file to: {}'.format(_font))
         _font = os.path.basename(_font)
         style = re.sub(r'url\([\S]*?/{}'.format(font), 'url({}'.format(_font), style)
         style = '<style>{}</style>\n'.format(style)
-        style += '<script type="text/javascript">{}</script>\n'.format(
-            url_get_content(URL_AMP, fake_headers()).replace('\n', ' ')
-        )
-        style += '<script type="text/javascript">{}</script>\n'.format(
-            url_get_content(URL_AMP_AUDIO, fake_headers()).replace('\n', ' ')
-        )
-        style += '<script type="text/javascript">{}</script>\n'.format(
-            url_get_content(URL_AMP_ACCORDION, fake_headers()).replace('\n', ' ')
-        )
+        # the custom elements each script is needed for
+        for script, elements in ((amp, 'amp-audio amp-accordion'), (amp_audio, 'amp-audio'),
+                                 (amp_accordion, 'amp-accordion')):
+            style += '<script type="text/javascript" data-for="{}">{}</script>\n'.format(elements,
+                                                                                      script.replace('\n', ' '))
         Log.i(TAG, 'retrieved styling')
         return style
 
+    def normalize(self, word: str) -> str:
+        return ' '.join(word.replace('/', ' ').replace('-', ' ').replace('\'', ' ').lower().split())
+
     def get_card(self, word: str) -> Tuple[str, List[str]]:
+        return async_run(self.get_card_async(word))
+
+    async def get_card_async(self, word: str) -> Tuple[str, List[str]]:
+        actual, content = await self.fetch_async(word)
+        fields = self.parse(content)
+        Log.d(TAG, 'parsed: "{}"'.format(actual))
+        return actual, fields
+
+    async def fetch_async(self, word: str) -> Tuple[str, str]:
         Log.d(TAG, 'querying "{}"'.format(word))
-        response = urlopen_with_retry(
-            URL_QUERY.format(urllib.parse.quote(word.replace('/', ' '))),
-            fake_headers()
-        )
+        try:
+            response = await async_urlopen_with_retry(
+                URL_QUERY.format(urllib.parse.quote(word.replace('/', ' '))),
+                fake_headers(),
+                cached=True
+            )
+        except HTTPError as e:
+            if e.code in (404, 410):
+                raise WordNotFoundError('can\'t find: "{}"'.format(word)) from e
+            raise
         actual = urllib.parse.urlsplit(response.geturl()).path.rsplit('/', 1)[-1]
         actual = ' '.join(actual.split('-'))
         if not actual:
+            response.close()
             raise WordNotFoundError('can\'t find: "{}"'.format(word))
-        if actual != ' '.join(word.replace('/', ' ').replace('-', ' ').replace('\'', ' ').lower().split()):
+        if actual != self.normalize(word):
             Log.i(TAG, 'redirected "{}" to: "{}"'.format(word, actual))
-        content = url_get_content(response, fake_headers())
-        fields = self._extract_fields(content)
-        Log.d(TAG, 'parsed: "{}"'.format(actual))
-        return actual, fields
+        return actual, await async_url_get_content(response, fake_headers())
 
-    def _extract_fields(self, html_str: str) -> List[str]:
-        try:
-            back = htmls.find(html_str, 'div', 'class="di-body"')
-            front = htmls.find(back, 'div', 'class="di-title"')
+    @classmethod
+    def parse(cls, page: str) -> List[str]:
+        return cls._extract_fields(page)
 
-            # remove titles
-            back = htmls.removeall(back, 'div', 'class="di-title"')
-            # # remove audios
-            # back = htmls.removeall(back, 'span', 'class="daud"')
+    @classmethod
+    def _extract_fields(cls, html_str: str) -> List[str]:
+        try:
+            doc = htmls.Document(html_str)
+            body = doc.find('div', 'class="di-body"')
+            front = doc.text(doc.find('div', 'class="di-title"', body))
+            back = REWRITER.apply(html_str, *body)
             # support online audios
             back = re.sub(r'src="/zhs/media', 'src="{}zhs/media'.format(URL_ROOT), back)
-            # remove phrases and idioms
-            back = htmls.removeall(back, 'div', 'class="xref')
-            # seems useless
-            back = htmls.removeall(back, 'div', 'class="cid"')
-            back = htmls.removeall(back, 'div', 'class="dwl hax"')
-
-            def remove_tag(h):
-                return parse_tag.sub(r'\g<2>', h)
-
-            # remove links
-            back = htmls.sub(back, remove_tag, 'a', 'class="query"')
-            back = htmls.sub(back, remove_tag, 'a', 'href=')
-
-            # remove share
-            back = htmls.removeall(back, 'div', 'class="hfr lpb-2"')
-            # remove more examples
-            back = htmls.removeall(back, 'div', 'class="daccord"')
-            # remove js
-            back = htmls.removeall(back, 'script')
-            # remove underlines
-            back = htmls.sub(back, remove_tag, 'span', 'class="x-h dx-h"')
-            # remove adds
-            back = htmls.removeall(back, 'div', 'ad_contentslot')
-            back = htmls.removeall(back, 'div', 'class="bb hax"')
             # collapse long cards
             if len(back) > THRESHOLD_COLLAPSE:
-                back = self._collapse(back)
+                back = cls._collapse(back)
             return [front, back]
         except Exception as e:
             raise ExtractError('can\'t extract fields', e)
 
-    def _collapse(self, html_str: str) -> str:
+    @classmethod
+    def _collapse(cls, html_str: str) -> str:
         def collapse1(h):
-            header = htmls.find(htmls.find(h, 'div', 'def-body ddef_b'), 'span', 'trans dtrans dtrans-se')
+            doc = htmls.Document(h)
+            header = doc.text(doc.find('span', 'trans dtrans dtrans-se', doc.find('div', 'def-body ddef_b')))
             return HTML_COLLAPSE1.format(header, h)
 
-        html_str = htmls.sub(html_str, collapse1, 'div', 'def-block ddef_block')
+        html_str = htmls.Document(html_str).sub(collapse1, 'div', 'def-block ddef_block')
 
         def collapse2(h):
             m = parse_tag.match(h)
@@ -1,10 +1,25 @@
 import asyncio
 import csv
+import glob
+import itertools
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from abc import ABCMeta, abstractmethod
-from typing import Tuple, List
+from typing import Tuple, List, Optional, Dict, Any, Iterable, Set
 
-from dict2anki.utils import valid_path, Log, get_tag, ProgressBar
+from dict2anki import net, stats
+from dict2anki.apkg import write_apkg, DEFAULT_DECK
+from dict2anki.journal import Journal, _digest
+from dict2anki.media import MediaFetcher
+from dict2anki.limiter import AdaptiveLimiter, DEFAULT_INITIAL, DEFAULT_MINIMUM, DEFAULT_MAXIMUM
+from dict2anki.net import async_run
+from dict2anki.shard import shard_of
+from dict2anki.store import CardStore
+from dict2anki.styling import prune_styling
+from dict2anki.utils import valid_path, write_if_changed, Log, get_tag, ProgressBar
+from dict2anki.writer import CardWriter, DEFAULT_WINDOW, recover
 
 __all__ = [
     'WordNotFoundError', 'ExtractError', 'CardExtractor',
@@ -18,6 +33,7 @@ DEFAULT_FRONT_TEMPLATE_FILE = 'front-template.txt'
 DEFAULT_BACK_TEMPLATE_FILE = 'back-template.txt'
 DEFAULT_STYLING_FILE = 'styling.txt'
 DEFAULT_CARDS_FILE = 'cards.txt'
+DEFAULT_JOURNAL_FILE = 'cards.journal'
 
 DEFAULT_FRONT_TEMPLATE = '''{{正面}}'''
 
@@ -34,7 +50,12 @@ DEFAULT_STYLING = '''.card {
 }
 '''
 
-DEFAULT_CONCURRENCY = 8
+DEFAULT_CONCURRENCY = DEFAULT_INITIAL
+
+DEFAULT_MAX_CONCURRENCY = DEFAULT_MAXIMUM
+
+# lines read from the input at a time
+DEFAULT_READ_BATCH = 1024
 
 
 class WordNotFoundError(Exception):
@@ -46,88 +67,339 @@ class ExtractError(Exception):
 
 
 class CardExtractor(metaclass=ABCMeta):
+    # bump when extracted fields change to invalidate stored cards
+    VERSION = 1
 
     def __init__(self, out_path: str = DEFAULT_OUT_PATH, media_folder: str = DEFAULT_MEDIA_FOLDER,
                  front: str = DEFAULT_FRONT_TEMPLATE_FILE, back: str = DEFAULT_BACK_TEMPLATE_FILE,
-                 styling: str = DEFAULT_STYLING_FILE, cards: str = DEFAULT_CARDS_FILE):
+                 styling: str = DEFAULT_STYLING_FILE, cards: str = DEFAULT_CARDS_FILE,
+                 journal: str = DEFAULT_JOURNAL_FILE):
         self.out_path = out_path
         self.media_path = os.path.join(out_path, media_folder)
         self.front_template_file = os.path.join(out_path, front)
         self.back_template_file = os.path.join(out_path, back)
         self.styling_file = os.path.join(out_path, styling)
         self.cards_file = os.path.join(out_path, cards)
+        self.journal_file = os.path.join(out_path, journal)
         self._front_template = DEFAULT_FRONT_TEMPLATE
         self._back_template = DEFAULT_BACK_TEMPLATE
         self._styling = DEFAULT_STYLING
+        self.card_store: Optional[CardStore] = None
+        # fixed concurrency, adapted to the server if None
+        self.concurrency: Optional[int] = None
+        self.max_concurrency = DEFAULT_MAX_CONCURRENCY
+        # processes parsing pages, one per core if None, parse in the event loop if 0
+        self.processes: Optional[int] = None
+        # (index, count), only words hashed to this shard are looked up
+        self.shard: Optional[Tuple[int, int]] = None
+        # download audios and images of cards into media_path if set
+        self.media: Optional[MediaFetcher] = None
+
+    @property
+    def version(self) -> str:
+        return '{}-{}'.format(type(self).__name__, self.VERSION)
 
     def generate_front_template(self):
         Log.i(TAG, 'generating front template')
         ftf = valid_path(self.front_template_file)
-        with open(ftf, 'w', encoding='utf8') as fp:
-            fp.write(self._front_template)
-        Log.i(TAG, 'generated front template to: {}'.format(ftf))
+        if write_if_changed(ftf, self._front_template):
+            Log.i(TAG, 'generated front template to: {}'.format(ftf))
+        else:
+            Log.i(TAG, 'front template unchanged: {}'.format(ftf))
 
     def generate_back_template(self):
         Log.i(TAG, 'generating back template')
         btf = valid_path(self.back_template_file)
-        with open(btf, 'w', encoding='utf8') as fp:
-            fp.write(self._back_template)
-        Log.i(TAG, 'generated back template to: {}'.format(btf))
+        if write_if_changed(btf, self._back_template):
+            Log.i(TAG, 'generated back template to: {}'.format(btf))
+        else:
+            Log.i(TAG, 'back template unchanged: {}'.format(btf))
 
     def generate_styling(self):
         Log.i(TAG, 'generating styling')
         sf = valid_path(self.styling_file)
-        with open(sf, 'w', encoding='utf8') as fp:
-            fp.write(self._styling)
-        Log.i(TAG, 'generated styling to: {}'.format(sf))
+        if write_if_changed(sf, self._styling):
+            Log.i(TAG, 'generated styling to: {}'.format(sf))
+        else:
+            Log.i(TAG, 'styling unchanged: {}'.format(sf))
+
+    async def generate_styling_async(self):
+        self.generate_styling()
 
-    def generate_cards(self, *words: str):
-        Log.i(TAG, 'generating {} cards'.format(len(words)))
+    def generate_cards(self, *words: str, resume: bool = False, source: Optional[Iterable[str]] = None):
+        async_run(self.generate_cards_async(*words, resume=resume, source=source))
+
+    async def generate_cards_async(self, *words: str, resume: bool = False, source: Optional[Iterable[str]] = None):
+        # words in source are read lazily, e.g. from a huge file or stdin
         file = valid_path(self.cards_file)
+        journal_file = valid_path(self.journal_file)
+        orphans = recover(file, journal_file) if resume else None
+        done = Journal.done(journal_file) if resume else None
+        Log.i(TAG, 'generating cards')
 
         # region Access with lock in coroutines
-        visited = set()
         skipped = []
-        bar = ProgressBar(len(words))
+        bar = ProgressBar(0)
         lock = asyncio.Lock()
 
         # endregion
 
-        async def do_generate():
-            sem = asyncio.Semaphore(DEFAULT_CONCURRENCY)
-
-            async def do_get(word: str) -> List[str]:
-                async with sem:
-                    try:
-                        actual, fields = await asyncio.get_running_loop().run_in_executor(None, self.get_card, word)
-                    except Exception as e:
-                        Log.e(TAG, 'can\'t get card: "{}", {}'.format(word, e))
-                        async with lock:
-                            skipped.append(word)
-                        Log.e(TAG, 'skipped: "{}"'.format(word))
-                    else:
-                        async with lock:
-                            bar.extra = actual
-                            bar.increment()
-                            if actual not in visited:
-                                visited.add(word)
-                                visited.add(actual)
-                                return fields
-
-            # gather all tasks to keep results stable
-            return await asyncio.gather(*[do_get(w) for w in words])
-
-        bar.update()
-        cards = asyncio.run(do_generate())
-        cards = [card for card in cards if card]
+        if self.concurrency:
+            limiter = AdaptiveLimiter(self.concurrency, self.concurrency, self.concurrency)
+        else:
+            limiter = AdaptiveLimiter(min(DEFAULT_CONCURRENCY, self.max_concurrency), DEFAULT_MINIMUM,
+                                      self.max_concurrency)
+        # cards are appended in order as soon as they are ready
+        writer = CardWriter(file, Journal(journal_file), done, max(DEFAULT_WINDOW, 2 * limiter.maximum),
+                            orphans=orphans)
+        # lookups in flight by normalized word
+        inflight: Dict[str, asyncio.Future] = {}
+        # digests of words learned, only aliases keep their entries, the others are entries themselves
+        known: Set[int] = set()
+        aliases: Dict[int, str] = {}
+        coalesced = 0
+
+        staged = self.staged
+        pool = None
+        processes = self.processes if self.processes is not None else os.cpu_count() or 1
+        if staged and processes >= 1:
+            pool = ProcessPoolExecutor(processes)
+            Log.d(TAG, 'parsing in {} processes'.format(processes))
+
+        async def limited_get(word: str) -> Tuple[str, Any]:
+            started = stats.start()
+            await limiter.acquire()
+            stats.stop('queue', started)
+            start = time.monotonic()
+            try:
+                result = await (self.fetch_async(word) if staged else self.get_card_async(word))
+            except WordNotFoundError:
+                # answered by the server
+                limiter.release(time.monotonic() - start)
+                raise
+            except Exception as e:
+                limiter.release(time.monotonic() - start, e)
+                raise
+            limiter.release(time.monotonic() - start)
+            stats.record('fetch', time.monotonic() - start)
+            return result
+
+        async def get(word: str) -> Tuple[str, List[str]]:
+            actual, result = await limited_get(word)
+            if not staged:
+                return actual, result
+            # the network slot is released while parsing
+            started = stats.start()
+            if pool:
+                fields = await asyncio.get_running_loop().run_in_executor(pool, type(self).parse, result)
+            else:
+                fields = self.parse(result)
+            stats.stop('parse', started)
+            return actual, fields
+
+        async def lookup(key: str, word: str) -> Tuple[str, Optional[List[str]]]:
+            # a duplicate or an alias of an entry, no fields needed
+            nonlocal coalesced
+            digest = _digest(key)
+            if digest in known:
+                coalesced += 1
+                return aliases.get(digest, key), None
+            if key in inflight:
+                coalesced += 1
+                return (await asyncio.shield(inflight[key]))[0], None
+            future = asyncio.get_running_loop().create_future()
+            inflight[key] = future
+            try:
+                card = self.card_store.get(key) if self.card_store else None
+                if card:
+                    actual, fields = card
+                else:
+                    actual, fields = await get(word)
+                    if self.card_store:
+                        self.card_store.put(key, actual, fields)
+            except Exception as e:
+                future.set_exception(e)
+                # mark retrieved
+                future.exception()
+                raise
+            else:
+                future.set_result((actual, None))
+            finally:
+                del inflight[key]
+                if not future.done():
+                    future.cancel()
+            for learned in (key, self.normalize(actual)):
+                known.add(_digest(learned))
+                if learned != actual:
+                    aliases[_digest(learned)] = actual
+            return actual, fields
+
+        async def do_get(index: int, word: str, key: str):
+            await writer.reserve(index)
+            try:
+                actual, fields = await lookup(key, word)
+            except Exception as e:
+                Log.e(TAG, 'can\'t get card: "{}", {}'.format(word, e))
+                async with lock:
+                    skipped.append(word)
+                Log.e(TAG, 'skipped: "{}"'.format(word))
+                await writer.put(index, key)
+            else:
+                if fields and self.media:
+                    started = stats.start()
+                    fields = await self.media.localize(fields)
+                    stats.stop('media', started)
+                async with lock:
+                    bar.extra = actual
+                    bar.increment()
+                await writer.put(index, key, actual, fields)
+
+        # a fixed set of workers, fed through a bounded queue
+        workers = writer.window
+        queue = asyncio.Queue(workers)
+        read = resumed = others = 0
+
+        async def produce():
+            nonlocal read, resumed, others
+            lines = itertools.chain(words, source or ())
+            loop = asyncio.get_running_loop()
+            index = 0
+            while True:
+                # reading may block, e.g. on stdin
+                batch = await loop.run_in_executor(None, list, itertools.islice(lines, DEFAULT_READ_BATCH))
+                if not batch:
+                    break
+                for word in batch:
+                    read += 1
+                    key = self.normalize(word)
+                    if self.shard and shard_of(key, self.shard[1]) != self.shard[0]:
+                        others += 1
+                        continue
+                    if done is not None and key in done:
+                        resumed += 1
+                        continue
+                    await queue.put((index, word, key))
+                    index += 1
+                    # known as words are queued, the queue is bounded so a batch may take long
+                    bar.total = index
+            for _ in range(workers):
+                await queue.put(None)
+
+        async def work():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                await do_get(*item)
+
+        # throttling is learned on each attempt, not only when a request has run out of retries
+        net.on_throttle = None if limiter.fixed else limiter.throttled
+        tasks = [asyncio.ensure_future(produce())] + [asyncio.ensure_future(work()) for _ in range(workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            net.on_throttle = None
+            if pool:
+                pool.shutdown()
+            writer.close()
+            if self.card_store:
+                self.card_store.flush()
         bar.done()
-        with open(file, 'a', encoding='utf8') as fp:
-            writer = csv.writer(fp)
-            writer.writerows(cards)
-        Log.i(TAG, 'generated {} cards to: {}'.format(len(cards), file))
+        if self.shard:
+            Log.i(TAG, 'shard {}/{}, left {} of {} words to other shards'.format(*self.shard, others, read))
+        if resume:
+            Log.i(TAG, 'resumed, {} of {} words done before'.format(resumed, read))
+        if stats.enabled:
+            stats.log_report()
+        if not limiter.fixed:
+            Log.i(TAG, 'concurrency limit ranged {}..{}, ended at {}'.format(limiter.low, limiter.high, limiter.limit))
+        if coalesced:
+            Log.i(TAG, 'coalesced {} duplicate lookups'.format(coalesced))
+        Log.i(TAG, 'generated {} cards to: {}'.format(writer.count, file))
         if skipped:
             Log.e(TAG, 'skipped {} words:\n{}'.format(len(skipped), '\n'.join(skipped)))
 
+    def generate(self, *words: str, resume: bool = False, source: Optional[Iterable[str]] = None):
+        start = time.perf_counter()
+        self.generate_front_template()
+        self.generate_back_template()
+
+        async def do_generate():
+            # styling assets are downloaded along with the first cards
+            results = await asyncio.gather(self.generate_styling_async(),
+                                           self.generate_cards_async(*words, resume=resume, source=source),
+                                           return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+
+        async_run(do_generate())
+        Log.i(TAG, 'generated all in {:.1f}s'.format(time.perf_counter() - start))
+
+    def prune_styling(self):
+        # drop what the cards written so far can't use
+        styling = self._styling or ''
+        if os.path.exists(self.styling_file):
+            with open(self.styling_file, encoding='utf8') as fp:
+                styling = fp.read()
+
+        def htmls():
+            yield self._front_template
+            yield self._back_template
+            with open(self.cards_file, encoding='utf8', newline='') as fp:
+                for row in csv.reader(fp):
+                    yield from row
+
+        csv.field_size_limit(sys.maxsize)
+        self._styling = prune_styling(styling, htmls())
+        sf = valid_path(self.styling_file)
+        if write_if_changed(sf, self._styling):
+            Log.i(TAG, 'generated pruned styling to: {}'.format(sf))
+
+    def generate_apkg(self, deck: str = DEFAULT_DECK) -> str:
+        # a package imported by Anki in one step, with the note type and media
+        def read(file: str, default: Optional[str]) -> str:
+            if default is None and os.path.exists(file):
+                with open(file, encoding='utf8') as fp:
+                    return fp.read()
+            return default or ''
+
+        def rows():
+            with open(self.cards_file, encoding='utf8', newline='') as fp:
+                yield from csv.reader(fp)
+
+        csv.field_size_limit(sys.maxsize)
+        file = os.path.join(self.out_path, '{}.apkg'.format(deck))
+        media = sorted(glob.glob(os.path.join(self.media_path, '*')))
+        write_apkg(file, rows(), read(self.front_template_file, self._front_template),
+                   read(self.back_template_file, self._back_template), read(self.styling_file, self._styling),
+                   deck, media)
+        return file
+
+    def normalize(self, word: str) -> str:
+        # words with the same normalized form are looked up once
+        return ' '.join(word.split())
+
+    @property
+    def staged(self) -> bool:
+        # fetching and parsing are implemented separately
+        return type(self).fetch_async is not CardExtractor.fetch_async
+
+    async def fetch_async(self, word: str) -> Tuple[str, Any]:
+        # returns the actual word and the page passed to parse()
+        raise NotImplementedError
+
+    @classmethod
+    def parse(cls, page: Any) -> List[str]:
+        # CPU bound, run in other processes, so it must not depend on the instance
+        raise NotImplementedError
+
     @abstractmethod
     def get_card(self, word: str) -> Tuple[str, List[str]]:
         pass
+
+    async def get_card_async(self, word: str) -> Tuple[str, List[str]]:
+        # extractors without a native implementation are run in threads
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_card, word)
@@ -1,21 +1,35 @@
 import re
-from typing import Optional, Iterator, Tuple
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Optional, Iterator, Tuple, Iterable, Union, Callable, Dict, List, Pattern
 
 from .utils import get_tag, Log
 
 __all__ = [
     'find_positions', 'findall', 'find', 'sub', 'removeall',
+    'REMOVE', 'UNWRAP', 'Rewriter', 'compile_rules', 'Document',
 ]
 
 TAG = get_tag(__name__)
 
 
-def find_positions(html_str: str, tag: str, attrib: str = '', hook=None) -> Iterator[Tuple[int, int]]:
+@lru_cache(maxsize=256)
+def _patterns(tag: str, attrib: str) -> Tuple[Pattern, Pattern, Pattern, Pattern]:
     open_tag = re.compile(r'<{}(?:\s*?|\s[\s\S]*?)>'.format(tag))
     close_tag = re.compile(r'</{}\s*?>'.format(tag))
     all_tag = re.compile(r'</?{}\s*?>|<{}\s[\s\S]*?>'.format(tag, tag))
     # must match with open_tag first
     start_tag = re.compile(r'<{}[\s\S]*?{}[\s\S]*?>'.format(tag, attrib))
+    return open_tag, close_tag, all_tag, start_tag
+
+
+@lru_cache(maxsize=256)
+def _attrib_pattern(attrib: str) -> Optional[Pattern]:
+    return re.compile(attrib) if attrib else None
+
+
+def find_positions(html_str: str, tag: str, attrib: str = '', hook=None) -> Iterator[Tuple[int, int]]:
+    open_tag, close_tag, all_tag, start_tag = _patterns(tag, attrib)
     count = 0
     start = -1
     for m in all_tag.finditer(html_str):
@@ -58,3 +72,156 @@ def sub(html_str: str, replace, tag: str, attrib: str = ''):
 
 def removeall(html_str: str, tag: str, attrib: str = '') -> str:
     return sub(html_str, lambda h: '', tag, attrib)
+
+
+REMOVE = 'remove'
+UNWRAP = 'unwrap'
+
+Action = Union[str, Callable[[str], str]]
+
+# any open or close tag, split into slash, name and rest
+_TAG = re.compile(r'<(/?)([^\s<>/]+)(\s[^>]*)?>')
+
+
+class _Element:
+    __slots__ = ('tag', 'action', 'open', 'start', 'depth', 'chunks')
+
+    def __init__(self, tag: str, action: Action, open_tag: str, start: int):
+        self.tag = tag
+        self.action = action
+        self.open = open_tag
+        self.start = start
+        self.depth = 1
+        self.chunks = []
+
+
+class Rewriter:
+    def __init__(self, rules: Iterable[Tuple[str, str, Action]]):
+        self._rules: Dict[str, List[Tuple[Optional[Pattern], Action]]] = {}
+        for tag, attrib, action in rules:
+            if action not in (REMOVE, UNWRAP) and not callable(action):
+                raise ValueError('unknown action: {}'.format(action))
+            self._rules.setdefault(tag, []).append((_attrib_pattern(attrib), action))
+
+    def _match(self, tag: str, open_tag: str) -> Optional[Action]:
+        for attrib, action in self._rules.get(tag, ()):
+            if attrib is None or attrib.search(open_tag, len(tag) + 1):
+                return action
+        return None
+
+    def apply(self, html_str: str, start: int = 0, end: int = None) -> str:
+        if end is None:
+            end = len(html_str)
+        root = []
+        stack: List[_Element] = []
+        pos = start
+        for m in _TAG.finditer(html_str, start, end):
+            top = stack[-1] if stack else None
+            if top is None or top.action != REMOVE:
+                (top.chunks if top else root).append(html_str[pos:m.start()])
+            pos = m.end()
+            closing, tag = m.group(1), m.group(2)
+            if top is not None and top.action == REMOVE:
+                # skip everything inside, only keep track of nesting
+                if tag == top.tag:
+                    top.depth += -1 if closing else 1
+                    if top.depth == 0:
+                        stack.pop()
+                continue
+            if not closing:
+                action = self._match(tag, m.group(0))
+                if action is not None:
+                    Log.d(TAG, 'rewriting element: {}, action={}'.format(m.group(0), action))
+                    stack.append(_Element(tag, action, m.group(0), m.start()))
+                    continue
+                if top is not None and tag == top.tag:
+                    top.depth += 1
+            elif top is not None and tag == top.tag:
+                top.depth -= 1
+                if top.depth == 0:
+                    stack.pop()
+                    self._finish(top, m.group(0), stack[-1].chunks if stack else root)
+                    continue
+            (top.chunks if top else root).append(m.group(0))
+        # unpaired elements are left as they are
+        tail = html_str[pos:end]
+        while stack:
+            e = stack.pop()
+            if e.action == REMOVE:
+                tail = html_str[e.start:end]
+            else:
+                tail = e.open + ''.join(e.chunks) + tail
+        root.append(tail)
+        return ''.join(root)
+
+    @staticmethod
+    def _finish(e: _Element, close_tag: str, parent: List[str]):
+        if e.action == UNWRAP:
+            parent.extend(e.chunks)
+        else:
+            parent.append(e.action(e.open + ''.join(e.chunks) + close_tag))
+
+
+def compile_rules(rules: Iterable[Tuple[str, str, Action]]) -> Rewriter:
+    return Rewriter(rules)
+
+
+Span = Tuple[int, int]
+
+
+class Document:
+    def __init__(self, html_str: str):
+        self.html = html_str
+        # tag -> (starts, elements), elements are (start, end of open tag, end) sorted by start
+        self._index: Dict[str, Tuple[List[int], List[Tuple[int, int, int]]]] = {}
+        opened: Dict[str, List[Span]] = {}
+        closed: Dict[str, List[Tuple[int, int, int]]] = {}
+        for m in _TAG.finditer(html_str):
+            tag = m.group(2)
+            if not m.group(1):
+                opened.setdefault(tag, []).append(m.span())
+            elif opened.get(tag):
+                i, j = opened[tag].pop()
+                closed.setdefault(tag, []).append((i, j, m.end()))
+        for tag, elements in closed.items():
+            elements.sort()
+            self._index[tag] = ([e[0] for e in elements], elements)
+        Log.d(TAG, 'indexed {} tags, {} elements'.format(len(self._index), sum(len(e) for e in closed.values())))
+
+    def find_positions(self, tag: str, attrib: str = '', within: Span = None) -> Iterator[Span]:
+        start, end = within if within else (0, len(self.html))
+        if tag not in self._index:
+            return
+        starts, elements = self._index[tag]
+        pattern = _attrib_pattern(attrib)
+        last = start
+        for n in range(bisect_left(starts, start), len(elements)):
+            i, j, k = elements[n]
+            if i >= end:
+                break
+            # skip elements nested in the last match or crossing the boundary
+            if i < last or k > end:
+                continue
+            if pattern is None or pattern.search(self.html, i + len(tag) + 1, j):
+                last = k
+                yield i, k
+
+    def findall(self, tag: str, attrib: str = '', within: Span = None) -> Iterator[Span]:
+        return self.find_positions(tag, attrib, within)
+
+    def find(self, tag: str, attrib: str = '', within: Span = None) -> Optional[Span]:
+        for span in self.find_positions(tag, attrib, within):
+            return span
+
+    def text(self, span: Optional[Span]) -> Optional[str]:
+        return self.html[span[0]:span[1]] if span else None
+
+    def sub(self, replace: Callable[[str], str], tag: str, attrib: str = '', within: Span = None) -> str:
+        start, end = within if within else (0, len(self.html))
+        chunks = []
+        for i, j in self.find_positions(tag, attrib, within):
+            chunks.append(self.html[start:i])
+            chunks.append(replace(self.html[i:j]))
+            start = j
+        chunks.append(self.html[start:end])
+        return ''.join(chunks)
@@ -0,0 +1,111 @@
+import hashlib
+import heapq
+import json
+import os
+from array import array
+from bisect import bisect_left
+from typing import Iterator, Sequence, Tuple
+
+from .utils import get_tag, Log
+
+__all__ = [
+    'CARD', 'DUPLICATE', 'SKIPPED', 'Journal', 'WordSet', 'row_digest',
+]
+
+TAG = get_tag(__name__)
+
+# a card was written to cards.txt
+CARD = 'C'
+# done without a card, e.g. redirected to an entry written before
+DUPLICATE = 'D'
+# failed, will be retried on resume
+SKIPPED = 'S'
+
+# hex digits of row_digest()
+ROW_DIGEST_SIZE = 16
+
+# digests sorted at a time as int objects
+SORT_RUN = 1 << 16
+
+
+def _digest(word: str) -> int:
+    return int.from_bytes(hashlib.blake2b(word.encode('utf8'), digest_size=8).digest(), 'big')
+
+
+def row_digest(fields: Sequence[str]) -> str:
+    # recorded along with a card, so the row can be found in cards.txt
+    return hashlib.blake2b(json.dumps(list(fields), ensure_ascii=False).encode('utf8'), digest_size=8).hexdigest()
+
+
+class WordSet:
+    # 8 bytes a word instead of a str object each
+    def __init__(self, words: Iterator[str] = ()):
+        digests = array('Q')
+        for word in words:
+            digests.append(_digest(word))
+        # sorted in runs, then merged without duplicates, so there are never more than two arrays of digests
+        n = len(digests)
+        for i in range(0, n, SORT_RUN):
+            digests[i:i + SORT_RUN] = array('Q', sorted(digests[i:i + SORT_RUN]))
+        self._digests = array('Q')
+        last = None
+        for d in heapq.merge(*((digests[j] for j in range(i, min(i + SORT_RUN, n))) for i in range(0, n, SORT_RUN))):
+            if d != last:
+                self._digests.append(d)
+                last = d
+
+    def __contains__(self, word: str) -> bool:
+        d = _digest(word)
+        i = bisect_left(self._digests, d)
+        return i < len(self._digests) and self._digests[i] == d
+
+    def __len__(self) -> int:
+        return len(self._digests)
+
+
+class Journal:
+    # appended like cards.txt, so its entries always match the cards written across runs
+    def __init__(self, path: str, append: bool = True):
+        self.path = path
+        self._fp = open(path, 'a' if append else 'w', encoding='utf8')
+        if self._fp.tell() > 0:
+            with open(path, 'rb') as fp:
+                fp.seek(-1, os.SEEK_END)
+                # terminate the line left incomplete by a crash
+                if fp.read(1) != b'\n':
+                    self._fp.write('\n')
+
+    def record(self, status: str, word: str, actual: str = '', row: str = ''):
+        self._fp.write('{}\t{}\t{}\t{}\n'.format(status, word.replace('\t', ' '), actual.replace('\t', ' '), row))
+
+    def flush(self):
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+    @staticmethod
+    def entries(path: str) -> Iterator[Tuple[str, str, str, str]]:
+        if not os.path.exists(path):
+            return
+        with open(path, encoding='utf8') as fp:
+            for line in fp:
+                parts = line.rstrip('\n').split('\t')
+                # the last line may be incomplete after a crash
+                if len(parts) != 4 or parts[0] == CARD and len(parts[3]) != ROW_DIGEST_SIZE:
+                    continue
+                yield parts[0], parts[1], parts[2], parts[3]
+
+    @staticmethod
+    def done(path: str) -> WordSet:
+        # finished words, along with entries written to cards
+        def words():
+            for status, word, actual, _ in Journal.entries(path):
+                if status in (CARD, DUPLICATE):
+                    yield word
+                if status == CARD:
+                    yield actual
+
+        done = WordSet(words())
+        Log.d(TAG, '{} words done in {}'.format(len(done), path))
+        return done
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from collections import deque
+from typing import Optional, Deque
+
+from .net import THROTTLE_CODES
+from .utils import get_tag, Log
+
+__all__ = [
+    'AdaptiveLimiter',
+]
+
+TAG = get_tag(__name__)
+
+DEFAULT_INITIAL = 8
+
+DEFAULT_MINIMUM = 1
+
+DEFAULT_MAXIMUM = 32
+
+# multiplicative decrease on throttling
+BACKOFF = 0.5
+
+# multiplicative decrease on other errors, e.g. timeouts, which don't always mean overload
+ERROR_BACKOFF = 0.75
+
+# multiplicative decrease when latency grows
+SHRINK = 0.9
+
+# recent latency this much above the long-term average means queueing
+TOLERANCE = 1.5
+
+# smoothing of the recent and long-term latency averages
+ALPHA_SHORT = 0.3
+ALPHA_LONG = 0.05
+
+
+class AdaptiveLimiter:
+    # AIMD on errors and throttling, plus a latency gradient between a recent and a long-term average
+    def __init__(self, initial: int = DEFAULT_INITIAL, minimum: int = DEFAULT_MINIMUM, maximum: int = DEFAULT_MAXIMUM):
+        if not 1 <= minimum <= maximum:
+            raise ValueError('invalid bounds: {}..{}'.format(minimum, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self._limit = float(min(max(initial, minimum), maximum))
+        self._inflight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._short: Optional[float] = None
+        self._long: Optional[float] = None
+        self._decreased = 0.0
+        self.low = self.high = self.limit
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def fixed(self) -> bool:
+        return self.minimum == self.maximum
+
+    async def acquire(self):
+        if self._inflight < self.limit and not self._waiters:
+            self._inflight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # woken up but not going to use it
+                self._inflight -= 1
+                self._wake()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self, latency: float, error: BaseException = None):
+        self._inflight -= 1
+        if not self.fixed:
+            self._update(latency, error)
+        self._wake()
+
+    def throttled(self, error: BaseException = None):
+        # each throttled attempt, reported while retrying instead of once the request is done
+        if not self.fixed:
+            old = self.limit
+            self._decrease(BACKOFF, 'throttled')
+            self._changed(old)
+
+    def _wake(self):
+        while self._waiters and self._inflight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._inflight += 1
+                waiter.set_result(None)
+
+    def _decrease(self, factor: float, reason: Optional[str] = None):
+        # at most once per round trip
+        now = time.monotonic()
+        if now - self._decreased >= (self._long or 0):
+            self._decreased = now
+            self._limit = max(self.minimum, self._limit * factor)
+            if reason:
+                Log.d(TAG, '{}, backing off'.format(reason))
+
+    def _changed(self, old: int):
+        if self.limit != old:
+            self.low = min(self.low, self.limit)
+            self.high = max(self.high, self.limit)
+            Log.d(TAG, 'concurrency limit: {} -> {}, latency={:.3f}s/{:.3f}s'.format(
+                old, self.limit, self._short or 0, self._long or 0))
+
+    def _update(self, latency: float, error: Optional[BaseException]):
+        old = self.limit
+        if error is not None:
+            if getattr(error, 'code', None) in THROTTLE_CODES:
+                self._decrease(BACKOFF, 'throttled')
+            else:
+                self._decrease(ERROR_BACKOFF, 'error')
+        else:
+            if self._long is None:
+                self._short = self._long = latency
+            else:
+                self._short += ALPHA_SHORT * (latency - self._short)
+                self._long += ALPHA_LONG * (latency - self._long)
+            if self._short > self._long * TOLERANCE:
+                self._decrease(SHRINK)
+            elif self._inflight + 1 >= self.limit:
+                # only grow when the limit is actually reached
+                self._limit = min(self.maximum, self._limit + 1 / self._limit)
+        self._changed(old)
@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from .net import fake_headers, url_save
+from .utils import get_tag, valid_path, Log
+
+__all__ = [
+    'MediaFetcher',
+]
+
+TAG = get_tag(__name__)
+
+DEFAULT_CONCURRENCY = 8
+
+MEDIA_EXTENSIONS = ('mp3', 'ogg', 'wav', 'm4a', 'png', 'jpg', 'jpeg', 'gif', 'svg', 'webp')
+
+# remote audios and images, e.g. <source type="audio/mpeg" src="https://.../ukcolou002.mp3"/>
+_media_src = re.compile(r'(\ssrc=")(https?://[^"]+?\.(?:{}))(")'.format('|'.join(MEDIA_EXTENSIONS)),
+                        re.IGNORECASE)
+
+
+class MediaFetcher:
+    def __init__(self, media_path: str, manifest_file: str, concurrency: int = DEFAULT_CONCURRENCY):
+        self.media_path = media_path
+        # kept out of media_path, which is imported into Anki as is
+        self.manifest_file = manifest_file
+        self.downloaded = 0
+        self.deduplicated = 0
+        # file by url, and file by content
+        self._files: Dict[str, str] = {}
+        self._digests: Dict[str, str] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(concurrency)
+        self._load()
+        os.makedirs(os.path.dirname(os.path.abspath(manifest_file)), exist_ok=True)
+        self._fp = open(manifest_file, 'a', encoding='utf8')
+
+    def _load(self):
+        if not os.path.exists(self.manifest_file):
+            return
+        with open(self.manifest_file, encoding='utf8') as fp:
+            for line in fp:
+                parts = line.rstrip('\n').split('\t')
+                # the last line may be incomplete after a crash
+                if len(parts) != 3:
+                    continue
+                url, name, digest = parts
+                if os.path.exists(os.path.join(self.media_path, name)):
+                    self._files[url] = name
+                    self._digests[digest] = name
+        Log.d(TAG, '{} media files in {}'.format(len(self._files), self.manifest_file))
+
+    def _name_of(self, url: str, digest: str) -> str:
+        path = valid_path(os.path.join(self.media_path,
+                                       urllib.parse.unquote(os.path.basename(urllib.parse.urlsplit(url).path))))
+        # different files with the same name
+        if os.path.exists(path):
+            stem, ext = os.path.splitext(path)
+            path = '{}-{}{}'.format(stem, digest[:8], ext)
+        return os.path.basename(path)
+
+    def _download(self, url: str) -> str:
+        # a hidden file, so a partial download is resumed but never imported
+        part = os.path.join(self.media_path, '.{}'.format(hashlib.sha1(url.encode('utf8')).hexdigest()))
+        digest = hashlib.sha256()
+        # saved as is, not decoded
+        headers = {k: v for k, v in fake_headers().items() if k != 'Accept-Encoding'}
+        url_save(url, headers, part, force=True, digest=digest)
+        digest = digest.hexdigest()
+        with self._lock:
+            name = self._digests.get(digest)
+            if name:
+                os.remove(part)
+                self.deduplicated += 1
+            else:
+                name = self._name_of(url, digest)
+                os.replace(part, os.path.join(self.media_path, name))
+                self.downloaded += 1
+                self._digests[digest] = name
+            self._fp.write('{}\t{}\t{}\n'.format(url, name, digest))
+            self._fp.flush()
+        return name
+
+    async def fetch(self, url: str) -> str:
+        # each url is downloaded once, even if requested by many cards at a time
+        if url in self._files:
+            return self._files[url]
+        if url not in self._inflight:
+            self._inflight[url] = asyncio.ensure_future(
+                asyncio.get_running_loop().run_in_executor(self._executor, self._download, url))
+        future = self._inflight[url]
+        try:
+            name = await asyncio.shield(future)
+        finally:
+            if future.done():
+                self._inflight.pop(url, None)
+        self._files[url] = name
+        return name
+
+    async def localize(self, fields: List[str]) -> List[str]:
+        # point to local files, or leave the url if it can't be downloaded
+        urls = {m.group(2) for field in fields for m in _media_src.finditer(field)}
+        if not urls:
+            return fields
+        names: Dict[str, Optional[str]] = {}
+
+        async def fetch(url: str):
+            try:
+                names[url] = await self.fetch(url)
+            except Exception as e:
+                Log.w(TAG, 'can\'t download: {}, {}'.format(url, e))
+
+        await asyncio.gather(*[fetch(url) for url in urls])
+
+        def repl(m) -> str:
+            name = names.get(m.group(2))
+            return m.group(1) + name + m.group(3) if name else m.group(0)
+
+        return [_media_src.sub(repl, field) for field in fields]
+
+    def close(self):
+        self._executor.shutdown()
+        self._fp.close()
+        Log.i(TAG, 'downloaded {} media files to: {}, {} duplicates by content'.format(
+            self.downloaded, self.media_path, self.deduplicated))
@@ -1,94 +1,513 @@
+import asyncio
+import codecs
+import email.utils
+import http.client
+import io
 import mimetypes
 import os
+import random
 import re
 import socket
+import ssl
+import threading
+import time
+import weakref
 import urllib
 import urllib.parse
 import zlib
-from http.client import HTTPResponse
-from typing import Union, Tuple, Optional, Dict
-from urllib.request import Request, urlopen
+from datetime import datetime, timezone
+from http.client import HTTPResponse, HTTPConnection, HTTPSConnection
+from typing import Union, Tuple, Optional, Dict, List, AsyncIterator, Coroutine, Any, Callable
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen, getproxies
 
+from . import stats
+from .cache import CachedResponse, ResponseCache
 from .utils import valid_path, get_tag, Log
 
+try:
+    import brotli
+
+    # before 1.2 the output can't be limited, so decompression bombs can't be stopped
+    if not hasattr(brotli.Decompressor, 'can_accept_more_data'):
+        brotli = None
+except ImportError:
+    brotli = None
+
 __all__ = [
-    'fake_headers', 'urlopen_with_retry', 'url_get_content', 'url_save', 'url_save_guess_file',
+    'fake_headers', 'ResponseTooLargeError', 'ConnectionPool', 'urlopen_with_retry', 'url_get_content', 'url_save',
+    'url_save_guess_file',
+    'AsyncResponse', 'AsyncConnectionPool', 'async_pool', 'async_run', 'async_urlopen_with_retry',
+    'async_url_get_data', 'async_url_get_content',
 ]
 
 TAG = get_tag(__name__)
 
+DEFAULT_POOL_SIZE = 8
+
+DEFAULT_MAX_REDIRECTS = 10
+
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+# errors when sending on a connection the server has closed in the meantime
+_STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+# worth retrying, other status codes are fatal
+_RETRY_CODES = (408, 429, 500, 502, 503, 504)
+
+# the server asks us to slow down
+THROTTLE_CODES = (429, 503)
+
+DEFAULT_BURST = 4
+
+DEFAULT_BACKOFF = 0.5
+
+DEFAULT_MAX_BACKOFF = 30.0
+
+# ignore servers asking to wait longer
+MAX_RETRY_AFTER = 600.0
+
+DEFAULT_MAX_BODY_SIZE = 16 * 1024 * 1024
+
+
+class _PooledResponse(HTTPResponse):
+    _release = None
+
+    def _close_conn(self):
+        super()._close_conn()
+        release, self._release = self._release, None
+        if release:
+            # called from read() means the body has been consumed, so the connection can be reused
+            release(not getattr(self, '_closing', False) and not self.will_close)
+
+    def close(self):
+        # the body is not consumed unless it's empty
+        self._closing = self.fp is not None and self.length != 0
+        super().close()
+
+
+class _PooledHTTPConnection(HTTPConnection):
+    response_class = _PooledResponse
+
+
+class _PooledHTTPSConnection(HTTPSConnection):
+    response_class = _PooledResponse
+
+
+class ConnectionPool:
+    def __init__(self, maxsize: int = DEFAULT_POOL_SIZE, max_redirects: int = DEFAULT_MAX_REDIRECTS):
+        self.maxsize = maxsize
+        self.max_redirects = max_redirects
+        self._idle: Dict[Tuple[str, str], List[HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, scheme: str, host: str, timeout) -> Tuple[HTTPConnection, bool]:
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+            if idle:
+                conn = idle.pop()
+                conn.timeout = timeout
+                return conn, True
+        Log.d(TAG, 'new connection: {}://{}'.format(scheme, host))
+        if scheme == 'https':
+            return _PooledHTTPSConnection(host, timeout=timeout), False
+        return _PooledHTTPConnection(host, timeout=timeout), False
+
+    def _put(self, scheme: str, host: str, conn: HTTPConnection, reusable: bool):
+        if reusable and conn.sock is not None:
+            with self._lock:
+                idle = self._idle.setdefault((scheme, host), [])
+                if len(idle) < self.maxsize:
+                    idle.append(conn)
+                    return
+        conn.close()
+
+    def _request(self, method: str, url: str, body, headers: Dict[str, str], timeout) -> HTTPResponse:
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError('unsupported scheme: {}'.format(parts.scheme))
+        path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        while True:
+            conn, reused = self._get(parts.scheme, parts.netloc, timeout)
+            try:
+                if not reused:
+                    started = stats.start()
+                    conn.connect()
+                    stats.stop('connect', started)
+                started = stats.start()
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                stats.stop('ttfb', started)
+                stats.count('requests')
+            except _STALE_ERRORS as e:
+                conn.close()
+                if not reused:
+                    raise
+                Log.d(TAG, 'stale connection: {}://{}, {}'.format(parts.scheme, parts.netloc, e))
+                continue
+            except BaseException:
+                conn.close()
+                raise
+            response._release = lambda reusable: self._put(parts.scheme, parts.netloc, conn, reusable)
+            response.url = url
+            return response
+
+    def urlopen(self, url: Union[str, Request], data: bytes = None,
+                timeout=socket._GLOBAL_DEFAULT_TIMEOUT) -> HTTPResponse:
+        if isinstance(url, str):
+            url = Request(url, data)
+        method = url.get_method()
+        body = url.data if data is None else data
+        headers = dict(url.header_items())
+        location = url.full_url
+        for _ in range(self.max_redirects + 1):
+            response = self._request(method, location, body, headers, timeout)
+            if response.status not in _REDIRECT_CODES or not response.headers['Location']:
+                break
+            response.read()
+            response.close()
+            location = urllib.parse.urljoin(location, response.headers['Location'])
+            Log.d(TAG, 'redirect {} to: {}'.format(response.status, location))
+            if response.status == 303 or (response.status in (301, 302) and method == 'POST'):
+                method, body = 'GET', None
+        else:
+            raise HTTPError(location, response.status, 'too many redirects', response.headers, None)
+        if response.status >= 400:
+            # read the body to release the connection
+            raise HTTPError(location, response.status, response.reason, response.headers, io.BytesIO(response.read()))
+        return response
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+pool = ConnectionPool()
+
+# set to cache bodies read by url_get_content
+response_cache: Optional[ResponseCache] = None
+
+# only serve responses from cache
+offline = False
+
+# abort responses larger than this after decompression, unlimited if None
+max_body_size: Optional[int] = DEFAULT_MAX_BODY_SIZE
+
+# requests per second to each host, unlimited if None
+rate_limit: Optional[float] = None
+
+rate_burst = DEFAULT_BURST
+
+# the first delay before retrying, doubled for each attempt
+backoff = DEFAULT_BACKOFF
+
+max_backoff = DEFAULT_MAX_BACKOFF
+
+# called with each throttled attempt of async requests, e.g. to lower the concurrency before retrying
+on_throttle: Optional[Callable[[HTTPError], None]] = None
+
+
+class _Throttle:
+    # token bucket of a host shared by all workers, also paused by Retry-After
+    def __init__(self, rate: Optional[float], burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._time = time.monotonic()
+        self._until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        # takes a token, returns seconds to wait before using it
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._until - now)
+            if self.rate:
+                self._tokens = min(self.burst, self._tokens + (now - self._time) * self.rate)
+                self._time = now
+                self._tokens -= 1
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens / self.rate)
+            return wait
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._until = max(self._until, time.monotonic() + seconds)
+
+
+_throttles: Dict[str, _Throttle] = {}
+
+_throttles_lock = threading.Lock()
+
+
+def _throttle(url: Request) -> _Throttle:
+    with _throttles_lock:
+        if url.host not in _throttles:
+            _throttles[url.host] = _Throttle(rate_limit, rate_burst)
+        return _throttles[url.host]
+
+
+def _retryable(e: BaseException) -> bool:
+    if isinstance(e, HTTPError):
+        return e.code in _RETRY_CODES or e.code >= 500
+    if isinstance(e, URLError):
+        # e.g. not cached when offline
+        return isinstance(e.reason, OSError)
+    # timeouts, resets and broken responses
+    return isinstance(e, (OSError, asyncio.TimeoutError, http.client.HTTPException))
+
+
+def _retry_after(e: BaseException) -> Optional[float]:
+    value = e.headers['Retry-After'] if isinstance(e, HTTPError) and e.headers else None
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (email.utils.parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(0.0, seconds), MAX_RETRY_AFTER)
+
+
+def _retry_delay(url: Request, attempt: int, e: BaseException) -> float:
+    seconds = _retry_after(e)
+    if seconds is not None:
+        # every worker waits for the host
+        _throttle(url).pause(seconds)
+        return seconds
+    delay = min(max_backoff, backoff * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
 
 def fake_headers() -> Dict[str, str]:
     return {
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
         'Accept-Charset': 'utf-8,*;q=0.5',
-        'Accept-Encoding': 'gzip, deflate',
+        'Accept-Encoding': 'gzip, deflate, br' if brotli else 'gzip, deflate',
         'Accept-Language': 'utf-8, *;q=0.5',
         'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_6) AppleWebKit/537.36 (KHTML, like Gecko) '
                       'Chrome/76.0.3809.132 Safari/537.36',
     }
 
 
+def _cache_get(url: Request, cached: bool) -> Optional[CachedResponse]:
+    if cached and response_cache is not None and url.get_method() == 'GET':
+        response = response_cache.get(url.full_url)
+        if response:
+            stats.count('cache_hits')
+            return response
+    if offline:
+        raise URLError('offline, not cached: {}'.format(url.full_url))
+    return None
+
+
+def _cache_put(key: Optional[str], response, data: bytes):
+    if key and response_cache is not None and response.status == 200:
+        response_cache.put(key, response.geturl(), response.headers, data)
+
+
 def urlopen_with_retry(url: Union[str, Request],
                        headers: Dict[str, str] = None,
                        retry: int = 5,
-                       **kwargs) -> HTTPResponse:
-    Log.d(TAG, 'urlopen: url={}, headers={}, retry={}, kwargs={}'.format(url, headers, retry, kwargs))
+                       cached: bool = False,
+                       **kwargs) -> Union[HTTPResponse, CachedResponse]:
+    Log.d(TAG, 'urlopen: url={}, headers={}, retry={}, cached={}, kwargs={}'.format(url, headers, retry, cached,
+                                                                                 kwargs))
     if isinstance(url, str):
         url = Request(url)
     if headers:
         url.headers = headers
+    response = _cache_get(url, cached)
+    if response:
+        return response
+    # fall back to urllib when a proxy is configured
+    opener = urlopen if url.type in getproxies() else pool.urlopen
     for i in range(1, retry + 1):
+        time.sleep(_throttle(url).reserve())
         try:
-            return urlopen(url, **kwargs)
+            response = opener(url, **kwargs)
+            # the body is put into cache once read by url_get_content
+            response.cache_key = url.full_url if cached else None
+            return response
         except Exception as e:
-            Log.w(TAG, 'urlopen attempt {} error: {}'.format(i, e))
-            if i == retry:
+            if i == retry or not _retryable(e):
+                Log.w(TAG, 'urlopen attempt {} error: {}'.format(i, e))
                 raise e
+            delay = _retry_delay(url, i, e)
+            Log.w(TAG, 'urlopen attempt {} error: {}, retrying in {:.1f}s'.format(i, e, delay))
+            stats.count('retries')
+            time.sleep(delay)
+
+
+class ResponseTooLargeError(Exception):
+    pass
+
+
+class _BodyReader:
+    # decompresses and decodes a body chunk by chunk, so no full copy of the raw or decompressed body is kept
+    def __init__(self, headers, text: bool, keep_raw: bool = False):
+        length = headers['Content-Length']
+        if max_body_size and length and length.isdigit() and int(length) > max_body_size:
+            raise ResponseTooLargeError('{} bytes exceeds {}'.format(length, max_body_size))
+        self._encoding = (headers['Content-Encoding'] or '').lower()
+        self._decompressor = None
+        if self._encoding == 'gzip':
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        elif self._encoding == 'br':
+            if brotli is None:
+                raise NotImplementedError('brotli 1.2+ is not installed')
+            self._decompressor = brotli.Decompressor()
+        elif self._encoding not in ('', 'identity', 'deflate'):
+            raise NotImplementedError('unknown encoding: {}'.format(self._encoding))
+        self._decoder = None
+        if text:
+            charset = None
+            content_type = headers['Content-Type']
+            if content_type:
+                m = re.search(r'charset=([\w-]+)', content_type)
+                if m:
+                    charset = m.group(1)
+                    Log.d(TAG, 'charset={}'.format(charset))
+            self._decoder = codecs.getincrementaldecoder(charset or 'utf-8')('strict' if charset else 'ignore')
+        # wire bytes to put into cache
+        self.raw: Optional[List[bytes]] = [] if keep_raw else None
+        self.size = 0
+        self._parts = []
+        self._decode_time = 0.0
+
+    def _decompress(self, chunk: bytes) -> bytes:
+        if self._decompressor is None and self._encoding == 'deflate':
+            # some servers send raw deflate data without the zlib header
+            zlib_header = len(chunk) >= 2 and chunk[0] & 0x0f == 8 and (chunk[0] << 8 | chunk[1]) % 31 == 0
+            if not zlib_header:
+                Log.w(TAG, 'cannot decompress, treat as deflate data')
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS if zlib_header else -zlib.MAX_WBITS)
+        if self._decompressor is None:
+            return chunk
+        if self._encoding == 'br':
+            if not max_body_size:
+                return self._decompressor.process(chunk)
+            # stop early on decompression bombs, like zlib
+            data = self._decompressor.process(chunk, output_buffer_limit=max_body_size - self.size + 1)
+            if len(data) > max_body_size - self.size:
+                raise ResponseTooLargeError('decompressed body exceeds {}'.format(max_body_size))
+            return data
+        if max_body_size:
+            # stop early on decompression bombs
+            data = self._decompressor.decompress(chunk, max_body_size - self.size + 1)
+            if self._decompressor.unconsumed_tail:
+                raise ResponseTooLargeError('decompressed body exceeds {}'.format(max_body_size))
+            return data
+        return self._decompressor.decompress(chunk)
+
+    def _add(self, data: bytes):
+        self.size += len(data)
+        if max_body_size and self.size > max_body_size:
+            raise ResponseTooLargeError('body exceeds {}'.format(max_body_size))
+        if data:
+            self._parts.append(self._decoder.decode(data) if self._decoder else data)
 
+    def feed(self, chunk: bytes):
+        if self.raw is not None:
+            self.raw.append(chunk)
+        started = stats.start()
+        self._add(self._decompress(chunk))
+        if stats.enabled:
+            self._decode_time += time.perf_counter() - started
 
-def url_get_content(url: Union[str, Request, HTTPResponse],
+    def finish(self) -> Union[bytes, str]:
+        started = stats.start()
+        if self._decompressor is not None and self._encoding != 'br':
+            self._add(self._decompressor.flush())
+        if self._decoder:
+            self._parts.append(self._decoder.decode(b'', True))
+            content = ''.join(self._parts)
+        else:
+            content = b''.join(self._parts)
+        if stats.enabled:
+            stats.record('decode', self._decode_time + time.perf_counter() - started)
+        return content
+
+
+def _read_body(response, reader: _BodyReader, bs: int = 64 * 1024) -> Union[bytes, str]:
+    started = stats.start()
+    network = not isinstance(response, CachedResponse)
+    for chunk in iter(lambda: response.read(bs), b''):
+        if network:
+            stats.count('bytes_in', len(chunk))
+        reader.feed(chunk)
+    content = reader.finish()
+    stats.stop('body', started)
+    return content
+
+
+def url_get_content(url: Union[str, Request, HTTPResponse, CachedResponse],
                     headers: Dict[str, str] = None,
                     retry: int = 5,
+                    cached: bool = True,
                     **kwargs) -> Union[bytes, str]:
     Log.d(TAG, 'get content, url={}, headers={}, retry={}, kwargs={}'.format(url, headers, retry, kwargs))
-    if isinstance(url, HTTPResponse):
+    if isinstance(url, (HTTPResponse, CachedResponse)):
         response = url
         url = response.geturl()
     else:
-        response = urlopen_with_retry(url, headers, retry, **kwargs)
-    data = None
+        response = urlopen_with_retry(url, headers, retry, cached, **kwargs)
+    key = getattr(response, 'cache_key', None)
     for i in range(1, retry + 1):
         try:
-            data = response.read()
+            if response is None:
+                response = urlopen_with_retry(url, headers, 1, **kwargs)
+            reader = _BodyReader(response.headers, True, key is not None)
+            content = _read_body(response, reader)
             break
         except Exception as e:
             Log.w(TAG, 'read response attempt {} error: {}'.format(i, e))
-            if i == retry:
+            if response is not None:
+                response.close()
+                response = None
+            if i == retry or not _retryable(e):
                 raise e
-            else:
-                response = urlopen_with_retry(url, headers, 1, **kwargs)
+            stats.count('retries')
+            time.sleep(_retry_delay(url if isinstance(url, Request) else Request(url), i, e))
+    if reader.raw is not None:
+        _cache_put(key, response, b''.join(reader.raw))
+    return content
 
-    content_encoding = response.headers['Content-Encoding']
-    if content_encoding == 'gzip':
-        data = zlib.decompress(data, zlib.MAX_WBITS | 16)
-    elif content_encoding == 'deflate':
-        try:
-            data = zlib.decompress(data)
-        except zlib.error:
-            Log.w(TAG, 'cannot decompress, treat as deflate data')
-            data = zlib.decompress(data, -zlib.MAX_WBITS)
-    elif content_encoding:
-        raise NotImplementedError('unknown encoding: {}'.format(content_encoding))
-
-    charset = None
-    content_type = response.headers['Content-Type']
-    if content_type:
-        m = re.search(r'charset=([\w-]+)', content_type)
+
+def _guess_file(response) -> Tuple[str, Optional[int]]:
+    name, size = None, None
+    if response.headers['Content-Disposition']:
+        m = re.search(r'filename="(.+)"', response.headers['Content-Disposition'])
         if m:
-            charset = m.group(1)
-            Log.d(TAG, 'charset={}'.format(charset))
-    return data.decode(charset) if charset else data.decode('utf-8', 'ignore')
+            name = m.group(1)
+    if not name:
+        name = urllib.parse.unquote(os.path.basename(urllib.parse.urlparse(response.geturl()).path))
+        if not name:
+            name = 'file'
+            ext = mimetypes.guess_extension((response.headers['Content-Type'] or '').rsplit(';', 1)[0])
+            if ext:
+                name += ext
+    if response.headers['Content-Range']:
+        m = re.search(r'/(\d+)$', response.headers['Content-Range'])
+        if m:
+            size = int(m.group(1))
+    elif response.headers['Content-Length']:
+        size = int(response.headers['Content-Length'])
+    Log.d(TAG, 'guess file, name={}, size={}'.format(name, size))
+    return name, size
+
+
+def _range_start(response) -> int:
+    if response.status == 206 and response.headers['Content-Range']:
+        m = re.search(r'(\d+)-\d+/', response.headers['Content-Range'])
+        if m:
+            return int(m.group(1))
+    return 0
 
 
 def url_save_guess_file(url: Union[str, Request],
@@ -96,23 +515,8 @@ def url_save_guess_file(url: Union[str, Request],
                         retry: int = 5,
                         **kwargs) -> Tuple[str, Optional[int]]:
     Log.d(TAG, 'guess file, url={}, headers={}, retry={}, kwargs={}'.format(url, headers, retry, kwargs))
-    name, size = None, None
     with urlopen_with_retry(url, headers, retry, **kwargs) as response:
-        if response.headers['Content-Disposition']:
-            m = re.search(r'filename="(.+)"', response.headers['Content-Disposition'])
-            if m:
-                name = m.group(1)
-        if not name:
-            name = urllib.parse.unquote(os.path.basename(urllib.parse.urlparse(response.geturl()).path))
-            if not name:
-                name = 'file'
-                ext = mimetypes.guess_extension(response.headers['Content-Type'].rsplit(';', 1)[0])
-                if ext:
-                    name += ext
-        if response.headers['Content-Length']:
-            size = int(response.headers['Content-Length'])
-    Log.d(TAG, 'guess file, name={}, size={}'.format(name, size))
-    return name, size
+        return _guess_file(response)
 
 
 def url_save(url: Union[str, Request],
@@ -120,67 +524,92 @@ def url_save(url: Union[str, Request],
              filename: str = None,
              force: bool = False,
              reporthook=None,
+             digest=None,
              **kwargs) -> Tuple[str, int]:
-    Log.d(TAG, 'url save, url={}, headers={}, filename={}, force={}, reporthook={}, kwargs={}'.format(
-        url, headers, filename, force, reporthook, kwargs))
+    Log.d(TAG, 'url save, url={}, headers={}, filename={}, force={}, reporthook={}, digest={}, kwargs={}'.format(
+        url, headers, filename, force, reporthook, digest, kwargs))
     if isinstance(url, str):
         url = Request(url)
     if headers:
-        url.headers = headers
-    else:
-        headers = url.headers
+        url.headers = dict(headers)
+    headers = url.headers
 
-    name, total_size = url_save_guess_file(url, **kwargs)
+    def part_of(file: str) -> int:
+        return os.path.getsize(file + '.part') if os.path.exists(file + '.part') else 0
+
+    # the filename is known in advance, so try to resume in the first request
+    part_size = 0
+    if filename is not None:
+        filename = valid_path(filename, force)
+        part_size = part_of(filename)
+        if part_size:
+            headers['Range'] = 'bytes={}-'.format(part_size)
+    try:
+        response = urlopen_with_retry(url, **kwargs)
+    except HTTPError as e:
+        if e.code != 416 or 'Range' not in headers:
+            raise
+        # the '.part' file is not smaller than the file
+        headers.pop('Range')
+        response = urlopen_with_retry(url, **kwargs)
+    headers.pop('Range', None)
+    name, total_size = _guess_file(response)
     if total_size is None:
         total_size = float('inf')
     if filename is None:
-        filename = os.path.join(os.curdir, name)
-    filename = valid_path(filename, force)
-
-    mode = 'wb'
+        filename = valid_path(os.path.join(os.curdir, name), force)
+        part_size = part_of(filename)
+        if 0 < part_size < total_size and response.headers['Accept-Ranges'] == 'bytes':
+            response.close()
+            headers['Range'] = 'bytes={}-'.format(part_size)
+            response = urlopen_with_retry(url, **kwargs)
+            headers.pop('Range', None)
     part_file = filename + '.part' if total_size != float('inf') else filename
-    part_size = 0
-    if os.path.exists(part_file):
-        part_size = os.path.getsize(part_file)
-        if 0 < part_size < total_size:
-            Log.i(TAG, '\'.part\' file already exists: {}, trying to append'.format(part_file))
-            mode = 'ab'
-        else:
-            part_size = 0
 
-    if part_size < total_size:
+    if 0 < part_size < total_size and _range_start(response) == part_size:
+        Log.i(TAG, '\'.part\' file already exists: {}, trying to append'.format(part_file))
+        mode = 'ab'
+        if digest is not None:
+            with open(part_file, 'rb') as f:
+                for buffer in iter(lambda: f.read(512 * 1024), b''):
+                    digest.update(buffer)
+    else:
         if part_size:
-            headers['Range'] = 'bytes={}-'.format(part_size)
-        response = urlopen_with_retry(url, **kwargs)
-        remaining_size = float('inf')
-        if response.headers['Content-Range']:
-            m = re.search(r'(\d+)-(\d+)/(\d+)$', response.headers['Content-Range'])
-            remaining_size = int(m.group(3)) - int(m.group(1))
-        elif response.headers['Content-Length']:
-            remaining_size = int(response.headers['Content-Length'])
-        if part_size + remaining_size != total_size:
             Log.i(TAG, '\'.part\' file inconsistent with server, retrieving')
-            part_size = 0
-            mode = 'wb'
+        part_size = 0
+        mode = 'wb'
 
-        with open(part_file, mode) as f:
-            bs = 512 * 1024
-            while part_size < total_size:
-                buffer = None
-                try:
-                    buffer = response.read(bs)
-                except socket.timeout:
-                    Log.w(TAG, 'timeout during downloading, retrying')
-                if buffer:
-                    f.write(buffer)
-                    part_size += len(buffer)
-                    if reporthook:
-                        reporthook(part_size, total_size)
-                else:
-                    if part_size >= total_size or total_size == float('inf'):
-                        break
-                    headers['Range'] = 'bytes={}-'.format(part_size)
-                    response = urlopen_with_retry(url, **kwargs)
+    with open(part_file, mode) as f:
+        bs = 512 * 1024
+        # bytes of the current response to skip if the server ignores Range
+        skip = part_size - _range_start(response)
+        while part_size < total_size:
+            buffer = None
+            try:
+                buffer = response.read(bs)
+            except socket.timeout:
+                Log.w(TAG, 'timeout during downloading, retrying')
+            if buffer and skip > 0:
+                n = min(skip, len(buffer))
+                buffer, skip = buffer[n:], skip - n
+                if not buffer:
+                    continue
+            if buffer:
+                f.write(buffer)
+                if digest is not None:
+                    digest.update(buffer)
+                part_size += len(buffer)
+                if reporthook:
+                    reporthook(part_size, total_size)
+            else:
+                if part_size >= total_size or total_size == float('inf'):
+                    break
+                response.close()
+                headers['Range'] = 'bytes={}-'.format(part_size)
+                response = urlopen_with_retry(url, **kwargs)
+                headers.pop('Range', None)
+                skip = part_size - _range_start(response)
+    response.close()
     assert part_size == os.path.getsize(part_file)
     if part_file != filename:
         if os.access(filename, os.W_OK):
@@ -188,3 +617,387 @@ def url_save(url: Union[str, Request],
         os.rename(part_file, filename)
     Log.d(TAG, 'url save completed, file={}, size={}'.format(filename, part_size))
     return filename, part_size
+
+
+_Stream = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class AsyncResponse:
+    def __init__(self, status: int, reason: str, version: str, headers: http.client.HTTPMessage, url: str,
+                 method: str, stream: _Stream, release):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.url = url
+        self._stream = stream
+        self._release = release
+        self._reusable = version == 'HTTP/1.1' and (headers['Connection'] or '').lower() != 'close'
+        self._chunked = (headers['Transfer-Encoding'] or '').lower() == 'chunked'
+        self._length = None
+        if status in (204, 304) or 100 <= status < 200 or method == 'HEAD':
+            self._length = 0
+        elif not self._chunked and headers['Content-Length']:
+            self._length = int(headers['Content-Length'])
+        if not self._chunked and self._length is None:
+            # body ends when the server closes the connection
+            self._reusable = False
+        if self._length == 0:
+            self._done()
+
+    def geturl(self) -> str:
+        return self.url
+
+    def _done(self):
+        release, self._release = self._release, None
+        if release:
+            release(self._stream, self._reusable)
+
+    async def iter_chunks(self, bs: int = 64 * 1024) -> AsyncIterator[bytes]:
+        if self._release is None:
+            return
+        reader = self._stream[0]
+        try:
+            if self._chunked:
+                while True:
+                    try:
+                        size = int((await reader.readline()).split(b';', 1)[0], 16)
+                        if size == 0:
+                            # trailers
+                            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                                pass
+                            break
+                        chunk = await reader.readexactly(size)
+                    except (asyncio.IncompleteReadError, ValueError) as e:
+                        # closed mid-body or a garbled chunk size, retryable like http.client does
+                        raise http.client.IncompleteRead(getattr(e, 'partial', b'')) from e
+                    yield chunk
+                    await reader.readline()
+            elif self._length is not None:
+                remaining = self._length
+                while remaining > 0:
+                    buffer = await reader.read(min(bs, remaining))
+                    if not buffer:
+                        raise http.client.IncompleteRead(b'', remaining)
+                    remaining -= len(buffer)
+                    yield buffer
+            else:
+                buffer = await reader.read(bs)
+                while buffer:
+                    yield buffer
+                    buffer = await reader.read(bs)
+        except BaseException:
+            self._reusable = False
+            self.close()
+            raise
+        self._done()
+
+    async def read(self) -> bytes:
+        return b''.join([chunk async for chunk in self.iter_chunks()])
+
+    def close(self):
+        if self._release is not None:
+            # the body is not consumed
+            self._reusable = False
+            self._done()
+
+
+class _ThreadedResponse:
+    # a response of urllib read in threads, for requests through a proxy
+    def __init__(self, response: HTTPResponse):
+        self._response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.url = response.geturl()
+
+    def geturl(self) -> str:
+        return self.url
+
+    async def iter_chunks(self, bs: int = 64 * 1024) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                buffer = await loop.run_in_executor(None, self._response.read, bs)
+                if not buffer:
+                    break
+                yield buffer
+        finally:
+            self.close()
+
+    async def read(self) -> bytes:
+        return b''.join([chunk async for chunk in self.iter_chunks()])
+
+    def close(self):
+        self._response.close()
+
+
+async def _async_urlopen_proxied(url: Request, **kwargs) -> _ThreadedResponse:
+    # the async client doesn't speak to proxies, so urllib is run in a thread like the sync path does
+    response = await asyncio.get_running_loop().run_in_executor(None, lambda: urlopen(url, **kwargs))
+    return _ThreadedResponse(response)
+
+
+class AsyncConnectionPool:
+    def __init__(self, maxsize: int = DEFAULT_POOL_SIZE, max_redirects: int = DEFAULT_MAX_REDIRECTS):
+        self.maxsize = maxsize
+        self.max_redirects = max_redirects
+        self._idle: Dict[Tuple[str, str], List[_Stream]] = {}
+        self._ssl = None
+
+    async def _connect(self, scheme: str, netloc: str) -> _Stream:
+        Log.d(TAG, 'new async connection: {}://{}'.format(scheme, netloc))
+        parts = urllib.parse.urlsplit('//' + netloc)
+        started = stats.start()
+        if scheme == 'https':
+            if self._ssl is None:
+                self._ssl = ssl.create_default_context()
+            stream = await asyncio.open_connection(parts.hostname, parts.port or 443, ssl=self._ssl)
+        else:
+            stream = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        stats.stop('connect', started)
+        return stream
+
+    def _put(self, scheme: str, netloc: str, stream: _Stream, reusable: bool):
+        idle = self._idle.setdefault((scheme, netloc), [])
+        if reusable and len(idle) < self.maxsize:
+            idle.append(stream)
+        else:
+            stream[1].close()
+
+    async def _request(self, method: str, url: str, body: Optional[bytes], headers: Dict[str, str]) -> AsyncResponse:
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError('unsupported scheme: {}'.format(parts.scheme))
+        path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        lines = ['{} {} HTTP/1.1'.format(method, path), 'Host: {}'.format(parts.netloc)]
+        lines.extend('{}: {}'.format(k, v) for k, v in headers.items() if k.lower() != 'host')
+        if body is not None:
+            lines.append('Content-Length: {}'.format(len(body)))
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b'')
+        while True:
+            idle = self._idle.get((parts.scheme, parts.netloc))
+            reused = bool(idle)
+            stream = idle.pop() if reused else await self._connect(parts.scheme, parts.netloc)
+            reader, writer = stream
+            try:
+                started = stats.start()
+                writer.write(request)
+                await writer.drain()
+                status_line = await reader.readline()
+                if not status_line:
+                    raise http.client.RemoteDisconnected('remote end closed connection without response')
+                version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(None, 2) + [''])[:3]
+                header_lines = []
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    header_lines.append(line)
+                stats.stop('ttfb', started)
+                stats.count('requests')
+            except _STALE_ERRORS as e:
+                writer.close()
+                if not reused:
+                    raise
+                Log.d(TAG, 'stale async connection: {}://{}, {}'.format(parts.scheme, parts.netloc, e))
+                continue
+            except BaseException:
+                writer.close()
+                raise
+            message = http.client.parse_headers(io.BytesIO(b''.join(header_lines)))
+            return AsyncResponse(int(status), reason, version, message, url, method, stream,
+                                 lambda st, reusable: self._put(parts.scheme, parts.netloc, st, reusable))
+
+    async def urlopen(self, url: Union[str, Request], data: bytes = None, timeout: float = None) -> AsyncResponse:
+        if isinstance(url, str):
+            url = Request(url, data)
+        if timeout is None:
+            timeout = socket.getdefaulttimeout()
+        method = url.get_method()
+        body = url.data if data is None else data
+        headers = dict(url.header_items())
+        location = url.full_url
+        for _ in range(self.max_redirects + 1):
+            response = await asyncio.wait_for(self._request(method, location, body, headers), timeout)
+            if response.status not in _REDIRECT_CODES or not response.headers['Location']:
+                break
+            await asyncio.wait_for(response.read(), timeout)
+            location = urllib.parse.urljoin(location, response.headers['Location'])
+            Log.d(TAG, 'redirect {} to: {}'.format(response.status, location))
+            if response.status == 303 or (response.status in (301, 302) and method == 'POST'):
+                method, body = 'GET', None
+        else:
+            raise HTTPError(location, response.status, 'too many redirects', response.headers, None)
+        if response.status >= 400:
+            data = await asyncio.wait_for(response.read(), timeout)
+            raise HTTPError(location, response.status, response.reason, response.headers, io.BytesIO(data))
+        return response
+
+    async def close(self):
+        idle, self._idle = self._idle, {}
+        writers = [writer for streams in idle.values() for _, writer in streams]
+        for writer in writers:
+            writer.close()
+        for writer in writers:
+            try:
+                await writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
+
+
+# one pool for each event loop
+_async_pools: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncConnectionPool]' = \
+    weakref.WeakKeyDictionary()
+
+
+def async_pool() -> AsyncConnectionPool:
+    loop = asyncio.get_running_loop()
+    if loop not in _async_pools:
+        _async_pools[loop] = AsyncConnectionPool()
+    return _async_pools[loop]
+
+
+def async_run(main: Coroutine[Any, Any, Any]) -> Any:
+    async def run():
+        try:
+            return await main
+        finally:
+            await async_pool().close()
+
+    return asyncio.run(run())
+
+
+async def async_urlopen_with_retry(url: Union[str, Request],
+                                   headers: Dict[str, str] = None,
+                                   retry: int = 5,
+                                   cached: bool = False,
+                                   revalidate: bool = False,
+                                   **kwargs) -> Union[AsyncResponse, _ThreadedResponse, CachedResponse]:
+    Log.d(TAG, 'async urlopen: url={}, headers={}, retry={}, cached={}, revalidate={}, kwargs={}'.format(
+        url, headers, retry, cached, revalidate, kwargs))
+    if isinstance(url, str):
+        url = Request(url)
+    if headers:
+        url.headers = dict(headers)
+    stale = None
+    if cached and revalidate and response_cache is not None and not offline:
+        # send a conditional request even if the cached response hasn't expired
+        stale = response_cache.get(url.full_url, allow_expired=True)
+        if stale and stale.headers['ETag']:
+            url.headers['If-None-Match'] = stale.headers['ETag']
+        if stale and stale.headers['Last-Modified']:
+            url.headers['If-Modified-Since'] = stale.headers['Last-Modified']
+    else:
+        response = _cache_get(url, cached)
+        if response:
+            return response
+    # fall back to urllib when a proxy is configured
+    proxied = url.type in getproxies()
+    if proxied:
+        Log.d(TAG, 'async urlopen through proxy: {}'.format(url.full_url))
+    for i in range(1, retry + 1):
+        await asyncio.sleep(_throttle(url).reserve())
+        try:
+            if proxied:
+                try:
+                    response = await _async_urlopen_proxied(url, **kwargs)
+                except HTTPError as e:
+                    # urllib raises for 304
+                    if not stale or e.code != 304:
+                        raise
+                    e.close()
+                    Log.d(TAG, 'not modified: {}'.format(url.full_url))
+                    response_cache.refresh(url.full_url)
+                    return stale
+            else:
+                response = await async_pool().urlopen(url, **kwargs)
+            if stale and response.status == 304:
+                Log.d(TAG, 'not modified: {}'.format(url.full_url))
+                await response.read()
+                response_cache.refresh(url.full_url)
+                return stale
+            response.cache_key = url.full_url if cached else None
+            return response
+        except Exception as e:
+            if on_throttle and isinstance(e, HTTPError) and e.code in THROTTLE_CODES:
+                on_throttle(e)
+            if i == retry or not _retryable(e):
+                Log.w(TAG, 'async urlopen attempt {} error: {!r}'.format(i, e))
+                if stale:
+                    Log.w(TAG, 'can\'t revalidate, using cached: {}'.format(url.full_url))
+                    return stale
+                raise e
+            delay = _retry_delay(url, i, e)
+            Log.w(TAG, 'async urlopen attempt {} error: {!r}, retrying in {:.1f}s'.format(i, e, delay))
+            stats.count('retries')
+            await asyncio.sleep(delay)
+
+
+async def _async_read_body(response: Union[AsyncResponse, _ThreadedResponse, CachedResponse],
+                           reader: _BodyReader) -> Union[bytes, str]:
+    if isinstance(response, CachedResponse):
+        return _read_body(response, reader)
+    started = stats.start()
+    async for chunk in response.iter_chunks():
+        stats.count('bytes_in', len(chunk))
+        reader.feed(chunk)
+    content = reader.finish()
+    stats.stop('body', started)
+    return content
+
+
+async def _async_read(url: Union[str, Request, AsyncResponse, _ThreadedResponse, CachedResponse],
+                      headers: Dict[str, str],
+                      retry: int,
+                      cached: bool,
+                      revalidate: bool,
+                      text: bool,
+                      **kwargs) -> Union[bytes, str]:
+    if isinstance(url, (AsyncResponse, _ThreadedResponse, CachedResponse)):
+        response = url
+        url = response.geturl()
+    else:
+        response = await async_urlopen_with_retry(url, headers, retry, cached, revalidate, **kwargs)
+    if isinstance(response, CachedResponse):
+        return _read_body(response, _BodyReader(response.headers, text))
+    key = getattr(response, 'cache_key', None)
+    for i in range(1, retry + 1):
+        try:
+            if response is None:
+                response = await async_urlopen_with_retry(url, headers, 1, **kwargs)
+            reader = _BodyReader(response.headers, text, key is not None)
+            content = await asyncio.wait_for(_async_read_body(response, reader),
+                                             kwargs.get('timeout') or socket.getdefaulttimeout())
+            break
+        except Exception as e:
+            Log.w(TAG, 'read response attempt {} error: {!r}'.format(i, e))
+            if response is not None:
+                response.close()
+                response = None
+            if i == retry or not _retryable(e):
+                raise e
+            stats.count('retries')
+            await asyncio.sleep(_retry_delay(url if isinstance(url, Request) else Request(url), i, e))
+    if reader.raw is not None:
+        _cache_put(key, response, b''.join(reader.raw))
+    return content
+
+
+async def async_url_get_data(url: Union[str, Request, AsyncResponse, _ThreadedResponse, CachedResponse],
+                             headers: Dict[str, str] = None,
+                             retry: int = 5,
+                             cached: bool = True,
+                             revalidate: bool = False,
+                             **kwargs) -> bytes:
+    Log.d(TAG, 'async get data, url={}, headers={}, retry={}, kwargs={}'.format(url, headers, retry, kwargs))
+    return await _async_read(url, headers, retry, cached, revalidate, False, **kwargs)
+
+
+async def async_url_get_content(url: Union[str, Request, AsyncResponse, _ThreadedResponse, CachedResponse],
+                                headers: Dict[str, str] = None,
+                                retry: int = 5,
+                                cached: bool = True,
+                                revalidate: bool = False,
+                                **kwargs) -> str:
+    Log.d(TAG, 'async get content, url={}, headers={}, retry={}, kwargs={}'.format(url, headers, retry, kwargs))
+    return await _async_read(url, headers, retry, cached, revalidate, True, **kwargs)
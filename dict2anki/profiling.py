@@ -0,0 +1,127 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from typing import List, Optional
+
+from .utils import get_tag, Log
+
+__all__ = [
+    'Profiler',
+]
+
+TAG = get_tag(__name__)
+
+DEFAULT_TOP = 20
+
+# frames kept for each allocation
+DEFAULT_FRAMES = 10
+
+PSTATS_FILE = 'profile.pstats'
+
+PROFILE_FILE = 'profile.txt'
+
+SNAPSHOT_FILE = 'memory.snapshot'
+
+MEMORY_FILE = 'memory.txt'
+
+# cProfile uses sys.monitoring since 3.12, which sees all threads
+_PROFILES_ALL_THREADS = sys.version_info >= (3, 12)
+
+
+class Profiler:
+    def __init__(self, out_path: str, cpu: bool = True, memory: bool = False, top: int = DEFAULT_TOP):
+        self.out_path = out_path
+        self.cpu = cpu
+        self.memory = memory
+        self.top = top
+        self._profile: Optional[cProfile.Profile] = None
+        # profiles of other threads, e.g. executors of asyncio
+        self._thread_profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def _profile_thread(self, frame, event, arg):
+        # set by threading.setprofile, called on the first event of a new thread
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        with self._lock:
+            self._thread_profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        if self.memory:
+            tracemalloc.start(DEFAULT_FRAMES)
+        if self.cpu:
+            if not _PROFILES_ALL_THREADS:
+                threading.setprofile(self._profile_thread)
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self):
+        if self._profile:
+            self._profile.disable()
+            if not _PROFILES_ALL_THREADS:
+                threading.setprofile(None)
+        snapshot = None
+        if self.memory:
+            # before writing the profile, which allocates a lot
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+            ])
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        os.makedirs(self.out_path, exist_ok=True)
+        if self._profile:
+            self._write_profile()
+        if snapshot:
+            self._write_memory(snapshot, current, peak)
+
+    def _write_profile(self):
+        stats = pstats.Stats(self._profile)
+        with self._lock:
+            for profile in self._thread_profiles:
+                stats.add(profile)
+        pstats_file = os.path.join(self.out_path, PSTATS_FILE)
+        stats.dump_stats(pstats_file)
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats('tottime').print_stats(self.top)
+        stats.sort_stats('cumulative').print_stats(self.top)
+        profile_file = os.path.join(self.out_path, PROFILE_FILE)
+        with open(profile_file, 'w', encoding='utf8') as f:
+            f.write(out.getvalue())
+        Log.i(TAG, 'profiled {} threads, wrote {} and {}'.format(1 + len(self._thread_profiles), pstats_file,
+                                                               profile_file))
+        Log.i(TAG, 'hottest functions:')
+        for (file, line, name), (_, calls, tottime, cumtime, _) in sorted(
+                stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:self.top]:
+            Log.i(TAG, '{:>9.3f}s {:>9.3f}s {:>9} {}:{}({})'.format(tottime, cumtime, calls, os.path.basename(file),
+                                                                   line, name))
+
+    def _write_memory(self, snapshot: tracemalloc.Snapshot, current: int, peak: int):
+        snapshot_file = os.path.join(self.out_path, SNAPSHOT_FILE)
+        snapshot.dump(snapshot_file)
+        lines = ['current: {:.1f} KiB, peak: {:.1f} KiB'.format(current / 1024, peak / 1024)]
+        for stat in snapshot.statistics('lineno')[:self.top]:
+            lines.append(str(stat))
+        lines.append('')
+        for stat in snapshot.statistics('traceback')[:3]:
+            lines.append('{} blocks, {:.1f} KiB'.format(stat.count, stat.size / 1024))
+            lines.extend(stat.traceback.format())
+        memory_file = os.path.join(self.out_path, MEMORY_FILE)
+        with open(memory_file, 'w', encoding='utf8') as f:
+            f.write('\n'.join(lines) + '\n')
+        Log.i(TAG, 'wrote {} and {}'.format(snapshot_file, memory_file))
+        for line in lines[:11]:
+            Log.i(TAG, line)
+
+    def __enter__(self) -> 'Profiler':
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
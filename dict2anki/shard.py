@@ -0,0 +1,170 @@
+import csv
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from .journal import Journal, CARD, DUPLICATE, SKIPPED, _digest, row_digest
+from .utils import get_tag, valid_path, Log
+
+__all__ = [
+    'MergeError', 'parse_shard', 'shard_of', 'shard_dir', 'merge',
+]
+
+TAG = get_tag(__name__)
+
+# files copied from the first shard
+SHARED_FILES = ('front-template.txt', 'back-template.txt', 'styling.txt')
+
+# local media of cards, e.g. <source type="audio/mpeg" src="ukcolou002.mp3"/>
+_media_ref = re.compile(r'(\ssrc=")([^"/]+)(")')
+
+
+class MergeError(Exception):
+    pass
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    # "i/N", 0 <= i < N
+    try:
+        index, count = (int(s) for s in value.split('/'))
+    except ValueError:
+        raise ValueError('invalid shard: {}, expected i/N'.format(value))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError('invalid shard: {}, expected 0 <= i < N'.format(value))
+    return index, count
+
+
+def shard_of(key: str, count: int) -> int:
+    # stable across processes and hosts, unlike hash()
+    return _digest(key) % count
+
+
+def shard_dir(index: int, count: int) -> str:
+    return 'shard-{}-of-{}'.format(index, count)
+
+
+def _sha256(file: str) -> str:
+    digest = hashlib.sha256()
+    with open(file, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _same(a: str, b: str) -> bool:
+    return os.path.getsize(a) == os.path.getsize(b) and _sha256(a) == _sha256(b)
+
+
+def _plan_media(shard_paths: List[str], media_folder: str) -> Tuple[Dict[str, str], Dict[str, Dict[str, str]]]:
+    # files by merged name, and renamed files of each shard, as shards name files without knowing each other
+    files: Dict[str, str] = {}
+    renames: Dict[str, Dict[str, str]] = {}
+    for path in shard_paths:
+        for file in sorted(glob.glob(os.path.join(path, media_folder, '*'))):
+            name = os.path.basename(file)
+            if name in files and not _same(files[name], file):
+                stem, ext = os.path.splitext(name)
+                renamed = '{}-{}{}'.format(stem, _sha256(file)[:8], ext)
+                Log.w(TAG, 'different media files named {}, renamed the one of {} to {}'.format(name, path, renamed))
+                renames.setdefault(path, {})[name] = renamed
+                name = renamed
+            files.setdefault(name, file)
+    return files, renames
+
+
+def _rename_media(row: List[str], renames: Dict[str, str]) -> List[str]:
+    return [_media_ref.sub(lambda m: m.group(1) + renames.get(m.group(2), m.group(2)) + m.group(3), field)
+            for field in row]
+
+
+def _copy_shared(shard_paths: List[str], out_path: str, media_folder: str, media: Dict[str, str]):
+    for name in SHARED_FILES:
+        for path in shard_paths:
+            if os.path.exists(os.path.join(path, name)):
+                shutil.copyfile(os.path.join(path, name), valid_path(os.path.join(out_path, name)))
+                break
+    for name, file in media.items():
+        dst = os.path.join(out_path, media_folder, name)
+        if not os.path.exists(dst) or not _same(file, dst):
+            shutil.copyfile(file, valid_path(dst))
+
+
+def merge(shard_paths: List[str], words: Iterable[str], normalize: Callable[[str], str], out_path: str,
+          cards: str = 'cards.txt', journal: str = 'cards.journal', media_folder: str = 'collection.media'):
+    # shards may hold more cards than fit in memory, so they are indexed in a temporary database
+    csv.field_size_limit(sys.maxsize)
+    db = sqlite3.connect('')
+    db.execute('CREATE TABLE words (word TEXT PRIMARY KEY, status TEXT NOT NULL, actual TEXT NOT NULL)')
+    db.execute('CREATE TABLE cards (actual TEXT PRIMARY KEY, row TEXT NOT NULL, path TEXT NOT NULL)')
+    db.execute('CREATE TABLE rows (path TEXT NOT NULL, row TEXT NOT NULL, fields TEXT NOT NULL, '
+               'PRIMARY KEY (path, row))')
+    media, renames = _plan_media(shard_paths, media_folder)
+    for path in shard_paths:
+        entries = list(Journal.entries(os.path.join(path, journal)))
+        # a word done in any shard wins over a failure
+        db.executemany('INSERT OR REPLACE INTO words VALUES (?, ?, ?)',
+                       ((word, status, actual) for status, word, actual, _ in entries if status != SKIPPED))
+        db.executemany('INSERT OR IGNORE INTO words VALUES (?, ?, ?)',
+                       ((word, status, actual) for status, word, actual, _ in entries if status == SKIPPED))
+        db.executemany('INSERT OR IGNORE INTO cards VALUES (?, ?, ?)',
+                       ((actual, row, path) for status, _, actual, row in entries if status == CARD))
+        # rows are found by the digests in the journal, not by their positions
+        count = 0
+        with open(os.path.join(path, cards), encoding='utf8', newline='') as fp:
+            for row in csv.reader(fp):
+                # found by the digest written, but pointing to renamed media
+                fields = _rename_media(row, renames[path]) if path in renames else row
+                db.execute('INSERT OR IGNORE INTO rows VALUES (?, ?, ?)',
+                           (path, row_digest(row), json.dumps(fields, ensure_ascii=False)))
+                count += 1
+        Log.i(TAG, 'indexed {} cards from: {}'.format(count, path))
+    db.commit()
+    lost = db.execute('SELECT cards.actual, cards.path FROM cards '
+                      'LEFT JOIN rows ON cards.path = rows.path AND cards.row = rows.row '
+                      'WHERE rows.row IS NULL').fetchall()
+    if lost:
+        db.close()
+        raise MergeError('{} cards in journals not found in {}, e.g. "{}" of: {}'.format(
+            len(lost), cards, lost[0][0], lost[0][1]))
+
+    _copy_shared(shard_paths, out_path, media_folder, media)
+    file = valid_path(os.path.join(out_path, cards))
+    written, missing, skipped = set(), [], 0
+    merged = Journal(valid_path(os.path.join(out_path, journal)), append=False)
+    with open(file, 'w', encoding='utf8', newline='') as fp:
+        writer = csv.writer(fp)
+        for word in words:
+            key = normalize(word)
+            row = db.execute('SELECT status, actual FROM words WHERE word = ?', (key,)).fetchone()
+            if not row:
+                missing.append(word)
+                continue
+            status, actual = row
+            if status == SKIPPED:
+                skipped += 1
+                merged.record(SKIPPED, key)
+                continue
+            card = None if actual in written else db.execute(
+                'SELECT rows.fields FROM cards JOIN rows ON cards.path = rows.path AND cards.row = rows.row '
+                'WHERE cards.actual = ?',
+                (actual,)).fetchone()
+            if card:
+                fields = json.loads(card[0])
+                writer.writerow(fields)
+                written.add(actual)
+                merged.record(CARD, key, actual, row_digest(fields))
+            else:
+                merged.record(DUPLICATE, key, actual)
+    merged.close()
+    db.close()
+    Log.i(TAG, 'merged {} cards from {} shards to: {}'.format(len(written), len(shard_paths), file))
+    if skipped:
+        Log.w(TAG, '{} words failed in shards, run them again with --resume'.format(skipped))
+    if missing:
+        Log.e(TAG, '{} words not found in shards:\n{}'.format(len(missing), '\n'.join(missing)))
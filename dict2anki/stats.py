@@ -0,0 +1,77 @@
+import math
+import time
+from array import array
+from collections import Counter
+from typing import Dict
+
+from .utils import get_tag, Log
+
+__all__ = [
+    'start', 'stop', 'record', 'count', 'reset', 'report', 'log_report',
+]
+
+TAG = get_tag(__name__)
+
+# hooks are no-ops unless enabled
+enabled = False
+
+_durations: Dict[str, array] = {}
+
+_counters = Counter()
+
+
+def start() -> float:
+    return time.perf_counter() if enabled else 0.0
+
+
+def stop(stage: str, started: float):
+    if enabled:
+        record(stage, time.perf_counter() - started)
+
+
+def record(stage: str, seconds: float):
+    if enabled:
+        if stage not in _durations:
+            _durations[stage] = array('d')
+        _durations[stage].append(seconds)
+
+
+def count(name: str, n: int = 1):
+    if enabled:
+        _counters[name] += n
+
+
+def reset():
+    _durations.clear()
+    _counters.clear()
+
+
+def _percentile(values, p: float) -> float:
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def report() -> dict:
+    stages = {}
+    for stage, durations in _durations.items():
+        values = sorted(durations)
+        if not values:
+            continue
+        stages[stage] = {
+            'count': len(values),
+            'total': sum(values),
+            'p50': _percentile(values, 50),
+            'p95': _percentile(values, 95),
+            'p99': _percentile(values, 99),
+            'max': values[-1],
+        }
+    return {'stages': stages, 'counters': dict(_counters)}
+
+
+def log_report():
+    result = report()
+    Log.i(TAG, '{:<10} {:>8} {:>10} {:>10} {:>10} {:>10}'.format('stage', 'count', 'total', 'p50', 'p95', 'p99'))
+    for stage, s in result['stages'].items():
+        Log.i(TAG, '{:<10} {:>8} {:>9.2f}s {:>8.1f}ms {:>8.1f}ms {:>8.1f}ms'.format(
+            stage, s['count'], s['total'], s['p50'] * 1000, s['p95'] * 1000, s['p99'] * 1000))
+    if result['counters']:
+        Log.i(TAG, ', '.join('{}={}'.format(k, v) for k, v in sorted(result['counters'].items())))
@@ -0,0 +1,63 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Optional, Tuple, List, Dict
+
+from .utils import get_tag, Log
+
+__all__ = [
+    'CardStore',
+]
+
+TAG = get_tag(__name__)
+
+DEFAULT_BATCH_SIZE = 256
+
+
+class CardStore:
+    def __init__(self, path: str, version: str, ttl: float = None, batch: int = DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.version = version
+        self.ttl = ttl
+        self.batch = batch
+        self._pending: Dict[str, Tuple[str, str, str, str, float]] = {}
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS cards ('
+                         'word TEXT NOT NULL, version TEXT NOT NULL, actual TEXT NOT NULL, fields TEXT NOT NULL, '
+                         'time REAL NOT NULL, PRIMARY KEY (word, version))')
+        self._db.commit()
+        Log.d(TAG, 'opened card store: {}, version={}'.format(path, version))
+
+    def get(self, word: str) -> Optional[Tuple[str, List[str]]]:
+        row = self._pending.get(word)
+        if row:
+            return row[2], json.loads(row[3])
+        row = self._db.execute('SELECT actual, fields, time FROM cards WHERE word = ? AND version = ?',
+                               (word, self.version)).fetchone()
+        if not row or (self.ttl is not None and row[2] + self.ttl < time.time()):
+            return None
+        Log.d(TAG, 'hit: "{}"'.format(word))
+        return row[0], json.loads(row[1])
+
+    def put(self, word: str, actual: str, fields: List[str]):
+        self._pending[word] = (word, self.version, actual, json.dumps(fields, ensure_ascii=False), time.time())
+        if len(self._pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        with self._db:
+            self._db.executemany('INSERT OR REPLACE INTO cards VALUES (?, ?, ?, ?, ?)', self._pending.values())
+        Log.d(TAG, 'stored {} cards'.format(len(self._pending)))
+        self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self._db.close()
@@ -0,0 +1,242 @@
+import re
+from typing import Iterable, List, Set, Tuple
+
+from .utils import get_tag, Log
+
+__all__ = [
+    'Used', 'prune_css', 'prune_styling',
+]
+
+TAG = get_tag(__name__)
+
+# always there when Anki renders a card
+ANKI_TAGS = {'html', 'body'}
+
+ANKI_CLASSES = {'card', 'card1', 'nightMode', 'night_mode', 'mobile', 'win', 'mac', 'linux', 'isWin', 'isMac', 'isLin',
+                'android', 'iphone', 'ipad'}
+
+# added by scripts at runtime, e.g. i-amphtml-element
+RUNTIME_CLASS_PREFIXES = ('i-amphtml-', 'amp-')
+
+# rules of these are pruned, other at-rules like @font-face and @keyframes are kept as is
+NESTED_AT_RULES = ('@media', '@supports', '@document', '@-moz-document', '@layer', '@container')
+
+_start_tag = re.compile(r'<([a-zA-Z][\w-]*)((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>')
+
+_attr = re.compile(r'(?:^|\s)(class|id)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+
+_style = re.compile(r'(<style[^>]*>)([\s\S]*?)(</style>)', re.IGNORECASE)
+
+_script = re.compile(r'<script\b([^>]*)>[\s\S]*?</script>\s*', re.IGNORECASE)
+
+_script_for = re.compile(r'data-for="([^"]*)"')
+
+# not escaped colons in names, e.g. .md\:x
+_functional_pseudo = re.compile(r'(?<!\\)::?[\w-]+\(')
+
+_pseudo = re.compile(r'(?<!\\)::?[\w-]+')
+
+_attribute = re.compile(r'\[[^\]]*\]')
+
+_name = r'((?:[\w-]|\\.)+)'
+
+_class = re.compile(r'\.' + _name)
+
+_id = re.compile(r'#' + _name)
+
+_type = re.compile(r'(?:^|[\s>+~])([a-zA-Z][\w-]*)')
+
+_unescape = re.compile(r'\\(.)')
+
+
+class Used:
+    # tags, classes and ids in the HTML of cards
+    def __init__(self):
+        self.tags: Set[str] = set(ANKI_TAGS)
+        self.classes: Set[str] = set(ANKI_CLASSES)
+        self.ids: Set[str] = set()
+
+    def scan(self, html: str):
+        for m in _start_tag.finditer(html):
+            self.tags.add(m.group(1).lower())
+            for a in _attr.finditer(m.group(2)):
+                value = next(v for v in a.groups()[1:] if v is not None)
+                (self.classes if a.group(1).lower() == 'class' else self.ids).update(value.split())
+
+    def has_class(self, name: str) -> bool:
+        return name in self.classes or name.startswith(RUNTIME_CLASS_PREFIXES)
+
+
+def _skip_string(css: str, i: int) -> int:
+    quote = css[i]
+    i += 1
+    while i < len(css) and css[i] != quote:
+        i += 2 if css[i] == '\\' else 1
+    return i + 1
+
+
+def _strip_comments(css: str) -> str:
+    out, i, start = [], 0, 0
+    while i < len(css):
+        c = css[i]
+        if c in '"\'':
+            i = _skip_string(css, i)
+        elif css.startswith('/*', i):
+            out.append(css[start:i])
+            end = css.find('*/', i + 2)
+            i = start = len(css) if end < 0 else end + 2
+        else:
+            i += 1
+    out.append(css[start:])
+    return ''.join(out)
+
+
+def _minify(css: str, declarations: bool = False) -> str:
+    # collapse whitespace outside strings, drop it around punctuation
+    after = '{};:,>)' if declarations else '{};,>)'
+    out, i = [], 0
+    while i < len(css):
+        c = css[i]
+        if c in '"\'':
+            j = _skip_string(css, i)
+            out.append(css[i:j])
+            i = j
+        elif c.isspace():
+            while i < len(css) and css[i].isspace():
+                i += 1
+            # a space before ':' is a descendant combinator in selectors, e.g. ".a :first-child"
+            if out and i < len(css) and out[-1][-1:] not in '{};:,>(' and css[i] not in after:
+                out.append(' ')
+        else:
+            out.append(c)
+            i += 1
+    return ''.join(out).replace(';}', '}')
+
+
+def _split(css: str) -> List[Tuple[str, str]]:
+    # top level (prelude, block) pairs, block is None for statements like @import
+    items, i, start = [], 0, 0
+    while i < len(css):
+        c = css[i]
+        if c in '"\'':
+            i = _skip_string(css, i)
+        elif c == ';' and css[start:i].strip().startswith('@'):
+            items.append((css[start:i].strip(), None))
+            i = start = i + 1
+        elif c == '{':
+            depth, j = 1, i + 1
+            while j < len(css) and depth:
+                if css[j] in '"\'':
+                    j = _skip_string(css, j)
+                    continue
+                depth += {'{': 1, '}': -1}.get(css[j], 0)
+                j += 1
+            items.append((css[start:i].strip(), css[i + 1:j - 1]))
+            i = start = j
+        elif c == '}':
+            # unbalanced, skip it
+            i = start = i + 1
+        else:
+            i += 1
+    return items
+
+
+def _split_selectors(prelude: str) -> List[str]:
+    # commas in :is(), :not() and attribute values don't separate selectors
+    selectors, depth, i, start = [], 0, 0, 0
+    while i < len(prelude):
+        c = prelude[i]
+        if c in '"\'':
+            i = _skip_string(prelude, i)
+            continue
+        if c in '([':
+            depth += 1
+        elif c in ')]':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            selectors.append(prelude[start:i])
+            start = i + 1
+        i += 1
+    selectors.append(prelude[start:])
+    return selectors
+
+
+def _strip_functional_pseudo(selector: str) -> str:
+    # e.g. :not(.a) doesn't need .a, so the argument is dropped
+    while True:
+        m = _functional_pseudo.search(selector)
+        if not m:
+            return selector
+        depth, j = 1, m.end()
+        while j < len(selector) and depth:
+            depth += {'(': 1, ')': -1}.get(selector[j], 0)
+            j += 1
+        selector = selector[:m.start()] + selector[j:]
+
+
+def _may_match(selector: str, used: Used) -> bool:
+    # conservative, only selectors requiring a missing class, id or tag are known not to match
+    selector = _pseudo.sub('', _strip_functional_pseudo(_attribute.sub('', selector)))
+    for m in _class.finditer(selector):
+        if not used.has_class(_unescape.sub(r'\1', m.group(1))):
+            return False
+    for m in _id.finditer(selector):
+        if _unescape.sub(r'\1', m.group(1)) not in used.ids:
+            return False
+    for m in _type.finditer(_id.sub('', _class.sub('', selector))):
+        if m.group(1).lower() not in used.tags:
+            return False
+    return True
+
+
+def _prune(css: str, used: Used) -> Tuple[List[str], int]:
+    out, dropped = [], 0
+    for prelude, block in _split(css):
+        if block is None:
+            out.append(_minify(prelude) + ';')
+        elif prelude.startswith('@'):
+            if prelude.lower().startswith(NESTED_AT_RULES):
+                rules, n = _prune(block, used)
+                dropped += n
+                if rules:
+                    out.append('{}{{{}}}'.format(_minify(prelude), ''.join(rules)))
+            else:
+                out.append('{}{{{}}}'.format(_minify(prelude), _minify(block, True).strip().rstrip(';')))
+        else:
+            selectors = [s for s in (_minify(s).strip() for s in _split_selectors(prelude)) if s]
+            kept = [s for s in selectors if _may_match(s, used)]
+            if kept:
+                out.append('{}{{{}}}'.format(','.join(kept), _minify(block, True).strip().rstrip(';')))
+            else:
+                dropped += 1
+    return out, dropped
+
+
+def prune_css(css: str, used: Used) -> str:
+    rules, dropped = _prune(_strip_comments(css), used)
+    Log.d(TAG, 'dropped {} rules'.format(dropped))
+    return ''.join(rules)
+
+
+def prune_styling(styling: str, htmls: Iterable[str]) -> str:
+    # the styling of a note type, CSS or <style> and <script> elements
+    used = Used()
+    for html in htmls:
+        used.scan(html)
+    Log.d(TAG, 'used {} tags, {} classes, {} ids'.format(len(used.tags), len(used.classes), len(used.ids)))
+    if not _style.search(styling):
+        pruned = prune_css(styling, used)
+    else:
+        def script(m) -> str:
+            # scripts for custom elements, e.g. <script data-for="amp-audio">, are dropped if none is used
+            f = _script_for.search(m.group(1))
+            if f and not used.tags.intersection(f.group(1).split()):
+                Log.d(TAG, 'dropped script for: {}'.format(f.group(1)))
+                return ''
+            return m.group(0)
+
+        pruned = _style.sub(lambda m: m.group(1) + prune_css(m.group(2), used) + m.group(3), styling)
+        pruned = _script.sub(script, pruned)
+    Log.i(TAG, 'pruned styling from {:.1f} KiB to {:.1f} KiB'.format(len(styling.encode('utf8')) / 1024,
+                                                                     len(pruned.encode('utf8')) / 1024))
+    return pruned
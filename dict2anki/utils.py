@@ -1,11 +1,11 @@
 import os
 import re
 import sys
-from typing import Callable
+from typing import Callable, Union
 
 __all__ = [
     'Log',
-    'get_tag', 'valid_path',
+    'get_tag', 'valid_path', 'write_if_changed',
     'ProgressBar'
 ]
 
@@ -108,6 +108,21 @@ def valid_path(path: str, force: bool = True) -> str:
     return path
 
 
+def write_if_changed(file: str, content: Union[str, bytes]) -> bool:
+    data = content.encode('utf8') if isinstance(content, str) else content
+    try:
+        if os.path.getsize(file) == len(data):
+            with open(file, 'rb') as fp:
+                if fp.read() == data:
+                    Log.d(TAG, 'unchanged: {}'.format(file))
+                    return False
+    except OSError:
+        pass
+    with open(file, 'wb') as fp:
+        fp.write(data)
+    return True
+
+
 class ProgressBar:
     def __init__(self, total: int = 100, progress: int = 0, detail: Callable[[int], str] = None, extra: str = None):
         self._total = total
@@ -147,7 +162,8 @@ class ProgressBar:
     def update(self):
         if not self._show:
             self._show = True
-        percentage = round(self._progress * 100 / self._total, 1)
+        # the total is unknown until words are read
+        percentage = round(self._progress * 100 / self._total, 1) if self._total else 0
         if percentage >= 100:
             percentage = 100
         bar_count = int(percentage) // 4
@@ -0,0 +1,134 @@
+import asyncio
+import csv
+import os
+import sys
+import time
+from typing import Optional, List, Dict, Set, Tuple
+
+from . import stats
+from .journal import Journal, WordSet, CARD, DUPLICATE, SKIPPED, row_digest, _digest
+from .utils import get_tag, Log
+
+__all__ = [
+    'CardWriter', 'recover',
+]
+
+TAG = get_tag(__name__)
+
+DEFAULT_WINDOW = 64
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+
+def recover(file: str, journal: str) -> Set[str]:
+    # cards.txt is flushed before the journal, so a crash may leave rows without journal lines and a partial row,
+    # the partial row is cut off, and digests of the others are returned so they are not written again
+    if not os.path.exists(file):
+        return set()
+    csv.field_size_limit(sys.maxsize)
+    journaled = sum(1 for status, _, _, _ in Journal.entries(journal) if status == CARD)
+    orphans, count, offset, end = set(), 0, 0, 0
+    last = b''
+
+    def lines():
+        nonlocal offset, last
+        for line in fp:
+            offset += len(line)
+            last = line
+            yield line.decode('utf8')
+
+    with open(file, 'rb') as fp:
+        try:
+            for row in csv.reader(lines(), strict=True):
+                if not last.endswith(b'\n'):
+                    break
+                if count >= journaled:
+                    orphans.add(row_digest(row))
+                count += 1
+                end = offset
+        except (csv.Error, UnicodeDecodeError):
+            pass
+    if end < os.path.getsize(file):
+        Log.w(TAG, 'cut off an incomplete card at the end of: {}'.format(file))
+        with open(file, 'r+b') as fp:
+            fp.truncate(end)
+    if orphans:
+        Log.i(TAG, '{} cards in {} not in its journal, they won\'t be written again'.format(len(orphans), file))
+    return orphans
+
+
+class CardWriter:
+    def __init__(self, file: str, journal: Journal = None, done: WordSet = None, window: int = DEFAULT_WINDOW,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, orphans: Set[str] = None):
+        self.file = file
+        self.journal = journal
+        # entries written by previous runs
+        self.done = done if done is not None else WordSet()
+        # rows written by previous runs without journal lines, see recover()
+        self.orphans = orphans if orphans is not None else set()
+        self.window = window
+        self.flush_interval = flush_interval
+        self.count = 0
+        self._fp = open(file, 'a', encoding='utf8', newline='')
+        self._writer = csv.writer(self._fp)
+        # digests of words and entries written, 8 bytes each instead of a str
+        self._visited: Set[int] = set()
+        self._next = 0
+        # results finished ahead of self._next
+        self._pending: Dict[int, Tuple[str, Optional[str], Optional[List[str]]]] = {}
+        self._cond = asyncio.Condition()
+        self._flushed = time.monotonic()
+
+    async def reserve(self, index: int):
+        # bound the results waiting for earlier ones
+        async with self._cond:
+            await self._cond.wait_for(lambda: index < self._next + self.window)
+
+    async def put(self, index: int, word: str, actual: Optional[str] = None, fields: Optional[List[str]] = None):
+        async with self._cond:
+            self._pending[index] = (word, actual, fields)
+            if index != self._next:
+                return
+            while self._next in self._pending:
+                self._write(*self._pending.pop(self._next))
+                self._next += 1
+            if time.monotonic() - self._flushed >= self.flush_interval:
+                self.flush()
+            self._cond.notify_all()
+
+    def _write(self, word: str, actual: Optional[str], fields: Optional[List[str]]):
+        row = ''
+        if actual is None:
+            status = SKIPPED
+        elif fields is None or _digest(actual) in self._visited or actual in self.done:
+            Log.d(TAG, 'duplicate: "{}" -> "{}"'.format(word, actual))
+            status = DUPLICATE
+        else:
+            self._visited.add(_digest(word))
+            self._visited.add(_digest(actual))
+            row = row_digest(fields)
+            if row in self.orphans:
+                # only the journal line is missing
+                self.orphans.discard(row)
+            else:
+                started = stats.start()
+                stats.count('bytes_out', self._writer.writerow(fields))
+                stats.stop('write', started)
+            self.count += 1
+            status = CARD
+        if self.journal:
+            self.journal.record(status, word, actual or '', row)
+
+    def flush(self):
+        self._fp.flush()
+        # the journal must not get ahead of cards
+        if self.journal:
+            self.journal.flush()
+        self._flushed = time.monotonic()
+
+    def close(self):
+        if self._pending:
+            Log.w(TAG, '{} results not written'.format(len(self._pending)))
+        self._fp.close()
+        if self.journal:
+            self.journal.close()
@@ -0,0 +1,44 @@
+import json
+import os
+import sqlite3
+import tempfile
+import zipfile
+from unittest import TestCase
+
+from dict2anki.apkg import *
+from dict2anki.utils import Log, get_tag
+
+TAG = get_tag(__name__)
+
+Log.level = Log.DEBUG
+
+
+class TestApkg(TestCase):
+    def test_write_apkg(self):
+        with tempfile.TemporaryDirectory() as d:
+            font = os.path.join(d, '_font.woff')
+            with open(font, 'wb') as f:
+                f.write(b'font')
+            rows = [['color', '<b>color</b> &amp; colour'], ['red', 'RED'], ['color', 'another entry']]
+            path = os.path.join(d, 'out', 'deck.apkg')
+            self.assertEqual(3, write_apkg(path, rows, '{{正面}}', '{{FrontSide}}{{背面}}', '.card {}', 'deck',
+                                           [font], batch=2))
+            with zipfile.ZipFile(path) as zf:
+                self.assertEqual({'0': '_font.woff'}, json.loads(zf.read('media')))
+                self.assertEqual(b'font', zf.read('0'))
+                zf.extract('collection.anki2', d)
+            db = sqlite3.connect(os.path.join(d, 'collection.anki2'))
+            ver, models, decks = db.execute('SELECT ver, models, decks FROM col').fetchone()
+            self.assertEqual(11, ver)
+            model, = json.loads(models).values()
+            self.assertEqual(['正面', '背面'], [f['name'] for f in model['flds']])
+            self.assertEqual('{{FrontSide}}{{背面}}', model['tmpls'][0]['afmt'])
+            self.assertEqual('.card {}', model['css'])
+            self.assertIn('deck', [deck['name'] for deck in json.loads(decks).values()])
+            notes = db.execute('SELECT id, guid, flds, sfld FROM notes ORDER BY id').fetchall()
+            self.assertEqual(['color\x1f<b>color</b> &amp; colour', 'red\x1fRED', 'color\x1fanother entry'],
+                             [flds for _, _, flds, _ in notes])
+            self.assertEqual(3, len({guid for _, guid, _, _ in notes}))
+            cards = db.execute('SELECT nid, due FROM cards ORDER BY due').fetchall()
+            self.assertEqual([(nid, i + 1) for i, (nid, _, _, _) in enumerate(notes)], cards)
+            db.close()
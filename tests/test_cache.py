@@ -0,0 +1,56 @@
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from dict2anki.cache import *
+from dict2anki.net import url_get_content
+from dict2anki.utils import Log, get_tag
+
+TAG = get_tag(__name__)
+
+Log.level = Log.DEBUG
+
+HEADERS = {'Content-Type': 'text/html; charset=utf-8', 'Content-Encoding': None, 'ETag': '"1"',
+           'Last-Modified': None}
+
+
+class TestResponseCache(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(self.dir.name)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get('http://a/word'))
+        self.cache.put('http://a/query', 'http://a/word', HEADERS, '<p>word</p>'.encode())
+        for url in ('http://a/query', 'http://a/word'):
+            response = self.cache.get(url)
+            self.assertEqual('http://a/word', response.geturl())
+            self.assertEqual('deflate', response.headers['Content-Encoding'])
+            self.assertEqual('"1"', response.headers['ETag'])
+            self.assertEqual('<p>word</p>', url_get_content(response))
+
+    def test_ttl(self):
+        self.cache.ttl = 0.1
+        self.cache.put('http://a/word', 'http://a/word', HEADERS, b'word')
+        time.sleep(0.2)
+        self.assertIsNone(self.cache.get('http://a/word'))
+        self.assertIsNotNone(self.cache.get('http://a/word', allow_expired=True))
+        self.cache.refresh('http://a/word')
+        self.assertIsNotNone(self.cache.get('http://a/word'))
+
+    def test_evict(self):
+        self.cache.max_size = 4096
+        body = os.urandom(1024)
+        for i in range(8):
+            self.cache.put('http://a/{}'.format(i), 'http://a/{}'.format(i), HEADERS, body)
+            # mtime resolution
+            time.sleep(0.01)
+            # keep the first one recently used
+            self.cache.get('http://a/0')
+        self.assertIsNotNone(self.cache.get('http://a/0'))
+        self.assertIsNone(self.cache.get('http://a/1'))
+        self.assertIsNotNone(self.cache.get('http://a/7'))
@@ -0,0 +1,100 @@
+import csv
+import glob
+import io
+import os
+import sys
+import tempfile
+from unittest import TestCase
+
+from benchmarks.fake_cambridge import FakeCambridge
+from dict2anki import cli, net
+from dict2anki.journal import Journal
+from dict2anki.utils import Log, get_tag
+
+TAG = get_tag(__name__)
+
+Log.level = Log.DEBUG
+
+
+class TestCli(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.argv = sys.argv
+        cli.input_files = []
+        cli.shard = None
+        cli.merge_paths = []
+        cli.apkg = None
+        cli.media = False
+        cli.prune = False
+        with open(os.path.join(self.dir.name, 'words.txt'), 'w', encoding='utf8') as f:
+            f.write('# words\nrun\nRun\ntake\n\nset\n')
+
+    def tearDown(self):
+        sys.argv = self.argv
+        net.response_cache = None
+        net.rate_limit = None
+        net.backoff = net.DEFAULT_BACKOFF
+        net._throttles.clear()
+        self.dir.cleanup()
+
+    def run_cli(self, *args: str):
+        sys.argv = ['dict2anki', '-i', os.path.join(self.dir.name, 'words.txt'), '-o', self.dir.name] + list(args)
+        cli.main()
+        with open(os.path.join(cli.output_path, 'cards.txt'), encoding='utf8') as f:
+            csv.field_size_limit(sys.maxsize)
+            return list(csv.reader(f))
+
+    def test_main(self):
+        with FakeCambridge(throttle=0.2, retry_after=0, truncate=0.1, seed=1) as fake:
+            cards = self.run_cli('--rate', '0', '--processes', '0', '--apkg', 'words', '--prune-styling')
+        self.assertEqual(3, len(cards))
+        self.assertTrue(fake.counts[429])
+        for name in ('front-template.txt', 'back-template.txt', 'styling.txt', 'collection.media/_cdoicons.woff',
+                     'words.apkg'):
+            self.assertTrue(os.path.exists(os.path.join(cli.output_path, name)))
+        statuses = [status for status, _, _, _ in Journal.entries(os.path.join(cli.output_path, 'cards.journal'))]
+        self.assertEqual(['C', 'D', 'C', 'C'], statuses)
+        with open(os.path.join(cli.output_path, 'styling.txt'), encoding='utf8') as f:
+            styling = f.read()
+        self.assertIn('@font-face', styling)
+        self.assertNotIn('.cdo-search', styling)
+        # the card store is closed, which removes its WAL
+        self.assertEqual([], glob.glob(os.path.join(cli.output_path, '.cache', '*-wal')))
+
+    def test_stdin(self):
+        stdin = sys.stdin
+        sys.stdin = io.StringIO('take\n# comment\nset\n')
+        sys.stdin.name = '<stdin>'
+        try:
+            with FakeCambridge():
+                sys.argv = ['dict2anki', '-i', '-', '-o', self.dir.name, '--rate', '0', '--processes', '0']
+                cli.main()
+        finally:
+            sys.stdin = stdin
+        statuses = [status for status, _, _, _ in Journal.entries(os.path.join(cli.output_path, 'cards.journal'))]
+        self.assertEqual(['C', 'C'], statuses)
+
+    def test_shard(self):
+        rows = []
+        with FakeCambridge():
+            for i in range(2):
+                rows.extend(self.run_cli('--rate', '0', '--processes', '0', '--shard', '{}/2'.format(i)))
+            self.assertEqual(os.path.join(self.dir.name, 'cambridge', 'shard-1-of-2'), cli.output_path)
+            merged = self.run_cli('--merge', os.path.join(self.dir.name, 'cambridge', 'shard-*'))
+            expected = self.run_cli('--rate', '0', '--processes', '0', '-o', os.path.join(self.dir.name, 'all'))
+        self.assertEqual(3, len(rows))
+        self.assertEqual(3, len(expected))
+        self.assertEqual(expected, merged)
+
+    def test_media(self):
+        with FakeCambridge():
+            cards = self.run_cli('--rate', '0', '--processes', '0', '--media')
+        files = os.listdir(os.path.join(cli.output_path, 'collection.media'))
+        for _, back in cards:
+            self.assertNotIn('/zhs/media/', back)
+        self.assertIn('src="{}"'.format(next(f for f in files if f.endswith('.mp3'))), ''.join(b for _, b in cards))
+        self.assertTrue(os.path.exists(os.path.join(cli.output_path, 'media.manifest')))
+
+    def test_not_found(self):
+        with FakeCambridge(not_found=1):
+            self.assertEqual([], self.run_cli('--rate', '0', '--no-cache'))
@@ -0,0 +1,142 @@
+import asyncio
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+from dict2anki.extractors.extractor import *
+from dict2anki.journal import Journal, CARD
+from dict2anki.utils import Log, get_tag
+
+TAG = get_tag(__name__)
+
+Log.level = Log.DEBUG
+
+
+class _Extractor(CardExtractor):
+    ALIASES = {'colour': 'color'}
+
+    def __init__(self, out_path: str):
+        super().__init__(out_path)
+        self.lookups = []
+
+    def normalize(self, word: str) -> str:
+        return ' '.join(word.lower().split())
+
+    def get_card(self, word: str):
+        raise NotImplementedError
+
+    async def get_card_async(self, word: str):
+        self.lookups.append(word)
+        await asyncio.sleep(0.01)
+        if self.normalize(word) == 'missing':
+            raise WordNotFoundError(word)
+        actual = self.ALIASES.get(self.normalize(word), self.normalize(word))
+        return actual, [actual, actual.upper()]
+
+
+class _StagedExtractor(_Extractor):
+    async def fetch_async(self, word: str):
+        actual, _ = await self.get_card_async(word)
+        return actual, actual
+
+    @classmethod
+    def parse(cls, page: str):
+        if page == 'broken':
+            raise ExtractError(page)
+        return [page, '{}:{}'.format(page.upper(), os.getpid())]
+
+
+# cards big enough to be flushed to cards.txt before the journal, then killed while looking up word7
+_CRASH = '''
+import asyncio, os, sys
+from dict2anki.extractors.extractor import CardExtractor
+
+class Extractor(CardExtractor):
+    def get_card(self, word):
+        raise NotImplementedError
+
+    async def get_card_async(self, word):
+        if word == 'word7':
+            await asyncio.sleep(0.2)
+            os._exit(1)
+        return word, [word, word * 1000]
+
+Extractor(sys.argv[1]).generate_cards(*('word{}'.format(i) for i in range(10)))
+'''
+
+
+class TestCardExtractor(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.extractor = _Extractor(self.dir.name)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read(self):
+        with open(self.extractor.cards_file, encoding='utf8') as fp:
+            return list(csv.reader(fp))
+
+    def test_generate_cards(self):
+        self.extractor.generate_cards('Color', 'color ', 'colour', 'missing', 'missing', ' COLOR', 'red')
+        # duplicates in flight are coalesced, known aliases short-circuit
+        self.assertEqual(['Color', 'colour', 'missing', 'red'], self.extractor.lookups)
+        self.assertEqual([['color', 'COLOR'], ['red', 'RED']], self.read())
+        self.extractor.lookups.clear()
+        self.extractor.generate_cards('red', 'Missing', 'blue', resume=True)
+        self.assertEqual(['Missing', 'blue'], self.extractor.lookups)
+        self.assertEqual([['color', 'COLOR'], ['red', 'RED'], ['blue', 'BLUE']], self.read())
+
+    def test_append(self):
+        # cards.txt and its journal are both appended across runs
+        self.extractor.generate_cards('red', 'blue')
+        self.extractor.generate_cards('green', 'red')
+        self.extractor.lookups.clear()
+        self.extractor.generate_cards('red', 'blue', 'green', 'white', resume=True)
+        self.assertEqual(['white'], self.extractor.lookups)
+        self.assertEqual(['red', 'blue', 'green', 'red', 'white'], [front for front, _ in self.read()])
+        cards = [actual for status, _, actual, _ in Journal.entries(self.extractor.journal_file) if status == CARD]
+        self.assertEqual([front for front, _ in self.read()], cards)
+
+    def test_crash(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.run([sys.executable, '-c', _CRASH, self.dir.name], cwd=root, check=False)
+        self.assertTrue(self.read())
+        self.extractor.get_card_async = lambda word: asyncio.sleep(0, (word, [word, word * 1000]))
+        self.extractor.generate_cards(*('word{}'.format(i) for i in range(10)), resume=True)
+        self.assertEqual(['word{}'.format(i) for i in range(10)], [front for front, _ in self.read()])
+
+    def test_source(self):
+        tasks = []
+
+        async def get_card_async(word: str):
+            tasks.append(len(asyncio.all_tasks()))
+            return word, [word, word.upper()]
+
+        self.extractor.get_card_async = get_card_async
+        count = 5000
+        self.extractor.generate_cards('first', source=('word{}'.format(i) for i in range(count)))
+        rows = self.read()
+        self.assertEqual(count + 1, len(rows))
+        self.assertEqual(['first', 'word0', 'word1'], [front for front, _ in rows[:3]])
+        # a fixed set of workers instead of a task for each word
+        self.assertLess(max(tasks), 200)
+        self.extractor.generate_cards(source=iter(['word1', 'extra']), resume=True)
+        self.assertEqual(['extra', 'EXTRA'], self.read()[-1])
+
+    def test_staged(self):
+        extractor = _StagedExtractor(self.dir.name)
+        self.assertTrue(extractor.staged)
+        self.assertFalse(self.extractor.staged)
+        extractor.processes = 2
+        extractor.generate_cards('red', 'broken', 'blue')
+        extractor.processes = 1
+        extractor.generate_cards('green')
+        rows = self.read()
+        self.assertEqual([['red', 'RED'], ['blue', 'BLUE'], ['green', 'GREEN']],
+                         [[a, b.split(':')[0]] for a, b in rows])
+        # parsed in other processes
+        self.assertNotIn(str(os.getpid()), [b.split(':')[1] for _, b in rows])
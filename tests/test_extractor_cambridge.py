@@ -1,3 +1,6 @@
+import glob
+import gzip
+import os
 from unittest import TestCase
 
 from dict2anki.extractors.cambridge import *
@@ -28,3 +31,20 @@ class TestCambridge(TestCase):
             'abbreviate',
             'chat')
         extractor.generate_cards(*words)
+
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'corpus')
+
+
+class TestCambridgeCorpus(TestCase):
+    def test_extract_fields(self):
+        files = glob.glob(os.path.join(CORPUS_DIR, '*.html.gz'))
+        self.assertTrue(files)
+        for file in files:
+            with gzip.open(file, 'rt', encoding='utf8') as f:
+                front, back = CambridgeExtractor.parse(f.read())
+            self.assertIn('class="hw dhw"', front)
+            for removed in ('class="di-title"', '<script', 'ad_contentslot', 'class="daccord"', '<a ', 'x-h dx-h'):
+                self.assertNotIn(removed, back)
+            self.assertNotIn('src="/zhs/media', back)
+            self.assertEqual(len(back) > 4096, '<amp-accordion>' in back)
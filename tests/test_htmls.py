@@ -39,3 +39,43 @@ class TestHtml(TestCase):
 
     def test_removeall(self):
         Log.d(TAG, htmls.removeall(self.HTML, 'a'))
+
+    def test_rewriter(self):
+        html = '<div class="x"><div class="y"><a href="#">link</a> text</div><script>var a;</script>' \
+               '<div class="z">kept <div>nested</div></div></div>'
+        rewriter = htmls.compile_rules([
+            ('div', 'class="y"', htmls.UNWRAP),
+            ('script', '', htmls.REMOVE),
+            ('a', 'href=', htmls.UNWRAP),
+            ('div', 'class="z"', lambda h: h.upper()),
+        ])
+        self.assertEqual('<div class="x">link text<DIV CLASS="Z">KEPT <DIV>NESTED</DIV></DIV></div>',
+                         rewriter.apply(html))
+
+    def test_rewriter_sequential(self):
+        def rm_tag(s):
+            return re.sub(r'^<[\s\S]*?>([\s\S]*)<[\s\S]*>$', r'\g<1>', s)
+
+        expected = htmls.removeall(self.HTML, 'title')
+        expected = htmls.sub(expected, rm_tag, 'a', 'href=')
+        actual = htmls.compile_rules([
+            ('title', '', htmls.REMOVE),
+            ('a', 'href=', htmls.UNWRAP),
+        ]).apply(self.HTML)
+        self.assertEqual(expected, actual)
+        # unpaired elements are left as they are
+        self.assertEqual('<p>a<div>b', htmls.compile_rules([('div', '', htmls.REMOVE)]).apply('<p>a<div>b'))
+
+    def test_document(self):
+        doc = htmls.Document(self.HTML)
+        self.assertEqual(list(htmls.find_positions(self.HTML, 'a')), list(doc.findall('a')))
+        self.assertEqual(htmls.find(self.HTML, 'a', 'example.com'), doc.text(doc.find('a', 'example.com')))
+        p = doc.find('p')
+        self.assertEqual(2, len(list(doc.findall('a', within=p))))
+        self.assertIsNone(doc.find('a', within=doc.find('head')))
+        self.assertEqual(htmls.removeall(self.HTML, 'a', 'example.org'),
+                         doc.sub(lambda h: '', 'a', 'example.org'))
+        # nested elements of the same tag
+        html = '<div class="a"><div class="a">x</div></div><div class="a">y</div>'
+        doc = htmls.Document(html)
+        self.assertEqual(list(htmls.find_positions(html, 'div', 'class="a"')), list(doc.findall('div', 'class="a"')))
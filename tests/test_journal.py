@@ -0,0 +1,43 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from dict2anki.journal import *
+from dict2anki.utils import Log, get_tag
+
+TAG = get_tag(__name__)
+
+Log.level = Log.DEBUG
+
+
+class TestJournal(TestCase):
+    def test_word_set(self):
+        words = WordSet(['a', 'b', 'a'])
+        self.assertEqual(2, len(words))
+        self.assertIn('a', words)
+        self.assertNotIn('c', words)
+        self.assertNotIn('a', WordSet())
+        words = [str(i % 100000) for i in range(150000)]
+        digests = WordSet(words)._digests
+        self.assertEqual(100000, len(digests))
+        self.assertEqual(sorted(digests), list(digests))
+
+    def test_done(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'cards.journal')
+            journal = Journal(path)
+            journal.record(CARD, 'cater to', 'cater for sb sth', row_digest(['cater for sb sth', '']))
+            journal.record(DUPLICATE, 'cater for', 'cater for sb sth')
+            journal.record(SKIPPED, 'shiiiit')
+            journal.close()
+            with open(path, 'a', encoding='utf8') as fp:
+                # incomplete line
+                fp.write('C\tbroken\tbroken\t0123')
+            journal = Journal(path)
+            journal.record(CARD, 'list', 'list', row_digest(['list', '']))
+            journal.close()
+            done = Journal.done(path)
+            for word in ('cater to', 'cater for', 'cater for sb sth', 'list'):
+                self.assertIn(word, done)
+            for word in ('shiiiit', 'broken'):
+                self.assertNotIn(word, done)
@@ -0,0 +1,68 @@
+import asyncio
+from unittest import TestCase
+from urllib.error import HTTPError
+
+from dict2anki.limiter import *
+from dict2anki.utils import Log, get_tag
+
+TAG = get_tag(__name__)
+
+Log.level = Log.DEBUG
+
+
+class TestAdaptiveLimiter(TestCase):
+    def test_acquire(self):
+        async def run():
+            limiter = AdaptiveLimiter(2, 2, 2)
+            await limiter.acquire()
+            await limiter.acquire()
+            waiter = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiter.done())
+            limiter.release(0.1)
+            await asyncio.wait_for(waiter, 1)
+            # cancelled waiters don't take a slot
+            waiter = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            limiter.release(0.1)
+            await asyncio.wait_for(limiter.acquire(), 1)
+
+        asyncio.run(run())
+
+    def test_adapt(self):
+        async def run():
+            limiter = AdaptiveLimiter(4, 1, 8)
+            # grows while saturated with steady latency
+            for _ in range(100):
+                for _ in range(limiter.limit):
+                    await limiter.acquire()
+                for _ in range(limiter.limit):
+                    limiter.release(0.1)
+            self.assertEqual(8, limiter.limit)
+            await limiter.acquire()
+            limiter.release(0.1, HTTPError('', 429, 'Too Many Requests', None, None))
+            self.assertEqual(4, limiter.limit)
+            # decreases at most once per round trip
+            await limiter.acquire()
+            limiter.release(0.1, OSError())
+            self.assertEqual(4, limiter.limit)
+            self.assertEqual((4, 8), (limiter.low, limiter.high))
+            # throttling cuts harder than other errors
+            limiter._decreased = 0
+            await limiter.acquire()
+            limiter.release(0.1, OSError())
+            self.assertEqual(3, limiter.limit)
+            limiter._decreased = 0
+            limiter.throttled()
+            self.assertEqual(1, limiter.limit)
+
+        asyncio.run(run())
+
+    def test_fixed(self):
+        async def run():
+            limiter = AdaptiveLimiter(4, 4, 4)
+            limiter.throttled()
+            self.assertEqual(4, limiter.limit)
+
+        asyncio.run(run())
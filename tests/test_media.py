@@ -0,0 +1,46 @@
+import asyncio
+import os
+import tempfile
+from unittest import TestCase
+
+from benchmarks.fake_cambridge import FakeCambridge
+from dict2anki.media import *
+from dict2anki.net import async_run
+from dict2anki.utils import Log, get_tag
+
+TAG = get_tag(__name__)
+
+Log.level = Log.DEBUG
+
+
+class TestMediaFetcher(TestCase):
+    def test_localize(self):
+        with tempfile.TemporaryDirectory() as d, FakeCambridge() as fake:
+            media_path = os.path.join(d, 'collection.media')
+            manifest = os.path.join(d, 'media.manifest')
+            url = fake.url + '/zhs/media/english/{}_pron/{}take__001.mp3'
+            fields = [
+                'take',
+                '<source type="audio/mpeg" src="{}"/><source src="{}"/><source src="{}"/><img src="x.png">'.format(
+                    url.format('uk', 'uk'), url.format('us', 'us'), url.format('uk', 'uk')),
+            ]
+            fetcher = MediaFetcher(media_path, manifest)
+
+            async def localize():
+                return await asyncio.gather(fetcher.localize(fields), fetcher.localize(fields[1:]))
+
+            (front, back), (back1,) = async_run(localize())
+            fetcher.close()
+            self.assertEqual(back, back1)
+            # same content from another url
+            self.assertEqual((1, 1), (fetcher.downloaded, fetcher.deduplicated))
+            name, = os.listdir(media_path)
+            self.assertIn(name, ('uktake__001.mp3', 'ustake__001.mp3'))
+            self.assertEqual('<source type="audio/mpeg" src="{0}"/><source src="{0}"/><source src="{0}"/>'
+                             '<img src="x.png">'.format(name), back)
+            self.assertEqual(2, fake.counts[200])
+
+            fetcher = MediaFetcher(media_path, manifest)
+            self.assertEqual([front, back], async_run(fetcher.localize(fields)))
+            fetcher.close()
+            self.assertEqual(2, fake.counts[200])
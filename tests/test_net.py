@@ -1,7 +1,20 @@
+import asyncio
+import gzip
 import hashlib
+import os
+import re
+import socket
+import tempfile
+import urllib.error
+import threading
+import time
 import urllib.parse
-from unittest import TestCase
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import TestCase, skipUnless
 
+from dict2anki import net
+from dict2anki.cache import ResponseCache
 from dict2anki.net import *
 from dict2anki.utils import Log, get_tag
 
@@ -36,15 +49,352 @@ class TestNet(TestCase):
             fake_headers()
         ).splitlines()[0].split()
         Log.d(TAG, 'md5={}, file={}'.format(md5, file))
+        md5_actual = hashlib.md5()
         file_actual, size = url_save(
             URL_DEBIAN_CD_PATH.format(file),
-            reporthook=lambda a, b: Log.d(TAG, '{:>5}% downloaded'.format(round(a * 100 / b, 1)))
+            reporthook=lambda a, b: Log.d(TAG, '{:>5}% downloaded'.format(round(a * 100 / b, 1))),
+            digest=md5_actual
         )
         Log.d(TAG, 'file size: {} MiB'.format(round(size / 1024 / 1024, 1)))
-        md5_actual = hashlib.md5()
-        with open(file_actual, 'rb') as f:
-            buffer = f.read(512 * 1024)
-            while buffer:
-                md5_actual.update(buffer)
-                buffer = f.read(512 * 1024)
         self.assertEqual(md5, md5_actual.hexdigest())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = 0
+    not_modified = 0
+    requests = 0
+    throttled = 0
+    truncated = 0
+    FILE = bytes(range(256)) * 1024
+
+    def setup(self):
+        super().setup()
+        _Handler.connections += 1
+
+    def do_GET(self):
+        _Handler.requests += 1
+        if self.path == '/file.bin':
+            start = 0
+            m = re.match(r'bytes=(\d+)-', self.headers['Range'] or '')
+            if m:
+                start = int(m.group(1))
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(self.FILE) - 1, len(self.FILE)))
+            else:
+                self.send_response(200)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Length', str(len(self.FILE) - start))
+            self.end_headers()
+            self.wfile.write(self.FILE[start:])
+            return
+        if self.path == '/etag' and self.headers['If-None-Match'] == '"v1"':
+            _Handler.not_modified += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+        if self.path.startswith('/redirect/'):
+            self.send_response(302)
+            self.send_header('Location', '/' + self.path.rsplit('/', 1)[-1])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path == '/chunked':
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for chunk in (b'chun', b'ked'):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        if self.path == '/truncated' and _Handler.truncated < 2:
+            _Handler.truncated += 1
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            # closed mid-chunk, then a garbled chunk size
+            self.wfile.write(b'10\r\nabc' if _Handler.truncated == 1 else b'zz\r\n')
+            self.close_connection = True
+            return
+        if self.path == '/throttle' and _Handler.throttled < 2:
+            _Handler.throttled += 1
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path == '/missing':
+            body = b'not found'
+            self.send_response(404)
+        else:
+            body = self.path.encode()
+            self.send_response(200)
+        if self.path == '/gzip':
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        if self.path == '/deflate':
+            # raw deflate data without the zlib header
+            compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            self.send_header('Content-Encoding', 'deflate')
+        if self.path == '/bomb':
+            body = gzip.compress(b'0' * 1024 * 1024)
+            self.send_header('Content-Encoding', 'gzip')
+        if self.path == '/brotli-bomb':
+            body = net.brotli.compress(b'0' * 1024 * 1024)
+            self.send_header('Content-Encoding', 'br')
+        if self.path == '/etag':
+            self.send_header('ETag', '"v1"')
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestConnectionPool(TestCase):
+    def setUp(self):
+        _Handler.connections = 0
+        _Handler.requests = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        self.pool = ConnectionPool(maxsize=2)
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuse(self):
+        for word in ('a', 'b', 'c'):
+            self.assertEqual('/' + word, url_get_content(self.pool.urlopen(self.url + word)))
+        self.assertEqual(1, _Handler.connections)
+
+    def test_redirect(self):
+        response = self.pool.urlopen(self.url + 'redirect/word')
+        self.assertEqual(self.url + 'word', response.geturl())
+        self.assertEqual('/word', url_get_content(response))
+        self.assertEqual(1, _Handler.connections)
+
+    def test_error(self):
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.pool.urlopen(self.url + 'missing')
+        self.assertEqual(404, cm.exception.code)
+        self.assertEqual('/a', url_get_content(self.pool.urlopen(self.url + 'a')))
+        self.assertEqual(1, _Handler.connections)
+
+    def test_stale(self):
+        url_get_content(self.pool.urlopen(self.url + 'a'))
+        # break idle connections as if the server dropped them
+        for conns in self.pool._idle.values():
+            for conn in conns:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual('/b', url_get_content(self.pool.urlopen(self.url + 'b')))
+        self.assertEqual(2, _Handler.connections)
+
+    def test_url_save(self):
+        with tempfile.TemporaryDirectory() as d:
+            md5 = hashlib.md5()
+            file, size = url_save(self.url + 'file.bin', filename=os.path.join(d, 'file.bin'), digest=md5)
+            self.assertEqual(len(_Handler.FILE), size)
+            self.assertEqual(hashlib.md5(_Handler.FILE).hexdigest(), md5.hexdigest())
+            self.assertEqual(1, _Handler.requests)
+            # resume
+            os.rename(file, file + '.part')
+            with open(file + '.part', 'r+b') as f:
+                f.truncate(1000)
+            md5 = hashlib.md5()
+            self.assertEqual((file, len(_Handler.FILE)), url_save(self.url + 'file.bin', filename=file, digest=md5))
+            self.assertEqual(hashlib.md5(_Handler.FILE).hexdigest(), md5.hexdigest())
+            self.assertEqual(2, _Handler.requests)
+            with open(file, 'rb') as f:
+                self.assertEqual(_Handler.FILE, f.read())
+
+    def test_unread(self):
+        with self.pool.urlopen(self.url + 'a'):
+            pass
+        self.assertEqual('/b', url_get_content(self.pool.urlopen(self.url + 'b')))
+        self.assertEqual(2, _Handler.connections)
+
+
+class TestResponseCache(TestCase):
+    def setUp(self):
+        _Handler.connections = 0
+        _Handler.not_modified = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        self.dir = tempfile.TemporaryDirectory()
+        net.response_cache = ResponseCache(self.dir.name)
+
+    def tearDown(self):
+        net.response_cache = None
+        net.offline = False
+        self.dir.cleanup()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_cache(self):
+        self.assertEqual('/word', url_get_content(self.url + 'redirect/word'))
+        self.assertEqual('/gzip', async_run(async_url_get_content(self.url + 'gzip')))
+        net.offline = True
+        self.assertEqual('/word', url_get_content(self.url + 'redirect/word'))
+        response = async_run(async_urlopen_with_retry(self.url + 'redirect/word', cached=True))
+        self.assertEqual(self.url + 'word', response.geturl())
+        self.assertEqual('/gzip', url_get_content(self.url + 'gzip'))
+        with self.assertRaises(urllib.error.URLError):
+            url_get_content(self.url + 'a')
+
+    def test_revalidate(self):
+        async def get():
+            return [await async_url_get_data(self.url + 'etag', revalidate=True) for _ in range(2)]
+
+        self.assertEqual([b'/etag', b'/etag'], async_run(get()))
+        self.assertEqual(1, _Handler.not_modified)
+
+
+class TestAsyncConnectionPool(TestCase):
+    def setUp(self):
+        _Handler.connections = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_async_url_get_content(self):
+        async def get():
+            return [await async_url_get_content(self.url + path) for path in ('a', 'gzip', 'chunked')]
+
+        self.assertEqual(['/a', '/gzip', 'chunked'], async_run(get()))
+        self.assertEqual(1, _Handler.connections)
+
+    def test_decompress(self):
+        self.assertEqual('/deflate', url_get_content(self.url + 'deflate', cached=False))
+        self.assertEqual(b'/deflate', async_run(async_url_get_data(self.url + 'deflate', cached=False)))
+
+    def test_max_body_size(self):
+        net.max_body_size = 1000
+        try:
+            with self.assertRaises(ResponseTooLargeError):
+                url_get_content(self.url + 'bomb', cached=False)
+            with self.assertRaises(ResponseTooLargeError):
+                async_run(async_url_get_data(self.url + 'bomb', cached=False))
+        finally:
+            net.max_body_size = net.DEFAULT_MAX_BODY_SIZE
+        self.assertEqual(1024 * 1024, len(async_run(async_url_get_data(self.url + 'bomb', cached=False))))
+
+    @skipUnless(net.brotli, 'brotli is not installed')
+    def test_max_body_size_brotli(self):
+        net.max_body_size = 1000
+        try:
+            with self.assertRaises(ResponseTooLargeError):
+                url_get_content(self.url + 'brotli-bomb', cached=False)
+            with self.assertRaises(ResponseTooLargeError):
+                async_run(async_url_get_data(self.url + 'brotli-bomb', cached=False))
+        finally:
+            net.max_body_size = net.DEFAULT_MAX_BODY_SIZE
+        self.assertEqual(1024 * 1024, len(async_run(async_url_get_data(self.url + 'brotli-bomb', cached=False))))
+
+    def test_concurrent(self):
+        async def get():
+            return await asyncio.gather(*[async_url_get_content(self.url + str(i)) for i in range(20)])
+
+        self.assertEqual(['/' + str(i) for i in range(20)], async_run(get()))
+
+    def test_redirect(self):
+        async def get():
+            response = await async_urlopen_with_retry(self.url + 'redirect/word')
+            return response.geturl(), await async_url_get_content(response)
+
+        self.assertEqual((self.url + 'word', '/word'), async_run(get()))
+
+    def test_error(self):
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            async_run(async_urlopen_with_retry(self.url + 'missing', retry=1))
+        self.assertEqual(404, cm.exception.code)
+
+
+class TestRetry(TestCase):
+    def setUp(self):
+        _Handler.requests = 0
+        _Handler.throttled = 0
+        _Handler.truncated = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+
+    def tearDown(self):
+        net.rate_limit = None
+        net.rate_burst = net.DEFAULT_BURST
+        net._throttles.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retry_after(self):
+        self.assertEqual('/throttle', url_get_content(self.url + 'throttle', cached=False))
+        _Handler.throttled = 0
+        self.assertEqual('/throttle', async_run(async_url_get_content(self.url + 'throttle', cached=False)))
+        self.assertEqual(6, _Handler.requests)
+
+    def test_truncated(self):
+        self.assertEqual('/truncated', url_get_content(self.url + 'truncated', cached=False))
+        _Handler.truncated = 0
+        self.assertEqual('/truncated', async_run(async_url_get_content(self.url + 'truncated', cached=False)))
+        self.assertEqual(6, _Handler.requests)
+
+    def test_on_throttle(self):
+        throttles = []
+        net.on_throttle = throttles.append
+        try:
+            self.assertEqual('/throttle', async_run(async_url_get_content(self.url + 'throttle', cached=False)))
+        finally:
+            net.on_throttle = None
+        # each attempt, before it is retried
+        self.assertEqual([429, 429], [e.code for e in throttles])
+
+    def test_fatal(self):
+        # not retried
+        with self.assertRaises(urllib.error.HTTPError):
+            urlopen_with_retry(self.url + 'missing')
+        with self.assertRaises(urllib.error.HTTPError):
+            async_run(async_urlopen_with_retry(self.url + 'missing'))
+        self.assertEqual(2, _Handler.requests)
+
+    def test_rate_limit(self):
+        net.rate_limit = 20
+        net.rate_burst = 1
+
+        async def get():
+            return await asyncio.gather(*[async_url_get_content(self.url + str(i), cached=False) for i in range(5)])
+
+        start = time.monotonic()
+        async_run(get())
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+
+class TestProxy(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.environ = dict(os.environ)
+        for name in ('no_proxy', 'NO_PROXY', 'HTTP_PROXY'):
+            os.environ.pop(name, None)
+        os.environ['http_proxy'] = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_proxy(self):
+        # the proxy gets the absolute url, and answers with it
+        url = 'http://example.invalid/word'
+        self.assertEqual(url, url_get_content(url, cached=False))
+        self.assertEqual(url, async_run(async_url_get_content(url, cached=False)))
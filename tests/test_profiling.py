@@ -0,0 +1,31 @@
+import asyncio
+import os
+import pstats
+import tempfile
+from unittest import TestCase
+
+from dict2anki.profiling import *
+from dict2anki.utils import Log, get_tag
+
+TAG = get_tag(__name__)
+
+Log.level = Log.DEBUG
+
+
+def _in_executor():
+    return [str(i) for i in range(1000)]
+
+
+class TestProfiler(TestCase):
+    def test_profiler(self):
+        async def run():
+            return await asyncio.get_running_loop().run_in_executor(None, _in_executor)
+
+        with tempfile.TemporaryDirectory() as d:
+            with Profiler(d, memory=True):
+                asyncio.run(run())
+            for name in ('profile.pstats', 'profile.txt', 'memory.snapshot', 'memory.txt'):
+                self.assertTrue(os.path.exists(os.path.join(d, name)))
+            # executor threads are profiled too
+            functions = [name for _, _, name in pstats.Stats(os.path.join(d, 'profile.pstats')).stats]
+            self.assertIn('_in_executor', functions)
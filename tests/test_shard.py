@@ -0,0 +1,95 @@
+import csv
+import os
+import re
+import tempfile
+from unittest import TestCase
+
+from dict2anki.journal import Journal, CARD, DUPLICATE, SKIPPED, row_digest
+from dict2anki.shard import *
+from dict2anki.utils import Log, get_tag
+
+TAG = get_tag(__name__)
+
+Log.level = Log.DEBUG
+
+
+class TestShard(TestCase):
+    def test_parse_shard(self):
+        self.assertEqual((1, 4), parse_shard('1/4'))
+        for value in ('4/4', '-1/4', '0/0', '1', 'a/b'):
+            with self.assertRaises(ValueError):
+                parse_shard(value)
+
+    def test_shard_of(self):
+        words = ['word{}'.format(i) for i in range(1000)]
+        shards = [shard_of(w, 4) for w in words]
+        self.assertEqual(shards, [shard_of(w, 4) for w in words])
+        for i in range(4):
+            self.assertGreater(shards.count(i), 200)
+
+    def test_merge(self):
+        with tempfile.TemporaryDirectory() as d:
+            def make(name, entries, rows):
+                path = os.path.join(d, name)
+                os.makedirs(path)
+                journal = Journal(os.path.join(path, 'cards.journal'))
+                for status, word, actual, *fields in entries:
+                    journal.record(status, word, actual, row_digest(fields) if fields else '')
+                journal.close()
+                with open(os.path.join(path, 'cards.txt'), 'w', encoding='utf8', newline='') as fp:
+                    csv.writer(fp).writerows(rows)
+                with open(os.path.join(path, 'styling.txt'), 'w', encoding='utf8') as fp:
+                    fp.write(name)
+                return path
+
+            shard0 = make('shard-0-of-2', [(CARD, 'colour', 'color', 'color', 'multi\nline'), (SKIPPED, 'missing', '')],
+                          [['color', 'multi\nline']])
+            # rows are not matched by position, e.g. left by a run without --resume
+            shard1 = make('shard-1-of-2', [(CARD, 'red', 'red', 'red', 'RED'), (DUPLICATE, 'color', 'color'),
+                                           (CARD, 'blue', 'blue', 'blue', 'BLUE')],
+                          [['blue', 'BLUE'], ['green', 'GREEN'], ['red', 'RED']])
+            out = os.path.join(d, 'merged')
+            merge([shard0, shard1], ['Red', 'unknown', 'color', 'blue', 'colour', 'missing'], str.lower, out)
+            with open(os.path.join(out, 'cards.txt'), encoding='utf8', newline='') as fp:
+                self.assertEqual([['red', 'RED'], ['color', 'multi\nline'], ['blue', 'BLUE']], list(csv.reader(fp)))
+            statuses = [(status, word) for status, word, _, _ in Journal.entries(os.path.join(out, 'cards.journal'))]
+            self.assertEqual([(CARD, 'red'), (CARD, 'color'), (CARD, 'blue'), (DUPLICATE, 'colour'),
+                              (SKIPPED, 'missing')], statuses)
+            with open(os.path.join(out, 'styling.txt'), encoding='utf8') as fp:
+                self.assertEqual('shard-0-of-2', fp.read())
+            # a card in the journal but not in cards.txt
+            shard2 = make('broken', [(CARD, 'white', 'white', 'white', 'WHITE')], [['white', 'white']])
+            with self.assertRaises(MergeError):
+                merge([shard0, shard2], ['white'], str.lower, os.path.join(d, 'merged2'))
+            self.assertFalse(os.path.exists(os.path.join(d, 'merged2', 'cards.txt')))
+
+    def test_merge_media(self):
+        with tempfile.TemporaryDirectory() as d:
+            def make(name, word, audio):
+                path = os.path.join(d, name)
+                os.makedirs(os.path.join(path, 'collection.media'))
+                row = [word, '<audio src="a.mp3"></audio>']
+                journal = Journal(os.path.join(path, 'cards.journal'))
+                journal.record(CARD, word, word, row_digest(row))
+                journal.close()
+                with open(os.path.join(path, 'cards.txt'), 'w', encoding='utf8', newline='') as fp:
+                    csv.writer(fp).writerow(row)
+                with open(os.path.join(path, 'collection.media', 'a.mp3'), 'wb') as fp:
+                    fp.write(audio)
+                return path
+
+            # named the same in different shards, but not the same file
+            shards = [make('shard-0-of-2', 'red', b'red'), make('shard-1-of-2', 'blue', b'blue')]
+            out = os.path.join(d, 'merged')
+            merge(shards, ['red', 'blue'], str.lower, out)
+            with open(os.path.join(out, 'cards.txt'), encoding='utf8', newline='') as fp:
+                rows = list(csv.reader(fp))
+            self.assertEqual('<audio src="a.mp3"></audio>', rows[0][1])
+            renamed = re.search(r'src="([^"]+)"', rows[1][1]).group(1)
+            self.assertNotEqual('a.mp3', renamed)
+            for name, audio in (('a.mp3', b'red'), (renamed, b'blue')):
+                with open(os.path.join(out, 'collection.media', name), 'rb') as fp:
+                    self.assertEqual(audio, fp.read())
+            # rows are found again by the journal of the merged deck
+            self.assertEqual([row_digest(row) for row in rows],
+                             [row for _, _, _, row in Journal.entries(os.path.join(out, 'cards.journal'))])
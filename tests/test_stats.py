@@ -0,0 +1,38 @@
+from unittest import TestCase
+
+from dict2anki import stats
+from dict2anki.utils import Log, get_tag
+
+TAG = get_tag(__name__)
+
+Log.level = Log.DEBUG
+
+
+class TestStats(TestCase):
+    def tearDown(self):
+        stats.enabled = False
+        stats.reset()
+
+    def test_disabled(self):
+        stats.stop('parse', stats.start())
+        stats.count('retries')
+        self.assertEqual({'stages': {}, 'counters': {}}, stats.report())
+
+    def test_report(self):
+        stats.enabled = True
+        for i in range(1, 101):
+            stats.record('parse', i / 1000)
+        stats.count('bytes_in', 10)
+        stats.count('bytes_in', 5)
+        started = stats.start()
+        stats.stop('write', started)
+        report = stats.report()
+        parse = report['stages']['parse']
+        self.assertEqual(100, parse['count'])
+        self.assertAlmostEqual(0.05, parse['p50'])
+        self.assertAlmostEqual(0.095, parse['p95'])
+        self.assertAlmostEqual(0.099, parse['p99'])
+        self.assertAlmostEqual(5.05, parse['total'])
+        self.assertEqual(1, report['stages']['write']['count'])
+        self.assertEqual({'bytes_in': 15}, report['counters'])
+        stats.log_report()
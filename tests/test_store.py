@@ -0,0 +1,45 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from dict2anki.store import *
+from dict2anki.utils import Log, get_tag
+
+TAG = get_tag(__name__)
+
+Log.level = Log.DEBUG
+
+
+class TestCardStore(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'cards.sqlite3')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_get_put(self):
+        store = CardStore(self.path, 'v1', batch=2)
+        self.assertIsNone(store.get('cater to'))
+        store.put('cater to', 'cater for sb sth', ['<b>front</b>', '背面'])
+        # pending writes are visible
+        self.assertEqual(('cater for sb sth', ['<b>front</b>', '背面']), store.get('cater to'))
+        store.close()
+        store = CardStore(self.path, 'v1')
+        self.assertEqual(('cater for sb sth', ['<b>front</b>', '背面']), store.get('cater to'))
+        store.close()
+
+    def test_version(self):
+        store = CardStore(self.path, 'v1')
+        store.put('word', 'word', ['front', 'back'])
+        store.close()
+        store = CardStore(self.path, 'v2')
+        self.assertIsNone(store.get('word'))
+        store.close()
+
+    def test_ttl(self):
+        store = CardStore(self.path, 'v1', ttl=-1)
+        store.put('word', 'word', ['front', 'back'])
+        store.flush()
+        self.assertIsNone(store.get('word'))
+        store.close()
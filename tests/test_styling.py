@@ -0,0 +1,47 @@
+from unittest import TestCase
+
+from dict2anki.styling import *
+from dict2anki.utils import Log, get_tag
+
+TAG = get_tag(__name__)
+
+Log.level = Log.DEBUG
+
+
+class TestStyling(TestCase):
+    def test_used(self):
+        used = Used()
+        used.scan('<div class="a  b" data-id="x"><span id=i>x</span><AMP-AUDIO></AMP-AUDIO></div>')
+        self.assertTrue({'div', 'span', 'amp-audio', 'body'} <= used.tags)
+        self.assertTrue({'a', 'b', 'card'} <= used.classes)
+        self.assertEqual({'i'}, used.ids)
+
+    def test_prune_css(self):
+        used = Used()
+        used.scan('<div class="a b"><span id="i">x</span></div>')
+        css = '''/* comment */ @charset "utf-8";
+        .a , .z { color : red ; content: " a ; } " }
+        @media (max-width: 100px) and (min-width:10px) { .z { x: y } div  .b :first-child { margin: 0 auto; } }
+        @media print { .z { a: b } }
+        @font-face { font-family: x; src: url(a.woff) }
+        p, div:not(.y, .z) > span { a: b } #i { c: d } #j { e: f } [data-x="a,b"].q { g: h }
+        .i-amphtml-element { i: j } .md\\:x { k: l } .card.nightMode .a:hover::before { m: n }'''
+        self.assertEqual(
+            '@charset "utf-8";.a{color:red;content:" a ; } "}'
+            '@media (max-width:100px) and (min-width:10px){div .b :first-child{margin:0 auto}}'
+            '@font-face{font-family:x;src:url(a.woff)}div:not(.y,.z)>span{a:b}#i{c:d}.i-amphtml-element{i:j}'
+            '.card.nightMode .a:hover::before{m:n}', prune_css(css, used))
+        used.scan('<div class="md:x">')
+        self.assertIn('.md\\:x{k:l}', prune_css(css, used))
+        self.assertEqual('.md\\:x:hover{a:b}', prune_css('.md\\:x:hover { a: b } .md\\:y { c: d }', used))
+
+    def test_prune_styling(self):
+        styling = '<style>.a { color: red } .b { color: blue }</style>\n' \
+                  '<script type="text/javascript" data-for="amp-audio amp-accordion">amp</script>\n' \
+                  '<script type="text/javascript" data-for="amp-audio">audio</script>\n' \
+                  '<script type="text/javascript" data-for="amp-accordion">accordion</script>\n'
+        self.assertEqual('<style>.a{color:red}</style>\n'
+                         '<script type="text/javascript" data-for="amp-audio amp-accordion">amp</script>\n'
+                         '<script type="text/javascript" data-for="amp-audio">audio</script>\n',
+                         prune_styling(styling, ['<p class="a">', '<amp-audio>']))
+        self.assertEqual('.card{font-size:20px}', prune_styling('.card {\n font-size: 20px;\n}\n.x { }', []))
@@ -1,3 +1,5 @@
+import os
+import tempfile
 import time
 from unittest import TestCase
 
@@ -12,6 +14,13 @@ class TestUtils(TestCase):
     def test_valid_path(self):
         pass
 
+    def test_write_if_changed(self):
+        with tempfile.TemporaryDirectory() as d:
+            file = os.path.join(d, 'styling.txt')
+            self.assertTrue(write_if_changed(file, '<style></style>'))
+            self.assertFalse(write_if_changed(file, '<style></style>'))
+            self.assertTrue(write_if_changed(file, b'<style>.a{}</style>'))
+
     def test_Log(self):
         Log.level = Log.INFO
         Log.d(TAG, 'debug log')
@@ -0,0 +1,95 @@
+import asyncio
+import csv
+import os
+import tempfile
+from unittest import TestCase
+
+from dict2anki.journal import Journal, CARD, row_digest
+from dict2anki.utils import Log, get_tag
+from dict2anki.writer import *
+
+TAG = get_tag(__name__)
+
+Log.level = Log.DEBUG
+
+
+class TestCardWriter(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, 'cards.txt')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read(self):
+        with open(self.file, encoding='utf8') as fp:
+            return list(csv.reader(fp))
+
+    def test_order(self):
+        async def write():
+            writer = CardWriter(self.file, flush_interval=0)
+            await writer.put(2, 'c', 'c', ['c', 'C'])
+            await writer.put(1, 'b')
+            self.assertEqual([], self.read())
+            await writer.put(0, 'a', 'a', ['a', 'A'])
+            # flushed as soon as ready
+            self.assertEqual([['a', 'A'], ['c', 'C']], self.read())
+            # duplicate of an earlier card
+            await writer.put(3, 'A', 'a', ['a', 'A'])
+            writer.close()
+            return writer.count
+
+        self.assertEqual(2, asyncio.run(write()))
+        self.assertEqual([['a', 'A'], ['c', 'C']], self.read())
+
+    def test_alias(self):
+        async def write():
+            writer = CardWriter(self.file, flush_interval=0)
+            await writer.put(1, 'b', 'a')
+            await writer.put(0, 'a', 'a', ['a', 'A'])
+            writer.close()
+            return writer.count
+
+        # looked up once, written once
+        self.assertEqual(1, asyncio.run(write()))
+        self.assertEqual([['a', 'A']], self.read())
+
+    def test_window(self):
+        async def write():
+            writer = CardWriter(self.file, window=2)
+            await writer.reserve(1)
+            reserve = asyncio.ensure_future(writer.reserve(2))
+            await asyncio.sleep(0.01)
+            self.assertFalse(reserve.done())
+            await writer.put(0, 'a', 'a', ['a', 'A'])
+            await asyncio.wait_for(reserve, 1)
+            writer.close()
+
+        asyncio.run(write())
+
+    def test_recover(self):
+        journal = os.path.join(self.dir.name, 'cards.journal')
+
+        async def write():
+            writer = CardWriter(self.file, Journal(journal), flush_interval=0)
+            await writer.put(0, 'a', 'a', ['a', 'A'])
+            writer.close()
+
+        asyncio.run(write())
+        # a card not in the journal, and a partial one inside a quoted field
+        with open(self.file, 'a', encoding='utf8', newline='') as fp:
+            fp.write('b,B\r\nc,"multi\r\n')
+        orphans = recover(self.file, journal)
+        self.assertEqual({row_digest(['b', 'B'])}, orphans)
+        self.assertEqual([['a', 'A'], ['b', 'B']], self.read())
+
+        async def resume():
+            writer = CardWriter(self.file, Journal(journal), Journal.done(journal), orphans=orphans)
+            await writer.put(0, 'b', 'b', ['b', 'B'])
+            await writer.put(1, 'c', 'c', ['c', 'multi\nline'])
+            writer.close()
+
+        asyncio.run(resume())
+        self.assertEqual([['a', 'A'], ['b', 'B'], ['c', 'multi\nline']], self.read())
+        self.assertEqual(['a', 'b', 'c'], [word for status, word, _, _ in Journal.entries(journal)
+                                           if status == CARD])